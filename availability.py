@@ -0,0 +1,288 @@
+import bisect
+import datetime
+import os
+import re
+import threading
+
+import timestamps
+
+# Appointments only store a start time; each one is taken to last this long.
+APPOINTMENT_MINUTES = int(os.environ.get('APPOINTMENT_MINUTES', 30))
+
+_DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+_DAY_GROUPS = {
+    'daily': range(7), 'everyday': range(7), 'weekdays': range(5), 'weekends': range(5, 7),
+}
+_TIME = r'(\d{1,2})(?:[:.](\d{2}))?\s*([ap]\.?m\.?)?'
+_TIME_RANGE_RE = re.compile(_TIME + r'\s*(?:-|–|to)\s*' + _TIME, re.IGNORECASE)
+_WORD_RE = re.compile(r'[a-z]+(?:\s*-\s*[a-z]+)?', re.IGNORECASE)
+
+
+class AppointmentConflict(Exception):
+    """Raised when a booking overlaps another appointment or falls outside the doctor's schedule."""
+
+    def __init__(self, message, conflicts=()):
+        super().__init__(message)
+        self.conflicts = list(conflicts)
+
+
+def _day_index(word):
+    word = word.lower()
+    for index, day in enumerate(_DAYS):
+        if word.startswith(day):
+            return index
+    return None
+
+
+def _parse_days(text):
+    """'Mon, Wed, Fri' / 'Mon-Fri' / 'Weekdays' -> set of weekday numbers (Monday is 0)."""
+    days = set()
+    for match in _WORD_RE.finditer(text):
+        word = match.group(0).lower()
+        if word in _DAY_GROUPS:
+            days.update(_DAY_GROUPS[word])
+        elif '-' in word:
+            first, last = (_day_index(part.strip()) for part in word.split('-'))
+            if first is not None and last is not None:
+                days.update((first + offset) % 7 for offset in range((last - first) % 7 + 1))
+        elif _day_index(word) is not None:
+            days.add(_day_index(word))
+    return days
+
+
+def _minutes(hour, minute, meridiem):
+    hour = int(hour) % 12 if meridiem else int(hour)
+    if meridiem and meridiem.lower().startswith('p'):
+        hour += 12
+    return hour * 60 + int(minute or 0)
+
+
+def parse_schedule(schedule):
+    """
+    Reads a free-text schedule such as 'Mon, Wed, Fri 9AM-5PM' or
+    'Mon-Fri 09:00-13:00, 14:00-17:00; Sat 10am-12pm' into
+    {weekday: [(start minute, end minute), ...]}. Segments are separated by
+    ';' or new lines; a segment without days applies to every day. Returns
+    None if no working hours could be read, meaning "unknown".
+    """
+    if not isinstance(schedule, str):
+        return None
+    hours = {}
+    for segment in re.split(r'[;\n]', schedule):
+        ranges = list(_TIME_RANGE_RE.finditer(segment))
+        if not ranges:
+            continue
+        days = _parse_days(segment[:ranges[0].start()]) or set(range(7))
+        for match in ranges:
+            start_hour, start_minute, start_meridiem, end_hour, end_minute, end_meridiem = match.groups()
+            if start_meridiem is None and end_meridiem is not None:
+                # '9-5pm': the start shares the end's meridiem unless that puts it after the end.
+                start_meridiem = end_meridiem
+                if _minutes(start_hour, start_minute, start_meridiem) >= _minutes(end_hour, end_minute, end_meridiem):
+                    start_meridiem = 'am'
+            start = _minutes(start_hour, start_minute, start_meridiem)
+            end = _minutes(end_hour, end_minute, end_meridiem)
+            if end <= start and end_meridiem is None and end < 12 * 60:
+                # '9-5' means nine to five.
+                end += 12 * 60
+            if not 0 <= start < end <= 24 * 60:
+                continue
+            for day in days:
+                hours.setdefault(day, []).append((start, end))
+    for intervals in hours.values():
+        intervals.sort()
+    return hours or None
+
+
+def check_booking(start, duration, overlapping, hours):
+    """
+    Raises AppointmentConflict if a booking at `start` overlaps any of the
+    appointments `overlapping` or falls outside the working `hours` (as read
+    by parse_schedule; None means unknown, so any time is accepted).
+    """
+    if overlapping:
+        raise AppointmentConflict("The doctor already has an appointment at this time.", overlapping)
+    if hours is not None:
+        minute = start.hour * 60 + start.minute
+        end = minute + duration.total_seconds() / 60
+        if not any(begin <= minute and end <= finish for begin, finish in hours.get(start.weekday(), [])):
+            raise AppointmentConflict("The time is outside the doctor's schedule.")
+
+
+def _format_minute(date, minute):
+    return (datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(minutes=minute)).strftime(
+        timestamps.DATETIME_FORMAT)
+
+
+class _Bookings:
+    """Every doctor's appointments as a sorted list of (start, appointment ID)."""
+
+    def __init__(self):
+        self.appointments = {}
+        self.by_doctor = {}
+        self.schedules = {}
+
+    def remove_appointment(self, doc_id):
+        old = self.appointments.pop(doc_id, None)
+        if old is None:
+            return
+        doctor, start, _ = old
+        slots = self.by_doctor.get(doctor)
+        position = bisect.bisect_left(slots, (start, doc_id))
+        if position < len(slots) and slots[position] == (start, doc_id):
+            del slots[position]
+        if not slots:
+            del self.by_doctor[doctor]
+
+    def add_appointment(self, doc_id, doc):
+        self.remove_appointment(doc_id)
+        try:
+            start = timestamps.parse_datetime(doc.get('datetime'))
+        except ValueError:
+            # Not a usable time (e.g. not migrated yet); it can't take up a slot.
+            return
+        doctor = doc.get('doctor')
+        self.appointments[doc_id] = (doctor, start, dict(doc, id=doc_id))
+        bisect.insort(self.by_doctor.setdefault(doctor, []), (start, doc_id))
+
+    def apply(self, collection, doc_id, doc):
+        if collection == 'appointments':
+            if doc is None:
+                self.remove_appointment(doc_id)
+            else:
+                self.add_appointment(doc_id, doc)
+        elif collection == 'doctors':
+            if doc is None:
+                self.schedules.pop(doc_id, None)
+            else:
+                self.schedules[doc_id] = parse_schedule(doc.get('schedule'))
+
+    def between(self, doctor, start, end):
+        """Appointments of a doctor starting in [start, end), in time order."""
+        slots = self.by_doctor.get(doctor, [])
+        low = bisect.bisect_left(slots, (start, ''))
+        high = bisect.bisect_left(slots, (end, ''))
+        return [self.appointments[doc_id][2] for _, doc_id in slots[low:high]]
+
+
+class AvailabilityIndex:
+    """
+    Per-doctor interval index over appointments and working hours. Each
+    doctor's appointments are kept sorted by start time, so a conflict check
+    or a day's bookings is a bisect plus a short slice. Filled once by build()
+    and then kept current by apply(), which firebase_service calls from its
+    write paths and, in replica mode, for every change its listeners report.
+    """
+
+    def __init__(self, appointment_minutes=APPOINTMENT_MINUTES):
+        self.duration = datetime.timedelta(minutes=appointment_minutes)
+        self._lock = threading.RLock()
+        self._live = _Bookings()
+        self._next = None
+        self._touched = set()
+        self._ready = threading.Event()
+        self._booking_locks = {}
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def apply(self, collection, doc_id, doc):
+        """Applies one write: the document's new contents, or None once deleted."""
+        if collection not in ('appointments', 'doctors'):
+            return
+        with self._lock:
+            targets = [self._live]
+            if self._next is not None:
+                self._touched.add((collection, doc_id))
+                targets.append(self._next)
+            for bookings in targets:
+                bookings.apply(collection, doc_id, doc)
+
+    def build(self, load):
+        """Rebuilds the index from `load(collection)`; the old one is served until it is done."""
+        with self._lock:
+            self._next = _Bookings()
+            self._touched = set()
+        try:
+            for collection in ('doctors', 'appointments'):
+                for doc in load(collection):
+                    with self._lock:
+                        if (collection, doc['id']) not in self._touched:
+                            self._next.apply(collection, doc['id'], doc)
+            with self._lock:
+                self._live = self._next
+            self._ready.set()
+        finally:
+            with self._lock:
+                self._next = None
+                self._touched = set()
+
+    def booking_lock(self, doctor_id):
+        """
+        Serializes check-then-write for one doctor's bookings within this
+        process; only enough on its own when no other process books.
+        """
+        with self._lock:
+            return self._booking_locks.setdefault(doctor_id, threading.Lock())
+
+    def conflicts(self, doctor_id, start, exclude_id=None):
+        """Appointments of the doctor that overlap one starting at `start`."""
+        start = timestamps.parse_datetime(start)
+        with self._lock:
+            # Fixed-length appointments overlap exactly when their starts are
+            # less than one duration apart.
+            overlapping = self._live.between(doctor_id, start - self.duration + datetime.timedelta(seconds=1),
+                                             start + self.duration)
+        return [doc for doc in overlapping if doc['id'] != exclude_id]
+
+    def check(self, doctor_id, start, exclude_id=None):
+        """Raises AppointmentConflict unless the doctor can take an appointment at `start`."""
+        start = timestamps.parse_datetime(start)
+        overlapping = self.conflicts(doctor_id, start, exclude_id)
+        with self._lock:
+            hours = self._live.schedules.get(doctor_id)
+        check_booking(start, self.duration, overlapping, hours)
+
+    def day(self, doctor_id, date):
+        """A doctor's working hours, bookings and free intervals on one date."""
+        day_start = datetime.datetime.combine(date, datetime.time())
+        with self._lock:
+            hours = self._live.schedules.get(doctor_id)
+            booked = self._live.between(doctor_id, day_start, day_start + datetime.timedelta(days=1))
+        working = hours.get(date.weekday(), []) if hours is not None else [(0, 24 * 60)]
+        duration = int(self.duration.total_seconds() // 60)
+        taken = []
+        for doc in booked:
+            start = timestamps.parse_datetime(doc['datetime'])
+            minute = start.hour * 60 + start.minute
+            taken.append((minute, minute + duration))
+
+        free = []
+        for begin, finish in working:
+            cursor = begin
+            for start, end in taken:
+                if end <= cursor or start >= finish:
+                    continue
+                if start > cursor:
+                    free.append((cursor, start))
+                cursor = max(cursor, end)
+            if cursor < finish:
+                free.append((cursor, finish))
+
+        def intervals(pairs):
+            return [{'start': _format_minute(date, start), 'end': _format_minute(date, end)} for start, end in pairs]
+
+        return {
+            'doctor': doctor_id,
+            'date': date.isoformat(),
+            'appointment_minutes': duration,
+            # None when the doctor's schedule couldn't be read; the whole day then counts.
+            'working_hours': intervals(working) if hours is not None else None,
+            'booked': [dict(doc, end=_format_minute(date, end)) for doc, (_, end) in zip(booked, taken)],
+            'free': intervals(free),
+        }
+
+
+# The process-wide index used by firebase_service and web_app.
+index = AvailabilityIndex()
@@ -0,0 +1,178 @@
+"""
+Backfill of the MySQL mirror from Firestore.
+
+Every collection is split into the ID ranges of firebase_service.id_ranges()
+and each range is paged through by its own worker, BACKFILL_PAGE_SIZE
+documents per Firestore query. Each page is upserted with one executemany
+INSERT ... ON DUPLICATE KEY UPDATE. After every page the range's last ID is
+written to a checkpoint file, so an interrupted backfill resumes where it
+stopped instead of starting over.
+
+Rows that no longer exist in Firestore are not deleted, and a write the app
+mirrors while a range is being copied can be overwritten by the older copy;
+run `manage.py check-consistency --repair` afterwards (or pass --verify).
+Collections copied without errors stop being degraded (see
+mysql_mirror.mark_degraded) unless a mirror write failed after the backfill
+started.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import firebase_service
+import mysql_mirror
+import mysql_service
+import timestamps
+
+BACKFILL_PAGE_SIZE = int(os.environ.get('BACKFILL_PAGE_SIZE', 500))
+# Each worker holds a pooled MySQL connection while it upserts a page.
+DEFAULT_WORKERS = mysql_service.POOL_CONFIG['size']
+DEFAULT_CHECKPOINT = 'backfill_checkpoint.json'
+
+
+class _Checkpoint:
+    """
+    Progress of every range, {collection: {range: last copied ID, or True once
+    done}}, rewritten to `path` (atomically) after each page. No path keeps it
+    in memory only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def position(self, name, key):
+        with self._lock:
+            return self.state.get(name, {}).get(key)
+
+    def save(self, name, key, position):
+        with self._lock:
+            self.state.setdefault(name, {})[key] = position
+            if self.path:
+                temporary = self.path + '.tmp'
+                with open(temporary, 'w') as f:
+                    json.dump(self.state, f)
+                os.replace(temporary, self.path)
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _Progress:
+    """Rows copied per collection, for the rows-per-second report."""
+
+    def __init__(self, names):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.rows = {name: 0 for name in names}
+
+    def add(self, name, count):
+        with self._lock:
+            self.rows[name] += count
+
+    def report(self):
+        with self._lock:
+            rows = dict(self.rows)
+        elapsed = time.monotonic() - self.started
+        total = sum(rows.values())
+        return {
+            'rows': rows,
+            'total_rows': total,
+            'elapsed_seconds': round(elapsed, 1),
+            'rows_per_second': round(total / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+
+def _range_key(start, end):
+    return f"{start or ''}..{end or ''}"
+
+
+def _row(name, doc):
+    """A Firestore document as a mirror row (a list in TABLE_COLUMNS order)."""
+    row = [doc['id']]
+    for field in firebase_service.DOCUMENT_FIELDS[name]:
+        value = doc.get(field)
+        if field == 'datetime':
+            try:
+                value = timestamps.normalize_datetime(value)
+            except ValueError:
+                # Not a time MySQL can store (see migrate-appointments).
+                value = None
+        row.append(value)
+    return row
+
+
+def _copy_range(name, start, end, checkpoint, progress, page_size):
+    """Copies one ID range page by page, starting after its checkpointed position."""
+    key = _range_key(start, end)
+    after = checkpoint.position(name, key)
+    if after is True:
+        return
+    while True:
+        docs = list(firebase_service.iter_id_range(name, start, end, after=after, limit=page_size))
+        if docs:
+            mysql_service.upsert_rows_mysql(name, [_row(name, doc) for doc in docs])
+            progress.add(name, len(docs))
+            after = docs[-1]['id']
+        if len(docs) < page_size:
+            checkpoint.save(name, key, True)
+            return
+        checkpoint.save(name, key, after)
+
+
+def backfill(collections=firebase_service.COLLECTIONS, workers=DEFAULT_WORKERS, checkpoint_path=DEFAULT_CHECKPOINT,
+             page_size=BACKFILL_PAGE_SIZE, restart=False, on_progress=None, report_interval=5.0):
+    """
+    Copies `collections` from Firestore into the MySQL mirror, resuming from
+    the checkpoint file unless `restart`. `on_progress(report)` is called every
+    `report_interval` seconds while it runs. Returns the final report; its
+    `errors` lists the ranges that failed, and the checkpoint is kept so that
+    running it again retries just those. The checkpoint is removed once
+    everything has been copied.
+    """
+    for name in collections:
+        if name not in firebase_service.COLLECTIONS:
+            raise ValueError(f"Unknown collection: {name}")
+    if firebase_service.init() is None:
+        raise ConnectionError("Firestore is not initialized.")
+    # Runs the DDL even if a schema check has passed, since tables may have been dropped to backfill from scratch.
+    if not mysql_service.ensure_schema(force=True):
+        raise ConnectionError("MySQL is not initialized.")
+
+    started_at = time.time()
+    checkpoint = _Checkpoint(checkpoint_path)
+    if restart:
+        checkpoint.remove()
+        checkpoint.state = {}
+    progress = _Progress(collections)
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backfill') as pool:
+        futures = {
+            pool.submit(_copy_range, name, start, end, checkpoint, progress, page_size): (name, start, end)
+            for name in collections
+            for start, end in firebase_service.id_ranges()
+        }
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=report_interval)
+            if on_progress is not None and pending:
+                on_progress(progress.report())
+
+    for future, (name, start, end) in futures.items():
+        if future.exception() is not None:
+            print(f"Error backfilling {name} [{_range_key(start, end)}]: {future.exception()}")
+            errors.append({'collection': name, 'range': _range_key(start, end), 'error': str(future.exception())})
+    if not errors:
+        checkpoint.remove()
+    failed = {error['collection'] for error in errors}
+    mysql_mirror.clear_degraded([name for name in collections if name not in failed], started_at)
+    report = progress.report()
+    report['errors'] = errors
+    return report
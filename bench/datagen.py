@@ -0,0 +1,178 @@
+"""
+Synthetic clinic data for benchmarks.
+
+    python -m bench.datagen --scale 100000 [--seed N] [--skip-mysql] [--force]
+
+generate() yields documents one at a time, so it scales to millions; only the
+IDs that later documents refer to are kept in memory. load() writes them with
+Firestore batches and mirrors them with executemany upserts. As a command it
+loads into whatever firebase_service is configured with, so it refuses to run
+unless FIRESTORE_EMULATOR_HOST is set or --force is given.
+"""
+import argparse
+import datetime
+import os
+import random
+import string
+import sys
+import time
+
+FIRST_NAMES = ('Aarav', 'Aditi', 'Arjun', 'Diya', 'Ishaan', 'Kavya', 'Meera', 'Nikhil', 'Priya', 'Rahul',
+               'Riya', 'Rohan', 'Sara', 'Tanvi', 'Vikram', 'Zoya', 'James', 'Maria', 'Chen', 'Fatima')
+LAST_NAMES = ('Sharma', 'Patel', 'Gupta', 'Rathi', 'Iyer', 'Khan', 'Singh', 'Reddy', 'Das', 'Mehta',
+              'Smith', 'Garcia', 'Wang', 'Ali', 'Nair', 'Joshi')
+SPECIALTIES = ('General Practice', 'Cardiology', 'Dermatology', 'Pediatrics', 'Orthopedics', 'Neurology',
+               'Gynecology', 'ENT', 'Ophthalmology', 'Psychiatry')
+SCHEDULES = ('Mon-Fri 09:00-17:00', 'Mon, Wed, Fri 9AM-5PM', 'Tue, Thu 10:00-18:00; Sat 10am-2pm',
+             'Daily 08:00-20:00')
+CONDITIONS = ('Hypertension', 'Type 2 diabetes', 'Asthma', 'Migraine', 'Allergic rhinitis', 'None',
+              'Hypothyroidism', 'Back pain')
+MEDICINES = ('Paracetamol 500mg', 'Amoxicillin 250mg', 'Ibuprofen 400mg', 'Cetirizine 10mg', 'Metformin 500mg',
+             'Omeprazole 20mg', 'Atorvastatin 10mg', 'Salbutamol inhaler', 'Bandage roll', 'Syringe 5ml')
+SUPPLIERS = ('MedSupply Co', 'HealthCorp', 'PharmaDirect', 'CareWholesale')
+
+_ID_ALPHABET = string.ascii_letters + string.digits
+# Firestore batches hold at most 500 writes.
+BATCH_SIZE = 500
+
+
+def scaled_counts(scale):
+    """Collection sizes for `scale` patients, in roughly a clinic's proportions."""
+    return {
+        'patients': scale,
+        'doctors': max(5, scale // 1000),
+        'inventory': max(20, scale // 100),
+        'appointments': scale * 2,
+        'billing': scale,
+    }
+
+
+def _id(rng):
+    return ''.join(rng.choices(_ID_ALPHABET, k=20))
+
+
+def generate(counts, seed=1):
+    """
+    Yields (collection, id, document) for `counts` ({collection: size}).
+    Doctors and inventory come first, then patients, then the appointments
+    and bills that refer to them.
+    """
+    rng = random.Random(seed)
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time(8))
+
+    doctors = []
+    for _ in range(counts.get('doctors', 0)):
+        doc_id = _id(rng)
+        doctors.append(doc_id)
+        yield 'doctors', doc_id, {
+            'name': f"Dr. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'specialty': rng.choice(SPECIALTIES),
+            'schedule': rng.choice(SCHEDULES),
+            'fee': rng.choice((300, 500, 750, 1000, 1500)),
+        }
+
+    inventory = []
+    for index in range(counts.get('inventory', 0)):
+        doc_id = _id(rng)
+        item = {
+            'item': f"{MEDICINES[index % len(MEDICINES)]} #{index}",
+            'quantity': rng.randint(50, 5000),
+            'supplier': rng.choice(SUPPLIERS),
+            'price': round(rng.uniform(5, 500), 2),
+        }
+        inventory.append((doc_id, item['item'], item['price']))
+        yield 'inventory', doc_id, item
+
+    patients = []
+    for _ in range(counts.get('patients', 0)):
+        doc_id = _id(rng)
+        patients.append(doc_id)
+        yield 'patients', doc_id, {
+            'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'contact': f"9{rng.randint(100000000, 999999999)}",
+            'history': rng.choice(CONDITIONS),
+            'dob': (datetime.date(1940, 1, 1) + datetime.timedelta(days=rng.randint(0, 30000))).isoformat(),
+            'gender': rng.choice(('Male', 'Female', 'Other')),
+        }
+
+    for _ in range(counts.get('appointments', 0) if patients and doctors else 0):
+        # Half-hour slots within a year either side of today.
+        start = today + datetime.timedelta(days=rng.randint(-365, 365), minutes=30 * rng.randint(0, 19))
+        yield 'appointments', _id(rng), {
+            'patient': rng.choice(patients),
+            'doctor': rng.choice(doctors),
+            'datetime': start.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    for _ in range(counts.get('billing', 0) if patients else 0):
+        items = [{'id': 'consult_fee', 'name': 'Consultation', 'price': 500, 'quantity': 1, 'isConsultation': True}]
+        for item_id, name, price in rng.sample(inventory, min(len(inventory), rng.randint(0, 3))):
+            items.append({'id': item_id, 'name': name, 'price': price, 'quantity': rng.randint(1, 3)})
+        yield 'billing', _id(rng), {
+            'patient': rng.choice(patients),
+            'items': items,
+            'total': round(sum(item['price'] * item['quantity'] for item in items), 2),
+            'status': rng.choice(('Pending', 'Paid', 'Paid')),
+        }
+
+
+def load(counts, seed=1, mirror=True, progress=None):
+    """
+    Writes generate(counts, seed) to Firestore in batches of BATCH_SIZE and,
+    with `mirror`, upserts each batch into MySQL. Goes around the app's write
+    paths, so in-process indexes are built when the app starts afterwards.
+    Returns {collection: documents written}.
+    """
+    import firebase_service
+    import mysql_service
+
+    written = {}
+    pending = []
+
+    def flush():
+        batch = firebase_service.get_db().batch()
+        for name, doc_id, doc in pending:
+            batch.set(firebase_service.get_collection(name).document(doc_id), doc)
+        batch.commit()
+        if mirror:
+            rows = {}
+            for name, doc_id, doc in pending:
+                fields = firebase_service.DOCUMENT_FIELDS[name]
+                rows.setdefault(name, []).append([doc_id] + [doc.get(field) for field in fields])
+            for name, table_rows in rows.items():
+                mysql_service.upsert_rows_mysql(name, table_rows)
+        for name, _, _ in pending:
+            written[name] = written.get(name, 0) + 1
+        pending.clear()
+        if progress is not None:
+            progress(written)
+
+    for entry in generate(counts, seed):
+        pending.append(entry)
+        if len(pending) >= BATCH_SIZE:
+            flush()
+    if pending:
+        flush()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=10000, help='number of patients; the rest scale with it')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-mysql', action='store_true', help="don't mirror the documents to MySQL")
+    parser.add_argument('--force', action='store_true', help='load even though no emulator is configured')
+    args = parser.parse_args(argv)
+    if not os.environ.get('FIRESTORE_EMULATOR_HOST') and not args.force:
+        print("Refusing to load synthetic data without FIRESTORE_EMULATOR_HOST; pass --force to load anyway.")
+        return 2
+    started = time.monotonic()
+    written = load(scaled_counts(args.scale), args.seed, not args.skip_mysql,
+                   progress=lambda counts: print(f"\r{sum(counts.values())} documents", end='', file=sys.stderr))
+    elapsed = time.monotonic() - started
+    print(f"\nLoaded {written} in {elapsed:.1f}s ({sum(written.values()) / max(elapsed, 1e-9):.0f} documents/s).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
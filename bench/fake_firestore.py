@@ -0,0 +1,615 @@
+"""
+In-memory stand-in for the parts of firebase_admin (and the Firestore client
+under it) that firebase_service uses, for benchmarks. install() registers it
+in sys.modules, so it has to run before firebase_service is imported.
+
+Queries don't scan whole collections: equality filters start from a per-field
+hash index and ordered or ranged queries walk a per-field sorted index, so a
+page costs about what it returns, as it does on Firestore. Transactions lock
+the documents they read until they commit, the way server-side Firestore
+transactions do, so paying bills that share inventory items contends.
+`store.latency` adds a fixed delay to every RPC to stand in for the network.
+"""
+import bisect
+import copy
+import json
+import os
+import random
+import string
+import sys
+import threading
+import time
+import types
+
+_ID_ALPHABET = string.ascii_letters + string.digits
+_DOCUMENT_ID = '__name__'
+# How long a transaction waits for a document another transaction holds.
+LOCK_TIMEOUT = 10.0
+
+
+class NotFound(Exception):
+    """Raised by update() of a document that doesn't exist."""
+
+
+class Aborted(Exception):
+    """Raised when a transaction times out waiting for a document lock."""
+
+
+def _sort_key(value):
+    """Firestore's cross-type order: null, booleans, numbers, strings, then everything else."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, json.dumps(value, sort_keys=True, default=str))
+
+
+def _hashable(value):
+    if isinstance(value, (list, dict)):
+        return ('json', json.dumps(value, sort_keys=True, default=str))
+    if isinstance(value, bool):
+        # Keep True apart from 1.
+        return ('bool', value)
+    return value
+
+
+def _copy(doc):
+    return {key: copy.deepcopy(value) if isinstance(value, (list, dict)) else value for key, value in doc.items()}
+
+
+def _compare(op, left, right):
+    if op == '==':
+        return left == right
+    if op == 'in':
+        return left in right
+    if left is None or _sort_key(left)[0] != _sort_key(right)[0]:
+        # Range filters only match values of the same type.
+        return False
+    if op == '<':
+        return left < right
+    if op == '<=':
+        return left <= right
+    if op == '>':
+        return left > right
+    if op == '>=':
+        return left >= right
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+class _Collection:
+    """
+    One collection's documents plus the indexes built over them on first use
+    (so loading millions of documents doesn't maintain any) and kept current
+    after that.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self._ids = None
+        self.equality = {}
+        self.ordered = {}
+
+    @property
+    def ids(self):
+        """Document IDs in order."""
+        if self._ids is None:
+            self._ids = sorted(self.docs)
+        return self._ids
+
+    def _index_add(self, doc_id, doc):
+        for field, index in self.equality.items():
+            if field in doc:
+                index.setdefault(_hashable(doc[field]), set()).add(doc_id)
+        for field, index in self.ordered.items():
+            if field in doc:
+                bisect.insort(index, (_sort_key(doc[field]), doc_id))
+
+    def _index_remove(self, doc_id, doc):
+        for field, index in self.equality.items():
+            if field in doc:
+                bucket = index.get(_hashable(doc[field]))
+                if bucket is not None:
+                    bucket.discard(doc_id)
+        for field, index in self.ordered.items():
+            if field in doc:
+                entry = (_sort_key(doc[field]), doc_id)
+                position = bisect.bisect_left(index, entry)
+                if position < len(index) and index[position] == entry:
+                    del index[position]
+
+    def put(self, doc_id, doc):
+        old = self.docs.get(doc_id)
+        if old is None:
+            if self._ids is not None:
+                bisect.insort(self._ids, doc_id)
+        else:
+            self._index_remove(doc_id, old)
+        self.docs[doc_id] = doc
+        self._index_add(doc_id, doc)
+
+    def remove(self, doc_id):
+        old = self.docs.pop(doc_id, None)
+        if old is None:
+            return
+        self._index_remove(doc_id, old)
+        if self._ids is not None:
+            del self._ids[bisect.bisect_left(self._ids, doc_id)]
+
+    def equality_index(self, field):
+        index = self.equality.get(field)
+        if index is None:
+            index = {}
+            for doc_id, doc in self.docs.items():
+                if field in doc:
+                    index.setdefault(_hashable(doc[field]), set()).add(doc_id)
+            self.equality[field] = index
+        return index
+
+    def ordered_index(self, field):
+        if field == _DOCUMENT_ID:
+            return None
+        index = self.ordered.get(field)
+        if index is None:
+            index = sorted((_sort_key(doc[field]), doc_id) for doc_id, doc in self.docs.items() if field in doc)
+            self.ordered[field] = index
+        return index
+
+
+class Store:
+    """Every collection, keyed by path, plus RPC counters and the document locks of transactions."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.collections = {}
+        self.rpcs = 0
+        self._document_locks = {}
+
+    def collection(self, path):
+        with self.lock:
+            return self.collections.setdefault(path, _Collection())
+
+    def rpc(self):
+        with self.lock:
+            self.rpcs += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def document_lock(self, path, doc_id):
+        with self.lock:
+            return self._document_locks.setdefault((path, doc_id), threading.Lock())
+
+    def clear(self):
+        with self.lock:
+            self.collections = {}
+            self.rpcs = 0
+
+
+store = Store()
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return _copy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data is not None else None
+
+
+class DocumentReference:
+    def __init__(self, path, doc_id):
+        self._path = path
+        self.id = doc_id
+        self.path = f"{path}/{doc_id}"
+
+    def _read(self):
+        with store.lock:
+            data = store.collection(self._path).docs.get(self.id)
+            return DocumentSnapshot(self, _copy(data) if data is not None else None)
+
+    def get(self, field_paths=None, transaction=None):
+        if transaction is not None:
+            transaction._lock([self])
+        store.rpc()
+        return self._read()
+
+    def _apply_set(self, data, merge=False):
+        collection = store.collection(self._path)
+        if merge and self.id in collection.docs:
+            data = dict(collection.docs[self.id], **data)
+        collection.put(self.id, _copy(data))
+
+    def _apply_update(self, data):
+        collection = store.collection(self._path)
+        if self.id not in collection.docs:
+            raise NotFound(f"No document to update: {self.path}")
+        collection.put(self.id, dict(collection.docs[self.id], **_copy(data)))
+
+    def _apply_delete(self):
+        store.collection(self._path).remove(self.id)
+
+    def set(self, document_data, merge=False):
+        store.rpc()
+        with store.lock:
+            self._apply_set(document_data, merge)
+
+    def update(self, field_updates):
+        store.rpc()
+        with store.lock:
+            self._apply_update(field_updates)
+
+    def delete(self):
+        store.rpc()
+        with store.lock:
+            self._apply_delete()
+
+
+class AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class AggregationQuery:
+    def __init__(self, query):
+        self._query = query
+        self._aggregations = []
+
+    def count(self, alias=None):
+        self._aggregations.append(('count', None, alias or 'count'))
+        return self
+
+    def sum(self, field_ref, alias=None):
+        self._aggregations.append(('sum', field_ref, alias or 'sum'))
+        return self
+
+    def get(self, transaction=None):
+        store.rpc()
+        with store.lock:
+            docs = [doc for _, doc in self._query._run()]
+        results = []
+        for kind, field, alias in self._aggregations:
+            if kind == 'count':
+                value = len(docs)
+            else:
+                value = sum(doc[field] for doc in docs
+                            if isinstance(doc.get(field), (int, float)) and not isinstance(doc.get(field), bool))
+            results.append(AggregationResult(alias, value))
+        return [results]
+
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, path, filters=(), orders=(), limit=None, after=None, fields=None):
+        self._path = path
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._after = after
+        self._fields = fields
+
+    def _with(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit, after=self._after,
+                     fields=self._fields)
+        state.update(changes)
+        return Query(self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if isinstance(value, DocumentReference):
+            value = value.id
+        return self._with(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._with(orders=self._orders + [(field_path, direction == Query.DESCENDING)])
+
+    def limit(self, count):
+        return self._with(limit=count)
+
+    def start_after(self, document_fields):
+        if isinstance(document_fields, DocumentSnapshot):
+            document_fields = dict(document_fields.to_dict(), **{_DOCUMENT_ID: document_fields.id})
+        return self._with(after=dict(document_fields))
+
+    def select(self, field_paths):
+        return self._with(fields=list(field_paths))
+
+    def count(self, alias=None):
+        return AggregationQuery(self).count(alias)
+
+    def sum(self, field_ref, alias=None):
+        return AggregationQuery(self).sum(field_ref, alias)
+
+    def _value(self, doc_id, doc, field):
+        return doc_id if field == _DOCUMENT_ID else doc.get(field)
+
+    def _matches(self, doc_id, doc, filters):
+        for field, op, value in filters:
+            if field != _DOCUMENT_ID and field not in doc:
+                return False
+            if not _compare(op, self._value(doc_id, doc, field), value):
+                return False
+        return True
+
+    def _orders_with_name(self):
+        orders = list(self._orders)
+        range_fields = [field for field, op, _ in self._filters if op not in ('==', 'in')]
+        if not orders and range_fields:
+            orders = [(range_fields[0], False)]
+        if not orders or orders[-1][0] != _DOCUMENT_ID:
+            orders.append((_DOCUMENT_ID, orders[-1][1] if orders else False))
+        return orders
+
+    def _position(self, doc_id, doc, orders):
+        return tuple(_sort_key(self._value(doc_id, doc, field)) for field, _ in orders)
+
+    def _after_cursor(self, doc_id, doc, orders, cursor):
+        """Whether a document comes after the start_after position."""
+        for (field, descending), mine, theirs in zip(orders, self._position(doc_id, doc, orders), cursor):
+            if mine != theirs:
+                return mine < theirs if descending else mine > theirs
+        return False
+
+    def _run(self):
+        """Yields (id, document) in query order. Must be called with store.lock held."""
+        collection = store.collection(self._path)
+        orders = self._orders_with_name()
+        cursor = None
+        if self._after is not None:
+            cursor = tuple(_sort_key(self._after.get(field)) for field, _ in orders)
+        equalities = [(field, op, value) for field, op, value in self._filters
+                      if op in ('==', 'in') and field != _DOCUMENT_ID]
+
+        if equalities:
+            # Start from the smallest equality match and sort what's left.
+            candidate_sets = []
+            for field, op, value in equalities:
+                index = collection.equality_index(field)
+                if op == '==':
+                    candidate_sets.append(index.get(_hashable(value), set()))
+                else:
+                    candidate_sets.append(set().union(*(index.get(_hashable(item), set()) for item in value)))
+            candidates = min(candidate_sets, key=len)
+            matches = [(doc_id, collection.docs[doc_id]) for doc_id in candidates
+                       if self._matches(doc_id, collection.docs[doc_id], self._filters)]
+            for field, descending in reversed(orders):
+                matches.sort(key=lambda pair: _sort_key(self._value(pair[0], pair[1], field)), reverse=descending)
+            walk = iter(matches)
+        else:
+            walk = self._walk_index(collection, orders)
+
+        returned = 0
+        for doc_id, doc in walk:
+            if cursor is not None and not self._after_cursor(doc_id, doc, orders, cursor):
+                continue
+            if not self._matches(doc_id, doc, self._filters):
+                continue
+            yield doc_id, doc
+            returned += 1
+            if self._limit is not None and returned >= self._limit:
+                return
+
+    def _walk_index(self, collection, orders):
+        """Documents in `orders` order from the sorted index of the first order field."""
+        field, descending = orders[0]
+        if len(orders) > 2:
+            # Not used by firebase_service; sort the whole collection.
+            matches = list(collection.docs.items())
+            for order_field, order_descending in reversed(orders):
+                matches.sort(key=lambda pair: _sort_key(self._value(pair[0], pair[1], order_field)),
+                             reverse=order_descending)
+            yield from matches
+            return
+        index = collection.ordered_index(field)
+        keys = collection.ids if index is None else index
+
+        # Narrow the walk to the range filters on the ordered field and to the cursor.
+        low, high = 0, len(keys)
+        for filter_field, op, value in self._filters:
+            if filter_field != field or op in ('==', 'in'):
+                continue
+            if index is None:
+                first = last = value
+            else:
+                first, last = (_sort_key(value), ''), (_sort_key(value), '\U0010ffff')
+            if op == '>=':
+                low = max(low, bisect.bisect_left(keys, first))
+            elif op == '>':
+                low = max(low, bisect.bisect_right(keys, last))
+            elif op == '<':
+                high = min(high, bisect.bisect_left(keys, first))
+            elif op == '<=':
+                high = min(high, bisect.bisect_right(keys, last))
+        if self._after is not None:
+            after_id = self._after.get(_DOCUMENT_ID, '')
+            position = after_id if index is None else (_sort_key(self._after.get(field)), after_id)
+            if descending:
+                high = min(high, bisect.bisect_left(keys, position))
+            else:
+                low = max(low, bisect.bisect_right(keys, position))
+
+        positions = range(high - 1, low - 1, -1) if descending else range(low, high)
+        for position in positions:
+            entry = keys[position]
+            doc_id = entry if index is None else entry[1]
+            doc = collection.docs.get(doc_id)
+            if doc is not None:
+                yield doc_id, doc
+
+    def stream(self, transaction=None):
+        store.rpc()
+        with store.lock:
+            results = [(doc_id, _copy(doc)) for doc_id, doc in self._run()]
+        for doc_id, doc in results:
+            if self._fields is not None:
+                doc = {field: doc[field] for field in self._fields if field in doc}
+            yield DocumentSnapshot(DocumentReference(self._path, doc_id), doc)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction))
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("Listeners (replica mode) aren't supported by the in-memory Firestore.")
+
+
+class CollectionReference(Query):
+    def __init__(self, path):
+        super().__init__(path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = ''.join(random.choices(_ID_ALPHABET, k=20))
+        return DocumentReference(self._path, document_id)
+
+    def add(self, document_data):
+        reference = self.document()
+        reference.set(document_data)
+        return time.time(), reference
+
+
+class WriteBatch:
+    def __init__(self):
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, _copy(document_data), merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(('update', reference, _copy(field_updates), None))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, None))
+
+    def _apply(self):
+        with store.lock:
+            for kind, reference, data, _ in self._writes:
+                if kind == 'update' and reference.id not in store.collection(reference._path).docs:
+                    raise NotFound(f"No document to update: {reference.path}")
+            for kind, reference, data, merge in self._writes:
+                if kind == 'set':
+                    reference._apply_set(data, merge)
+                elif kind == 'update':
+                    reference._apply_update(data)
+                else:
+                    reference._apply_delete()
+
+    def commit(self):
+        store.rpc()
+        self._apply()
+        return []
+
+
+class Transaction(WriteBatch):
+    def __init__(self):
+        super().__init__()
+        self._held = []
+
+    def _lock(self, references):
+        # Sorted so two transactions reading the same documents can't deadlock.
+        for reference in sorted(references, key=lambda ref: ref.path):
+            lock = store.document_lock(reference._path, reference.id)
+            if lock in self._held:
+                continue
+            if not lock.acquire(timeout=LOCK_TIMEOUT):
+                raise Aborted(f"Timed out waiting for a lock on {reference.path}")
+            self._held.append(lock)
+
+    def _release(self):
+        for lock in self._held:
+            lock.release()
+        self._held = []
+
+    def get_all(self, references, field_paths=None):
+        references = list(references)
+        self._lock(references)
+        store.rpc()
+        return [reference._read() for reference in references]
+
+
+def transactional(to_wrap):
+    def run(transaction, *args, **kwargs):
+        try:
+            result = to_wrap(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+        finally:
+            transaction._release()
+    return run
+
+
+class Client:
+    def collection(self, *path):
+        return CollectionReference('/'.join(path))
+
+    def batch(self):
+        return WriteBatch()
+
+    def transaction(self, **kwargs):
+        return Transaction()
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        if transaction is not None:
+            transaction._lock(references)
+        store.rpc()
+        for reference in references:
+            yield reference._read()
+
+
+class FieldFilter:
+    def __init__(self, field_path, op_string, value=None):
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+
+class FieldPath:
+    @staticmethod
+    def document_id():
+        return _DOCUMENT_ID
+
+
+def install(latency=0.0):
+    """Registers the fake as firebase_admin, firebase_admin.credentials and firebase_admin.firestore."""
+    store.latency = latency
+    client = Client()
+    firestore = types.ModuleType('firebase_admin.firestore')
+    firestore.client = lambda app=None: client
+    firestore.transactional = transactional
+    firestore.Query = Query
+    firestore.FieldFilter = FieldFilter
+    firestore.FieldPath = FieldPath
+
+    credentials = types.ModuleType('firebase_admin.credentials')
+    credentials.Certificate = lambda certificate: certificate
+
+    def get_app(name=None):
+        raise ValueError(f"No app named {name}")
+
+    firebase_admin = types.ModuleType('firebase_admin')
+    firebase_admin.initialize_app = lambda credential=None, options=None, name=None: types.SimpleNamespace(name=name)
+    firebase_admin.get_app = get_app
+    firebase_admin.credentials = credentials
+    firebase_admin.firestore = firestore
+    sys.modules.update({
+        'firebase_admin': firebase_admin,
+        'firebase_admin.credentials': credentials,
+        'firebase_admin.firestore': firestore,
+    })
+    # firebase_service wants credentials from somewhere; any will do.
+    os.environ.setdefault('__firebase_config', '{}')
+    return store
@@ -0,0 +1,217 @@
+"""
+In-memory stand-in for mysql.connector, for benchmarks. install() registers
+it in sys.modules, so it has to run before mysql_service is imported.
+
+It understands the statements the mirror writes with (the upserts, updates
+and deletes of mysql_service, and the payment transaction) and the by-ID and
+whole-table reads. Other reads, such as the filtered and keyset-paged list
+queries, raise an error, so with READ_BACKEND set firebase_service falls back
+to Firestore; benchmark MySQL-served reads against a real server.
+`latency` adds a fixed delay to every statement.
+"""
+import re
+import sys
+import threading
+import time
+import types
+
+tables = {}
+latency = 0.0
+_lock = threading.RLock()
+
+_INSERT_RE = re.compile(r"^INSERT INTO (\w+) \(([^)]*)\) VALUES", re.IGNORECASE)
+_UPDATE_RE = re.compile(r"^UPDATE (\w+) SET (.+) WHERE id=%s$", re.IGNORECASE)
+_DELETE_RE = re.compile(r"^DELETE FROM (\w+) WHERE id(?:=%s| IN \(.*\))$", re.IGNORECASE)
+_SELECT_RE = re.compile(
+    r"^SELECT (.+?) FROM (\w+)(?: WHERE id(=%s| IN \(.*?\)))?(?: ORDER BY id(?: ASC)?)?(?: FOR UPDATE)?$",
+    re.IGNORECASE)
+_STOCK_RE = re.compile(r"^UPDATE inventory JOIN", re.IGNORECASE)
+_ASSIGNMENT_RE = re.compile(r"^(\w+)\s*=\s*(%s|'[^']*')$")
+
+
+class Error(Exception):
+    def __init__(self, msg=None, errno=None):
+        super().__init__(msg)
+        self.msg = msg
+        self.errno = errno
+
+
+class DatabaseError(Error):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+class DataError(DatabaseError):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    pass
+
+
+class InternalError(DatabaseError):
+    pass
+
+
+class Cursor:
+    def __init__(self, dictionary=False):
+        self.dictionary = dictionary
+        self.rowcount = 0
+        self._rows = []
+
+    def _result(self, rows):
+        self._rows = rows if self.dictionary else [tuple(row.values()) for row in rows]
+        self.rowcount = len(rows)
+
+    def execute(self, operation, params=()):
+        if latency:
+            time.sleep(latency)
+        query = ' '.join(operation.split())
+        params = list(params or ())
+        with _lock:
+            self._execute(query, params)
+
+    def _execute(self, query, params):
+        self._rows = []
+        self.rowcount = 0
+        upper = query.upper()
+        if upper.startswith(('CREATE ', 'ALTER ')):
+            return
+        if 'INFORMATION_SCHEMA' in upper:
+            # No indexes exist yet; creating them is a no-op anyway.
+            return
+
+        match = _INSERT_RE.match(query)
+        if match:
+            table = tables.setdefault(match.group(1), {})
+            columns = [column.strip() for column in match.group(2).split(',')]
+            row = dict(zip(columns, params))
+            existing = table.get(row['id'])
+            table[row['id']] = dict(existing, **row) if existing else row
+            self.rowcount = 1
+            return
+
+        if _STOCK_RE.match(query):
+            inventory = tables.setdefault('inventory', {})
+            for item_id, quantity in zip(params[0::2], params[1::2]):
+                if item_id in inventory:
+                    inventory[item_id]['quantity'] = quantity
+                    self.rowcount += 1
+            return
+
+        match = _UPDATE_RE.match(query)
+        if match:
+            row = tables.setdefault(match.group(1), {}).get(params[-1])
+            values = iter(params[:-1])
+            changes = {}
+            for assignment in match.group(2).split(','):
+                parsed = _ASSIGNMENT_RE.match(assignment.strip())
+                if parsed is None:
+                    raise ProgrammingError(f"Unsupported by the in-memory MySQL: {query}")
+                column, value = parsed.groups()
+                changes[column] = next(values) if value == '%s' else value.strip("'")
+            if row is not None:
+                row.update(changes)
+                self.rowcount = 1
+            return
+
+        match = _DELETE_RE.match(query)
+        if match:
+            table = tables.setdefault(match.group(1), {})
+            for doc_id in params:
+                if table.pop(doc_id, None) is not None:
+                    self.rowcount += 1
+            return
+
+        match = _SELECT_RE.match(query)
+        if match:
+            selected, name, condition = match.groups()
+            table = tables.setdefault(name, {})
+            if condition is None:
+                rows = [table[doc_id] for doc_id in sorted(table)]
+            else:
+                rows = [table[doc_id] for doc_id in sorted(set(params)) if doc_id in table]
+            if selected.upper() == 'COUNT(*) AS COUNT':
+                self._result([{'count': len(rows)}])
+                return
+            columns = [column.strip() for column in selected.split(',')]
+            self._result([{column: row.get(column) for column in columns} for row in rows])
+            return
+
+        raise ProgrammingError(f"Unsupported by the in-memory MySQL: {query}")
+
+    def executemany(self, operation, seq_params):
+        count = 0
+        for params in seq_params:
+            self.execute(operation, params)
+            count += self.rowcount
+        self.rowcount = count
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._rows = []
+
+
+class Connection:
+    in_transaction = False
+
+    def cursor(self, dictionary=False, buffered=None):
+        return Cursor(dictionary)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        # Statements apply immediately; a failed payment mirror isn't undone.
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def consume_results(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def connect(**config):
+    return Connection()
+
+
+def install(statement_latency=0.0):
+    """Registers the fake as mysql and mysql.connector."""
+    global latency
+    latency = statement_latency
+    connector = types.ModuleType('mysql.connector')
+    connector.connect = connect
+    connector.Error = Error
+    connector.errors = types.SimpleNamespace(
+        Error=Error, DatabaseError=DatabaseError, OperationalError=OperationalError, InterfaceError=InterfaceError,
+        ProgrammingError=ProgrammingError, DataError=DataError, IntegrityError=IntegrityError,
+        InternalError=InternalError)
+    mysql = types.ModuleType('mysql')
+    mysql.connector = connector
+    sys.modules.update({'mysql': mysql, 'mysql.connector': connector})
+    return tables
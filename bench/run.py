@@ -0,0 +1,417 @@
+"""
+Endpoint benchmarks for web_app.
+
+    python -m bench.run [--scale N] [--firestore fake|emulator] [--mysql fake|local]
+                        [--firestore-latency-ms MS] [--mysql-latency-ms MS] [--url URL]
+                        [--requests N] [--concurrency N] [--contention N] [--only REGEX]
+                        [--output FILE] [--baseline FILE]
+
+By default the app runs in this process on the in-memory Firestore and MySQL
+of bench/fake_firestore.py and bench/fake_mysql.py, loaded with --scale
+patients' worth of synthetic data (bench/datagen.py), behind a threaded
+Werkzeug server on a free port. `--firestore emulator` keeps the real client,
+so point FIRESTORE_EMULATOR_HOST at the emulator (firebase_service still
+needs credentials to start), and `--mysql local` uses the MySQL server in
+mysql_service.DB_CONFIG. `--url` benchmarks an app that is already running
+and loads nothing.
+
+Every scenario sends --requests requests from --concurrency client threads
+over keep-alive connections and records the throughput and p50/p95/p99
+latency. `pay-contended` pays bills that all take from the same few inventory
+items, from --contention threads at once. Results are written as JSON to
+bench/results/ (or --output); --baseline prints the change against an
+earlier results file.
+"""
+import argparse
+import datetime
+import http.client
+import itertools
+import json
+import math
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+COLLECTIONS = ('patients', 'doctors', 'appointments', 'billing', 'inventory')
+# Unpaged listings, bootstrap and exports are only benchmarked up to this many
+# documents in total; past it they measure JSON encoding of the whole database.
+FULL_LIST_MAX = 20000
+ORDER_FIELDS = {'patients': 'name', 'doctors': 'name', 'appointments': '-datetime', 'billing': '-total',
+                'inventory': 'item'}
+# Inventory items every contended payment takes from.
+HOT_ITEMS = 3
+
+
+class Client:
+    """One keep-alive HTTP connection, reopened when the server closes it."""
+
+    def __init__(self, base_url):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        """Returns (status, parsed JSON body or None)."""
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        # Bytes go out in the same packet as the headers.
+        payload = json.dumps(body).encode() if body is not None else None
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+                self.connection.connect()
+                # Without this, Nagle's algorithm and delayed ACKs add ~40ms to responses written in pieces.
+                self.connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                self.connection.request(method, path, payload, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+            if response.will_close:
+                self.close()
+            content_type = response.getheader('Content-Type', '')
+            return response.status, json.loads(data) if data and content_type.startswith('application/json') else None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Scenario:
+    """
+    One benchmarked request shape. `path` and `body` are values or functions
+    of the request's index, so writes can touch a different document each time.
+    """
+
+    def __init__(self, name, method, path, body=None, expect=(200,), concurrency=None, on_response=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.expect = expect
+        self.concurrency = concurrency
+        self.on_response = on_response
+
+    def build(self, index):
+        path = self.path(index) if callable(self.path) else self.path
+        body = self.body(index) if callable(self.body) else self.body
+        return path, body
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))]
+
+
+def run_scenario(base_url, scenario, requests, concurrency, warmup):
+    """Runs one scenario and returns its measurements."""
+    concurrency = scenario.concurrency or concurrency
+    indexes = itertools.count()
+    latencies = []
+    statuses = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        client = Client(base_url)
+        try:
+            while True:
+                index = next(indexes)
+                if index >= warmup + requests:
+                    return
+                path, body = scenario.build(index)
+                started = time.perf_counter()
+                try:
+                    status, data = client.request(scenario.method, path, body)
+                except Exception as e:
+                    status, data = 'failed', {'error': str(e)}
+                elapsed = time.perf_counter() - started
+                if scenario.on_response is not None and status in scenario.expect:
+                    scenario.on_response(index, data)
+                if index < warmup:
+                    continue
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[str(status)] = statuses.get(str(status), 0) + 1
+                    if status not in scenario.expect and len(errors) < 5:
+                        errors.append({'status': status, 'path': path, 'body': data})
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, name=f"bench-{i}") for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    unexpected = sum(count for status, count in statuses.items() if status not in map(str, scenario.expect))
+    to_ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'name': scenario.name,
+        'method': scenario.method,
+        'path': scenario.build(warmup)[0],
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        # Warm-up requests are included in the wall time, so this is a lower bound.
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        'latency_ms': {
+            'min': to_ms(latencies[0] if latencies else None),
+            'mean': to_ms(sum(latencies) / len(latencies) if latencies else None),
+            'p50': to_ms(percentile(latencies, 0.50)),
+            'p95': to_ms(percentile(latencies, 0.95)),
+            'p99': to_ms(percentile(latencies, 0.99)),
+            'max': to_ms(latencies[-1] if latencies else None),
+        },
+        'statuses': statuses,
+        'unexpected': unexpected,
+        'sample_errors': errors,
+    }
+
+
+# --- Setup ---
+def _sample(client, collection, count=200):
+    status, data = client.request('GET', f"/api/{collection}?limit={count}")
+    if status != 200:
+        raise RuntimeError(f"Could not list {collection}: {status} {data}")
+    return data['items']
+
+
+def _bulk_create(client, collection, documents):
+    ids = []
+    for start in range(0, len(documents), 500):
+        status, data = client.request('POST', f"/api/{collection}/bulk", {'create': documents[start:start + 500]})
+        if status != 200:
+            raise RuntimeError(f"Could not create {collection}: {status} {data}")
+        ids.extend(result['id'] for result in data['results'])
+    return ids
+
+
+def _unpaid_bills(client, items, count):
+    """Creates `count` pending bills over `items` ([(id, name)]) and returns their IDs."""
+    bill = lambda: {'patient': 'bench-patient', 'status': 'Pending', 'total': len(items),
+                    'items': [{'id': item_id, 'name': name, 'price': 1, 'quantity': 1} for item_id, name in items]}
+    return _bulk_create(client, 'billing', [bill() for _ in range(count)])
+
+
+def build_scenarios(client, args, total_documents):
+    """Every scenario, with the documents they need created through the API up front."""
+    samples = {name: _sample(client, name) for name in COLLECTIONS}
+    for name in ('patients', 'doctors'):
+        if not samples[name]:
+            raise RuntimeError(f"No {name} to benchmark with; load some data first.")
+    pick = lambda name, key='id': (lambda index: samples[name][index % len(samples[name])][key])
+    today = datetime.date.today()
+    scenarios = []
+
+    # Reads.
+    for name in COLLECTIONS:
+        scenarios.append(Scenario(f"list-{name}-page", 'GET', f"/api/{name}?limit=50"))
+        scenarios.append(Scenario(f"list-{name}-ordered", 'GET', f"/api/{name}?limit=50&order_by={ORDER_FIELDS[name]}"))
+        scenarios.append(Scenario(f"count-{name}", 'GET', f"/api/{name}/count"))
+        if total_documents <= FULL_LIST_MAX:
+            scenarios.append(Scenario(f"list-{name}-all", 'GET', f"/api/{name}"))
+            scenarios.append(Scenario(f"stream-{name}", 'GET', f"/api/{name}?stream=ndjson"))
+            scenarios.append(Scenario(f"export-{name}-csv", 'GET', f"/api/{name}/export?format=csv"))
+    if total_documents <= FULL_LIST_MAX:
+        scenarios.append(Scenario('bootstrap', 'GET', '/api/bootstrap'))
+    window = f"from={today - datetime.timedelta(days=30)}&to={today + datetime.timedelta(days=30)}"
+    scenarios += [
+        Scenario('appointments-by-doctor', 'GET',
+                 lambda i: f"/api/appointments?doctor={pick('doctors')(i)}&{window}&limit=50"),
+        Scenario('appointments-by-patient', 'GET', lambda i: f"/api/appointments?patient={pick('patients')(i)}"),
+        Scenario('appointments-expanded', 'GET', '/api/appointments?limit=50&expand=patient,doctor'),
+        Scenario('count-appointments-window', 'GET', f"/api/appointments/count?{window}"),
+        Scenario('search-patients', 'GET',
+                 lambda i: f"/api/search?type=patients&q={urllib.parse.quote(pick('patients', 'name')(i).split()[0])}"),
+        Scenario('dashboard', 'GET', '/api/dashboard'),
+        Scenario('patient-timeline', 'GET', lambda i: f"/api/patients/{pick('patients')(i)}/timeline"),
+        Scenario('doctor-availability', 'GET', lambda i: f"/api/doctors/{pick('doctors')(i)}/availability?date={today}"),
+    ]
+    for path in ('/api/cache/stats', '/api/mysql/pool/stats', '/api/mysql/mirror/stats', '/api/replica/status',
+                 '/api/reads/status'):
+        scenarios.append(Scenario('status' + path.replace('/api', '').replace('/', '-'), 'GET', path))
+
+    # Writes: create, then update and delete what was created.
+    documents = {
+        'patients': lambda i: {'name': f"Bench Patient {i}", 'contact': '9000000000', 'history': 'None',
+                               'dob': '1990-01-01', 'gender': 'Other'},
+        'doctors': lambda i: {'name': f"Dr. Bench {i}", 'specialty': 'General Practice',
+                              'schedule': 'Mon-Fri 09:00-17:00', 'fee': 500},
+        'billing': lambda i: {'patient': pick('patients')(i), 'status': 'Pending', 'total': 500,
+                              'items': [{'id': 'consult_fee', 'name': 'Consultation', 'price': 500, 'quantity': 1,
+                                         'isConsultation': True}]},
+        'inventory': lambda i: {'item': f"Bench item {i}", 'quantity': 100, 'supplier': 'Bench', 'price': 10},
+    }
+    # A doctor who works around the clock, so every half-hour slot is bookable.
+    bench_doctor = _bulk_create(client, 'doctors', [{'name': 'Dr. Benchmark', 'specialty': 'General Practice',
+                                                     'schedule': 'Daily 00:00-24:00', 'fee': 500}])[0]
+    first_slot = datetime.datetime.combine(today + datetime.timedelta(days=400), datetime.time())
+    slot = lambda i: (first_slot + datetime.timedelta(minutes=30 * i)).strftime('%Y-%m-%dT%H:%M:%S')
+    documents['appointments'] = lambda i: {'patient': pick('patients')(i), 'doctor': bench_doctor, 'datetime': slot(i)}
+    total = args.requests + args.warmup
+    for name in COLLECTIONS:
+        created = {}
+        scenarios.append(Scenario(f"create-{name}", 'POST', f"/api/{name}", documents[name], expect=(201,),
+                                  on_response=lambda index, data, created=created: created.__setitem__(index, data['id'])))
+        # Updates move appointments to slots no create used.
+        update_body = documents[name] if name != 'appointments' else (lambda i: dict(documents['appointments'](i + total)))
+        scenarios.append(Scenario(f"update-{name}", 'PUT', lambda i, name=name, created=created: f"/api/{name}/{created.get(i, 'missing')}",
+                                  update_body))
+        scenarios.append(Scenario(f"delete-{name}", 'DELETE', lambda i, name=name, created=created: f"/api/{name}/{created.get(i, 'missing')}"))
+    scenarios.append(Scenario('bulk-create-patients-100', 'POST', '/api/patients/bulk',
+                              lambda i: {'create': [documents['patients'](i * 100 + j) for j in range(100)]}))
+
+    # Payments: every bill with its own stock item, then all bills on the same few items.
+    stock = _bulk_create(client, 'inventory', [dict(documents['inventory'](i), quantity=10 ** 6) for i in range(total)])
+    own_bills = [_unpaid_bills(client, [(item_id, f"Bench item {i}")], 1)[0] for i, item_id in enumerate(stock)]
+    scenarios.append(Scenario('pay', 'POST', lambda i: f"/api/billing/pay/{own_bills[i]}"))
+    hot = _bulk_create(client, 'inventory', [dict(documents['inventory'](i), quantity=10 ** 9) for i in range(HOT_ITEMS)])
+    shared_bills = _unpaid_bills(client, [(item_id, f"Hot item {i}") for i, item_id in enumerate(hot)], total)
+    scenarios.append(Scenario('pay-contended', 'POST', lambda i: f"/api/billing/pay/{shared_bills[i]}",
+                              concurrency=args.contention))
+    return scenarios
+
+
+# --- In-process app ---
+def start_app(args):
+    """Installs the fakes, loads data, imports web_app and serves it; returns (base URL, documents loaded)."""
+    if args.firestore == 'fake':
+        from bench import fake_firestore
+        fake_firestore.install()
+    if args.mysql == 'fake':
+        from bench import fake_mysql
+        fake_mysql.install()
+
+    from bench import datagen
+    loaded = {}
+    if args.scale:
+        started = time.monotonic()
+        loaded = datagen.load(datagen.scaled_counts(args.scale), args.seed)
+        print(f"Loaded {sum(loaded.values())} documents in {time.monotonic() - started:.1f}s.", file=sys.stderr)
+    if args.firestore == 'fake':
+        fake_firestore.store.latency = args.firestore_latency_ms / 1000
+    if args.mysql == 'fake':
+        fake_mysql.latency = args.mysql_latency_ms / 1000
+
+    import firebase_service
+    import web_app
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    # Build the in-process indexes now, so the first measured requests don't
+    # (this also waits for the start-up warm-up if it is running).
+    started = time.monotonic()
+    firebase_service.build_search_index()
+    firebase_service.build_dashboard()
+    firebase_service.build_availability()
+    print(f"Warmed up in {time.monotonic() - started:.1f}s.", file=sys.stderr)
+
+    # Keep-alive, and no Nagle delay between the headers and the body of a response.
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    WSGIRequestHandler.disable_nagle_algorithm = True
+    server = make_server('127.0.0.1', 0, web_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", sum(loaded.values())
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {scenario['name']: scenario for scenario in json.load(f)['scenarios']}
+    change = lambda new, old: f"{(new - old) / old * 100:+.0f}%" if new is not None and old else 'n/a'
+    print(f"\nChange against {baseline_path}:")
+    print(f"{'scenario':34} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for scenario in results['scenarios']:
+        old = baseline.get(scenario['name'])
+        if old is None:
+            continue
+        latency, old_latency = scenario['latency_ms'], old['latency_ms']
+        print(f"{scenario['name']:34} {change(scenario['throughput_rps'], old['throughput_rps']):>8} "
+              + ' '.join(f"{change(latency[key], old_latency[key]):>8}" for key in ('p50', 'p95', 'p99')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=2000, help='synthetic patients to load (0 loads nothing)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--firestore', choices=('fake', 'emulator'), default='fake')
+    parser.add_argument('--mysql', choices=('fake', 'local'), default='fake')
+    parser.add_argument('--firestore-latency-ms', type=float, default=0.0, help='delay added to every fake RPC')
+    parser.add_argument('--mysql-latency-ms', type=float, default=0.0, help='delay added to every fake statement')
+    parser.add_argument('--url', help='benchmark this running app instead of starting one')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests before each scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--contention', type=int, default=16, help='concurrent payers in pay-contended')
+    parser.add_argument('--only', help='run only the scenarios whose name matches this regular expression '
+                             '(updates and deletes need their create, e.g. "patients$")')
+    parser.add_argument('--output', help='results file (default: bench/results/<time>.json)')
+    parser.add_argument('--baseline', help='earlier results file to compare with')
+    args = parser.parse_args(argv)
+
+    if args.url:
+        base_url, loaded = args.url.rstrip('/'), None
+    else:
+        base_url, loaded = start_app(args)
+    client = Client(base_url)
+    if loaded is None:
+        loaded = sum(client.request('GET', f"/api/{name}/count")[1]['count'] for name in COLLECTIONS)
+    scenarios = build_scenarios(client, args, loaded)
+    client.close()
+    # Scenarios run in order, so each update and delete finds what its create made.
+    if args.only:
+        scenarios = [scenario for scenario in scenarios if re.search(args.only, scenario.name)]
+    results = {
+        'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'documents': loaded,
+        'scenarios': [],
+    }
+    print(f"{'scenario':34} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'bad':>5}")
+    for scenario in scenarios:
+        result = run_scenario(base_url, scenario, args.requests, args.concurrency, args.warmup)
+        results['scenarios'].append(result)
+        latency = result['latency_ms']
+        print(f"{result['name']:34} {result['throughput_rps']:>8} {latency['p50']:>8} {latency['p95']:>8} "
+              f"{latency['p99']:>8} {result['unexpected']:>5}")
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.baseline:
+        _compare(results, args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""
+Firestore <-> MySQL consistency checking.
+
+Documents are grouped into chunks by the first few characters of their ID,
+and every chunk gets a content hash (the sum of its documents' hashes, so the
+order rows arrive in doesn't matter) on both sides. Firestore is read as one
+range query per leading character and MySQL as one streamed scan per table,
+all in parallel. Only chunks whose hashes differ are read again, document by
+document, to find what is missing or different; those documents are then
+re-read by ID so that writes landing mid-check aren't reported as drift.
+
+Firestore is the source of truth: the repair plan upserts MySQL rows from
+Firestore and deletes the rows Firestore doesn't have. A collection found
+consistent, or repaired, stops being degraded (see mysql_mirror.mark_degraded)
+unless a mirror write to it failed after the check started.
+"""
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import firebase_service
+import mysql_mirror
+import mysql_service
+import timestamps
+
+# Characters of an ID that make up its chunk key. Two characters split
+# Firestore's auto IDs into ~3,800 chunks per collection.
+DEFAULT_PREFIX_LENGTH = 2
+DEFAULT_WORKERS = 16
+
+_NUMERIC_COLUMNS = ('fee', 'total', 'price', 'quantity')
+_HASH_MODULUS = 2 ** 64
+
+
+def _canonical(table, column, value):
+    """A value as it reads back from its MySQL column, so equal documents hash equally on both sides."""
+    if value is None:
+        return None
+    if column == 'datetime':
+        try:
+            return timestamps.normalize_datetime(value)
+        except ValueError:
+            return str(value)
+    if column in _NUMERIC_COLUMNS:
+        try:
+            return round(float(value), 2)
+        except (TypeError, ValueError):
+            return str(value)
+    if column in mysql_service.JSON_COLUMNS.get(table, ()):
+        return json.dumps(value, sort_keys=True, default=str)
+    return str(value)
+
+
+def _canonical_document(table, doc):
+    return [_canonical(table, column, doc.get(column)) for column in mysql_service.TABLE_COLUMNS[table]]
+
+
+def _digest(table, doc):
+    encoded = json.dumps(_canonical_document(table, doc), separators=(',', ':'), default=str).encode()
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), 'big')
+
+
+def _summarize(table, docs, prefix_length):
+    """{chunk key: (documents, hash)} for a stream of documents."""
+    chunks = {}
+    for doc in docs:
+        key = doc['id'][:prefix_length]
+        count, total = chunks.get(key, (0, 0))
+        chunks[key] = (count + 1, (total + _digest(table, doc)) % _HASH_MODULUS)
+    return chunks
+
+
+def _next_prefix(prefix):
+    """The smallest string after every string that starts with `prefix`."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _chunk_of_firestore(name, key, prefix_length):
+    return [doc for doc in firebase_service.iter_id_range(name, key, _next_prefix(key)) if doc['id'][:prefix_length] == key]
+
+
+def _chunk_of_mysql(name, key, prefix_length):
+    return [doc for doc in mysql_service.iter_rows_mysql(name, id_prefix=key) if doc['id'][:prefix_length] == key]
+
+
+def _diff_fields(table, firestore_doc, mysql_doc):
+    return [
+        column for column, left, right in zip(
+            mysql_service.TABLE_COLUMNS[table],
+            _canonical_document(table, firestore_doc),
+            _canonical_document(table, mysql_doc))
+        if left != right
+    ]
+
+
+def _compare(table, firestore_docs, mysql_docs):
+    """Per-document differences between {id: document} maps of both sides."""
+    missing = sorted(doc_id for doc_id in firestore_docs if doc_id not in mysql_docs)
+    extra = sorted(doc_id for doc_id in mysql_docs if doc_id not in firestore_docs)
+    different = [
+        {'id': doc_id, 'fields': _diff_fields(table, firestore_docs[doc_id], mysql_docs[doc_id])}
+        for doc_id in sorted(firestore_docs)
+        if doc_id in mysql_docs and _digest(table, firestore_docs[doc_id]) != _digest(table, mysql_docs[doc_id])
+    ]
+    return missing, extra, different
+
+
+def _reread(name, ids):
+    """Reads documents straight from both stores by ID: ({id: doc}, {id: doc})."""
+    collection = firebase_service.get_collection(name)
+    firestore_docs = {}
+    for start in range(0, len(ids), mysql_service.IN_CHUNK_SIZE):
+        refs = [collection.document(doc_id) for doc_id in ids[start:start + mysql_service.IN_CHUNK_SIZE]]
+        for snapshot in firebase_service.get_db().get_all(refs):
+            if snapshot.exists:
+                firestore_docs[snapshot.id] = dict(snapshot.to_dict(), id=snapshot.id)
+    return firestore_docs, mysql_service.get_rows_mysql(name, ids)
+
+
+def check_consistency(collections=firebase_service.COLLECTIONS, prefix_length=DEFAULT_PREFIX_LENGTH,
+                      workers=DEFAULT_WORKERS, plan=False):
+    """
+    Compares the MySQL mirror with Firestore. Returns a report with, per
+    collection, the document counts on both sides, how many chunks differed,
+    and the IDs missing from MySQL, extra in MySQL or with different contents
+    (and which columns). With `plan`, the report also carries the repair plan
+    that apply_repair() takes.
+    """
+    for name in collections:
+        if name not in firebase_service.COLLECTIONS:
+            raise ValueError(f"Unknown collection: {name}")
+    if prefix_length < 1:
+        raise ValueError("prefix_length must be at least 1.")
+    if firebase_service.init() is None:
+        raise ConnectionError("Firestore is not initialized.")
+    if not mysql_service.ensure_schema():
+        raise ConnectionError("MySQL is not initialized.")
+
+    started = time.monotonic()
+    checked_at = time.time()
+    report = {'consistent': True, 'prefix_length': prefix_length, 'collections': {}}
+    repairs = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Pass 1: chunk hashes of both stores. Each MySQL table is one long
+        # scan, so those are queued first.
+        mysql_scans = {
+            name: pool.submit(_summarize, name, mysql_service.iter_rows_mysql(name), prefix_length)
+            for name in collections
+        }
+        firestore_scans = {
+            name: [pool.submit(_summarize, name, firebase_service.iter_id_range(name, start, end), prefix_length)
+                   for start, end in firebase_service.id_ranges()]
+            for name in collections
+        }
+        firestore_chunks = {}
+        for name, futures in firestore_scans.items():
+            firestore_chunks[name] = {}
+            for future in futures:
+                firestore_chunks[name].update(future.result())
+        mysql_chunks = {name: future.result() for name, future in mysql_scans.items()}
+
+        # Pass 2: read only the chunks that differ, on both sides.
+        drills = {}
+        for name in collections:
+            keys = sorted(set(firestore_chunks[name]) | set(mysql_chunks[name]))
+            mismatched = [key for key in keys if firestore_chunks[name].get(key) != mysql_chunks[name].get(key)]
+            drills[name] = [
+                (pool.submit(_chunk_of_firestore, name, key, prefix_length),
+                 pool.submit(_chunk_of_mysql, name, key, prefix_length))
+                for key in mismatched
+            ]
+            report['collections'][name] = {
+                'firestore_documents': sum(count for count, _ in firestore_chunks[name].values()),
+                'mysql_rows': sum(count for count, _ in mysql_chunks[name].values()),
+                'chunks': len(keys),
+                'mismatched_chunks': len(mismatched),
+            }
+
+        for name, futures in drills.items():
+            firestore_docs = {}
+            mysql_docs = {}
+            for firestore_future, mysql_future in futures:
+                firestore_docs.update((doc['id'], doc) for doc in firestore_future.result())
+                mysql_docs.update((doc['id'], doc) for doc in mysql_future.result())
+            missing, extra, different = _compare(name, firestore_docs, mysql_docs)
+            suspects = missing + extra + [entry['id'] for entry in different]
+            if suspects:
+                # Confirm against fresh reads; the scans weren't one snapshot.
+                firestore_docs, mysql_docs = _reread(name, suspects)
+                missing, extra, different = _compare(name, firestore_docs, mysql_docs)
+
+            result = report['collections'][name]
+            result.update(missing_in_mysql=missing, extra_in_mysql=extra, different=different)
+            if missing or extra or different:
+                report['consistent'] = False
+            else:
+                mysql_mirror.clear_degraded([name], checked_at)
+            if plan and (missing or extra or different):
+                upserts = [
+                    [doc_id] + [firestore_docs[doc_id].get(field) for field in firebase_service.DOCUMENT_FIELDS[name]]
+                    for doc_id in missing + [entry['id'] for entry in different]
+                ]
+                repairs.append({'table': name, 'upsert': upserts, 'delete': extra, 'checked_at': checked_at})
+
+    report['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    if plan:
+        report['repair_plan'] = repairs
+    return report
+
+
+def apply_repair(plan):
+    """
+    Applies a repair plan from check_consistency(plan=True) to MySQL. In
+    write-behind mode the writes are queued behind the mirror's pending ones,
+    so they can't be overtaken by older writes. Returns {table: {'upserted', 'deleted'}}.
+    """
+    applied = {}
+    for step in plan:
+        table = step['table']
+        for op, arg in (('upsert_rows_mysql', step.get('upsert')), ('delete_rows_mysql', step.get('delete'))):
+            if not arg:
+                continue
+            if mysql_mirror.enabled():
+                mysql_mirror.submit(op, table, arg)
+            else:
+                mysql_mirror.apply_now(op, table, arg)
+        if 'checked_at' in step:
+            mysql_mirror.clear_degraded([table], step['checked_at'])
+        applied[table] = {'upserted': len(step.get('upsert') or ()), 'deleted': len(step.get('delete') or ())}
+    return applied
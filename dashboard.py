@@ -0,0 +1,190 @@
+import bisect
+import threading
+
+# Inventory items at or below this quantity are reported as low on stock.
+LOW_STOCK_THRESHOLD = 10
+# Number of appointments listed under recent activity.
+RECENT_LIMIT = 5
+
+COUNTED_COLLECTIONS = ('patients', 'doctors', 'appointments', 'billing', 'inventory')
+
+
+def _number(value):
+    """
+    Reads a stored amount or quantity, or None if it isn't a number. Firestore
+    filters and sums skip such values (even numeric strings), and so must we,
+    or reconciliation would find drift that no rebuild can fix.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def _date_of(datetime_value):
+    """'2024-05-01T09:30' -> '2024-05-01'; appointments store local wall-clock times."""
+    return str(datetime_value)[:10] if datetime_value else None
+
+
+class _Aggregates:
+    """
+    The dashboard figures for one consistent set of documents. Each document's
+    contribution is remembered so that an update or delete can take it back
+    out before the new version is added.
+    """
+
+    def __init__(self):
+        self.ids = {name: set() for name in COUNTED_COLLECTIONS}
+        self.bills = {}
+        self.bill_counts = {}
+        self.revenue = 0.0
+        self.low_stock = {}
+        self.appointments = {}
+        self.by_date = {}
+        self.timeline = []
+
+    def remove(self, collection, doc_id):
+        self.ids[collection].discard(doc_id)
+        if collection == 'billing':
+            old = self.bills.pop(doc_id, None)
+            if old is not None:
+                status, total = old
+                self.bill_counts[status] -= 1
+                if status == 'Paid':
+                    self.revenue -= total
+        elif collection == 'inventory':
+            self.low_stock.pop(doc_id, None)
+        elif collection == 'appointments':
+            old = self.appointments.pop(doc_id, None)
+            if old is not None:
+                date = _date_of(old.get('datetime'))
+                bucket = self.by_date.get(date)
+                if bucket is not None:
+                    bucket.pop(doc_id, None)
+                    if not bucket:
+                        del self.by_date[date]
+                key = (str(old.get('datetime') or ''), doc_id)
+                position = bisect.bisect_left(self.timeline, key)
+                if position < len(self.timeline) and self.timeline[position] == key:
+                    del self.timeline[position]
+
+    def add(self, collection, doc_id, doc):
+        self.remove(collection, doc_id)
+        self.ids[collection].add(doc_id)
+        doc = dict(doc, id=doc_id)
+        if collection == 'billing':
+            status = doc.get('status')
+            total = _number(doc.get('total')) or 0
+            self.bills[doc_id] = (status, total)
+            self.bill_counts[status] = self.bill_counts.get(status, 0) + 1
+            if status == 'Paid':
+                self.revenue += total
+        elif collection == 'inventory':
+            quantity = _number(doc.get('quantity'))
+            if quantity is not None and quantity <= LOW_STOCK_THRESHOLD:
+                self.low_stock[doc_id] = doc
+        elif collection == 'appointments':
+            self.appointments[doc_id] = doc
+            date = _date_of(doc.get('datetime'))
+            if date:
+                self.by_date.setdefault(date, {})[doc_id] = doc
+            bisect.insort(self.timeline, (str(doc.get('datetime') or ''), doc_id))
+
+    def summary(self, date):
+        todays = sorted(self.by_date.get(date, {}).values(), key=lambda doc: (str(doc.get('datetime')), doc['id']))
+        recent = [self.appointments[doc_id] for _, doc_id in reversed(self.timeline[-RECENT_LIMIT:])]
+        low_stock = sorted(self.low_stock.values(), key=lambda doc: (_number(doc.get('quantity')), str(doc.get('item'))))
+        return {
+            'totals': {name: len(ids) for name, ids in self.ids.items()},
+            'bills_by_status': dict((status, count) for status, count in self.bill_counts.items() if count),
+            'pending_bills': self.bill_counts.get('Pending', 0),
+            'paid_bills': self.bill_counts.get('Paid', 0),
+            # Rounded so float drift from many increments doesn't show.
+            'revenue': round(self.revenue, 2),
+            'date': date,
+            'todays_appointments': [dict(doc) for doc in todays],
+            'recent_appointments': [dict(doc) for doc in recent],
+            'low_stock_threshold': LOW_STOCK_THRESHOLD,
+            'low_stock': [dict(doc) for doc in low_stock],
+        }
+
+
+class DashboardAggregates:
+    """
+    Materialized dashboard figures: collection counts, bill counts by status,
+    revenue from paid bills, low-stock items and appointments by day. Filled
+    once by build() and then kept current by apply(), which firebase_service
+    calls from its write paths, so reading them never scans a collection.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._live = _Aggregates()
+        self._next = None
+        self._touched = set()
+        self._ready = threading.Event()
+        self.builds = 0
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def apply(self, collection, doc_id, doc):
+        """Applies one write: the document's new contents, or None once deleted."""
+        if collection not in COUNTED_COLLECTIONS:
+            return
+        with self._lock:
+            targets = [self._live]
+            if self._next is not None:
+                # A rebuild is streaming; keep this write over its older copy.
+                self._touched.add((collection, doc_id))
+                targets.append(self._next)
+            for aggregates in targets:
+                if doc is None:
+                    aggregates.remove(collection, doc_id)
+                else:
+                    aggregates.add(collection, doc_id, doc)
+
+    def build(self, load):
+        """
+        Recomputes everything from scratch. `load(collection)` must return an
+        iterable of documents. The current figures keep being served (and
+        updated) until the new ones are complete.
+        """
+        with self._lock:
+            self._next = _Aggregates()
+            self._touched = set()
+        try:
+            for collection in COUNTED_COLLECTIONS:
+                for doc in load(collection):
+                    with self._lock:
+                        if (collection, doc['id']) not in self._touched:
+                            self._next.add(collection, doc['id'], doc)
+            with self._lock:
+                self._live = self._next
+                self.builds += 1
+            self._ready.set()
+        finally:
+            with self._lock:
+                self._next = None
+                self._touched = set()
+
+    def summary(self, date):
+        """Returns the dashboard for a day ('YYYY-MM-DD')."""
+        with self._lock:
+            return self._live.summary(date)
+
+    def snapshot(self):
+        """The figures that reconciliation compares with the database."""
+        with self._lock:
+            live = self._live
+            return {
+                'totals': {name: len(ids) for name, ids in live.ids.items()},
+                'pending_bills': live.bill_counts.get('Pending', 0),
+                'paid_bills': live.bill_counts.get('Paid', 0),
+                'revenue': round(live.revenue, 2),
+                'low_stock': len(live.low_stock),
+            }
+
+
+# The process-wide aggregates used by firebase_service and web_app.
+aggregates = DashboardAggregates()
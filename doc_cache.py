@@ -0,0 +1,131 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class DocumentCache:
+    """
+    Bounded, thread-safe LRU cache with a per-entry time-to-live, used for
+    single-document lookups. Values are copied on the way in and out so
+    callers can mutate what they get back. A TTL of 0 disables caching.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Loads in flight, so an invalidation can stop a stale value from landing.
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def configure(self, max_entries=None, ttl=None):
+        """Changes the size bound and/or TTL, trimming the cache if needed."""
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl is not None:
+                self.ttl = ttl
+            self._trim()
+
+    def _trim(self):
+        while len(self._entries) > max(self.max_entries, 0):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if self._clock() >= expires_at:
+            del self._entries[key]
+            self.expirations += 1
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key] = (self._clock() + self.ttl, copy.deepcopy(value))
+        self._entries.move_to_end(key)
+        self._trim()
+
+    def get(self, key, default=None):
+        """Returns a cached value, or `default` if it is absent or expired."""
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return copy.deepcopy(value)
+
+    def get_or_load(self, key, loader):
+        """Read-through lookup: on a miss, calls `loader()` and caches its result."""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return copy.deepcopy(value)
+            self.misses += 1
+            token = object()
+            self._pending[key] = token
+
+        try:
+            value = loader()
+        except BaseException:
+            # e.g. "not found": nothing to cache, but the token must not leak.
+            with self._lock:
+                if self._pending.get(key) is token:
+                    del self._pending[key]
+            raise
+
+        with self._lock:
+            if self._pending.get(key) is token:
+                del self._pending[key]
+                self._store(key, value)
+        return value
+
+    def put(self, key, value):
+        """Stores a value, e.g. the document a write has just committed."""
+        with self._lock:
+            self._pending.pop(key, None)
+            self._store(key, value)
+
+    def invalidate(self, key):
+        """Drops a key, and discards any load of it that is still in flight."""
+        with self._lock:
+            self._pending.pop(key, None)
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the current size, configuration and counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,217 @@
+"""
+Streaming exports of whole collections as CSV, NDJSON or Parquet.
+
+Documents are read one at a time, from the MySQL mirror through an unbuffered
+cursor or from a Firestore stream, encoded EXPORT_BATCH_SIZE rows at a time
+and handed out as byte chunks (optionally gzip or zstd compressed), so memory
+use doesn't grow with the size of the collection. Parquet needs pyarrow and
+zstd needs zstandard; both are optional.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+
+from firebase_admin import firestore
+
+import firebase_service
+import mysql_mirror
+import mysql_service
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Rows encoded per output chunk; also the Parquet row group size.
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+# 'auto' reads the mirror when it is up and current (see firebase_service's
+# read routing), and Firestore otherwise.
+SOURCES = ('auto', 'mysql', 'firestore')
+
+_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'parquet': 'application/vnd.apache.parquet'}
+_COMPRESSED = {'gzip': ('.gz', 'application/gzip'), 'zstd': ('.zst', 'application/zstd')}
+_FLOAT_COLUMNS = ('fee', 'total', 'price')
+_INT_COLUMNS = ('quantity',)
+
+
+def _columns(name):
+    return ('id',) + firebase_service.DOCUMENT_FIELDS[name]
+
+
+def _batches(docs, size):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _text(value):
+    """Strings as they are; lists and objects (bill items) as JSON."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def _csv_chunks(columns, docs):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in _batches(docs, EXPORT_BATCH_SIZE):
+        writer.writerows([_text(doc.get(column)) for column in columns] for doc in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Only the header: the collection is empty.
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(columns, docs):
+    for batch in _batches(docs, EXPORT_BATCH_SIZE):
+        yield ''.join(
+            json.dumps({column: doc.get(column) for column in columns}, default=str) + '\n' for doc in batch
+        ).encode('utf-8')
+
+
+class _ChunkSink:
+    """A write-only file for ParquetWriter whose written bytes are taken back out with drain()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _number(value, kind):
+    try:
+        return kind(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parquet_chunks(columns, docs, compression):
+    types = {column: pyarrow.float64() for column in _FLOAT_COLUMNS}
+    types.update((column, pyarrow.int64()) for column in _INT_COLUMNS)
+    schema = pyarrow.schema([(column, types.get(column, pyarrow.string())) for column in columns])
+
+    def value(column, raw):
+        if column in _FLOAT_COLUMNS:
+            return _number(raw, float)
+        if column in _INT_COLUMNS:
+            return _number(raw, int)
+        return _text(raw)
+
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression=compression)
+    try:
+        for batch in _batches(docs, EXPORT_BATCH_SIZE):
+            rows = {column: [value(column, doc.get(column)) for doc in batch] for column in columns}
+            writer.write_table(pyarrow.Table.from_pydict(rows, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def _compress(chunks, compression):
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif compression == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        yield from chunks
+        return
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _documents(name, source, filters):
+    """Streams the documents of a collection from the chosen store."""
+    if source == 'auto':
+        fresh = mysql_mirror.is_fresh(name, firebase_service.MYSQL_READ_MAX_LAG)
+        source = 'mysql' if fresh and mysql_service.ensure_schema() else 'firestore'
+    if source == 'mysql':
+        return mysql_service.iter_rows_mysql(name, batch_size=EXPORT_BATCH_SIZE, filters=filters)
+    query = firebase_service.get_collection(name)
+    for field, op, value in filters:
+        query = query.where(filter=firestore.FieldFilter(field, op, value))
+    return (dict(snapshot.to_dict(), id=snapshot.id) for snapshot in query.stream())
+
+
+def export_info(name, fmt='csv', compression='none'):
+    """(file name, MIME type) of an export."""
+    filename = f"{name}.{fmt}"
+    mimetype = _MIMETYPES[fmt]
+    if fmt != 'parquet' and compression in _COMPRESSED:
+        extension, mimetype = _COMPRESSED[compression]
+        filename += extension
+    return filename, mimetype
+
+
+def export(name, fmt='csv', compression='none', source='auto', filters=()):
+    """
+    Returns a generator of byte chunks making up the export of a collection.
+    Parquet files compress their pages themselves, so for them `compression`
+    picks the column codec instead of wrapping the file. `filters` are
+    (field, operator, value) triples. Arguments are checked before anything
+    is read; raises ValueError on a bad one.
+    """
+    if name not in firebase_service.COLLECTIONS:
+        raise ValueError(f"Unknown collection: {name}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+    if source not in SOURCES:
+        raise ValueError(f"Unknown export source: {source}")
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError("Parquet exports need the pyarrow package.")
+    if compression == 'zstd' and fmt != 'parquet' and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package.")
+
+    columns = _columns(name)
+    docs = _documents(name, source, filters)
+    if fmt == 'parquet':
+        return _parquet_chunks(columns, docs, compression)
+    chunks = _csv_chunks(columns, docs) if fmt == 'csv' else _ndjson_chunks(columns, docs)
+    return _compress(chunks, compression)
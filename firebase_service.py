@@ -1,353 +1,1458 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
+import availability
+import contextlib
 import json
 import os
+import string
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import zlib
+import dashboard
+import datetime as dt
+import doc_cache
+import mysql_mirror
 import mysql_service
+import pagination
+import replica
+import search_index
+import timestamps
 
 # --- Firebase Initialization ---
+# Firebase is initialized on first use rather than at import, so importing this
+# module (and web_app) never waits on credentials or the network. A failed
+# attempt is retried after FIREBASE_INIT_RETRY_AFTER seconds.
 db = None
 app_id = "default-app-id"  # Hardcoded to unify local and deployed DB
+FIREBASE_INIT_RETRY_AFTER = float(os.environ.get('FIREBASE_INIT_RETRY_AFTER', 30))
+_init_lock = threading.Lock()
+_init_error = None
+_init_retry_at = 0.0
 
-try:
+
+def _connect():
+    """Initializes the Firebase app and returns its Firestore client."""
     # 1. Try to initialize using the serviceAccountKey.json
     cred_path = os.path.join(os.path.dirname(__file__), 'serviceAccountKey.json')
     if os.path.exists(cred_path):
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-    else:
-        # 2. Fallback for environments where __app_id is defined (like the platform)
-        # We must load credentials from the environment string
-        firebase_config_str = os.environ.get('__firebase_config')
-        if firebase_config_str:
-            firebase_config = json.loads(firebase_config_str)
-            cred = credentials.Certificate(firebase_config)
-            app_name = f"app-{app_id}"
-
-            # Check if app is already initialized
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app(credentials.Certificate(cred_path))
+        return firestore.client()
+
+    # 2. Fallback for environments where __app_id is defined (like the platform)
+    # We must load credentials from the environment string
+    firebase_config_str = os.environ.get('__firebase_config')
+    if not firebase_config_str:
+        raise FileNotFoundError("serviceAccountKey.json not found and __firebase_config is not set.")
+    firebase_config = json.loads(firebase_config_str)
+    app_name = f"app-{app_id}"
+
+    # Check if app is already initialized
+    try:
+        app = firebase_admin.get_app(name=app_name)
+    except ValueError:
+        app = firebase_admin.initialize_app(credentials.Certificate(firebase_config), name=app_name)
+    return firestore.client(app=app)
+
+
+def init():
+    """
+    Initializes Firebase (once). Returns the Firestore client, or None if it
+    couldn't be initialized; the error is kept for health().
+    """
+    global db, _init_error, _init_retry_at
+    if db is not None:
+        return db
+    with _init_lock:
+        if db is None and time.monotonic() >= _init_retry_at:
             try:
-                app = firebase_admin.get_app(name=app_name)
-            except ValueError:
-                app = firebase_admin.initialize_app(cred, name=app_name)
+                db = _connect()
+                _init_error = None
+            except Exception as e:
+                print(f"Error initializing Firebase: {e}")
+                print("CRITICAL: Firestore database (db) is None. App will not function.")
+                _init_error = str(e)
+                _init_retry_at = time.monotonic() + FIREBASE_INIT_RETRY_AFTER
+    return db
+
+
+def get_db():
+    """The Firestore client, initialized on first use."""
+    if init() is None:
+        raise ConnectionError("Firestore is not initialized. Check your serviceAccountKey.json or credentials.")
+    return db
 
-            db = firestore.client(app=app)
-        else:
-            raise FileNotFoundError("serviceAccountKey.json not found and __firebase_config is not set.")
 
-except Exception as e:
-    print(f"Error initializing Firebase: {e}")
-    # Handle the case where db is not initialized, e.g., set db to None
-    # and functions below will handle the 'db is None' case.
-    if db is None:
-        print("CRITICAL: Firestore database (db) is None. App will not function.")
+def health(probe=False):
+    """
+    Whether Firestore can be used. With `probe`, also runs a one-document
+    query to check that it answers, and reports how long that took.
+    """
+    status = {'ready': init() is not None, 'error': _init_error}
+    if status['ready'] and probe:
+        started = time.monotonic()
+        try:
+            list(get_collection('patients').select([]).limit(1).stream())
+        except Exception as e:
+            status.update(ready=False, error=str(e))
+        status['probe_seconds'] = round(time.monotonic() - started, 4)
+    return status
 
 
 def get_collection(name):
     """Helper to get a collection from the sandboxed path."""
-    if db is None:
-        raise ConnectionError("Firestore is not initialized. Check your serviceAccountKey.json or credentials.")
-    return db.collection('artifacts', app_id, 'public', 'data', name)
+    return get_db().collection('artifacts', app_id, 'public', 'data', name)
+
+
+COLLECTIONS = ('patients', 'doctors', 'appointments', 'billing', 'inventory')
+
+# Fields of each collection's documents, in the order the add_*/update_*
+# functions (and the MySQL mirror columns after `id`) take them.
+DOCUMENT_FIELDS = {
+    'patients': ('name', 'contact', 'history', 'dob', 'gender'),
+    'doctors': ('name', 'specialty', 'schedule', 'fee'),
+    'appointments': ('patient', 'doctor', 'datetime'),
+    'billing': ('patient', 'items', 'total', 'status'),
+    'inventory': ('item', 'quantity', 'supplier', 'price')
+}
+
+
+# --- Collection Versions ---
+# Every write path bumps its collection's counter, and list responses are
+# tagged with it (see collection_etag). The counters are per process, so they
+# only see every write when replica mode is on (its listeners bump them for
+# writes made elsewhere) or when SINGLE_PROCESS=1 declares this the only
+# process writing; otherwise the web app sends no ETags (see ETAGS_ENABLED).
+SINGLE_PROCESS = os.environ.get('SINGLE_PROCESS', '').lower() in ('1', 'true', 'yes')
+_boot_id = uuid.uuid4().hex[:8]
+_versions = {name: 0 for name in COLLECTIONS}
+_versions_lock = threading.Lock()
+
+
+def bump_version(name):
+    """Marks a collection as changed."""
+    with _versions_lock:
+        _versions[name] += 1
+
+
+def collection_version(name):
+    return _versions[name]
+
+
+def collection_etag(names, variant=b''):
+    """
+    Strong ETag for the current state of one or more collections. `variant`
+    distinguishes representations of the same state (e.g. the query string).
+    Read it *before* reading the data, so the data is never older than its tag.
+    """
+    if isinstance(names, str):
+        names = [names]
+    with _versions_lock:
+        state = '.'.join(f'{name}{_versions[name]}' for name in names)
+    return f'{_boot_id}-{state}-{zlib.crc32(variant):08x}'
+
+
+# --- Replica Mode ---
+# With FIRESTORE_REPLICA=1, on_snapshot listeners keep an in-memory copy of all
+# five collections, and the get_* functions are served from it once it is ready.
+REPLICA_ENABLED = os.environ.get('FIRESTORE_REPLICA', '').lower() in ('1', 'true', 'yes')
+ETAGS_ENABLED = REPLICA_ENABLED or SINGLE_PROCESS
+
+
+def _replica_document(name, doc_id, data):
+    """Applies a change a replica listener reported, made by any process, to the indexes that need them."""
+    availability.index.apply(name, doc_id, data)
+    dashboard.aggregates.apply(name, doc_id, data)
+
+
+replicas = {name: replica.CollectionReplica(name, on_change=bump_version, on_document=_replica_document)
+            for name in COLLECTIONS}
+_replica_lock = threading.Lock()
+_replica_started = False
+
+
+def start_replica():
+    """Attaches the snapshot listeners (once). Returns without waiting for them."""
+    global _replica_started
+    with _replica_lock:
+        if not _replica_started:
+            for name, collection_replica in replicas.items():
+                collection_replica.start(get_collection(name))
+            _replica_started = True
+
+
+def _replica_for(name):
+    """Returns the replica that can serve `name`, or None if reads go to Firestore."""
+    if not REPLICA_ENABLED:
+        return None
+    if not _replica_started:
+        try:
+            start_replica()
+        except Exception as e:
+            print(f"Error starting replica: {e}")
+            return None
+    collection_replica = replicas[name]
+    return collection_replica if collection_replica.ready else None
+
+
+def replica_status():
+    """Reports readiness and staleness of the in-memory replica."""
+    return {
+        'enabled': REPLICA_ENABLED,
+        'started': _replica_started,
+        'ready': _replica_started and all(r.ready for r in replicas.values()),
+        'collections': {name: r.status() for name, r in replicas.items()},
+    }
+
+
+# --- Read Routing ---
+# READ_BACKEND decides which list reads the MySQL mirror serves:
+#   'firestore' (default)  none; everything is read from Firestore (or the replica)
+#   'mysql'                every list read
+#   'auto'                 only query-shaped reads (filtered, ordered or paged),
+#                          which SQL indexes serve best
+# Writes and transactions always go to Firestore. The mirror is only read when
+# it is fresh: no mirror write to the table has failed since it was last
+# checked (see mysql_mirror.mark_degraded), and it has applied every write this
+# process made to the table, or its oldest pending write is at most
+# MYSQL_READ_MAX_LAG seconds old. If a MySQL read fails, reads go back to
+# Firestore for MYSQL_READ_RETRY_AFTER seconds. A paged listing stays on the
+# backend its first page came from (see _list_mysql).
+READ_BACKEND = os.environ.get('READ_BACKEND', 'firestore').lower()
+MYSQL_READ_MAX_LAG = float(os.environ.get('MYSQL_READ_MAX_LAG', 0))
+MYSQL_READ_RETRY_AFTER = float(os.environ.get('MYSQL_READ_RETRY_AFTER', 30))
+_read_counts = {'firestore': 0, 'replica': 0, 'mysql': 0, 'stale': 0, 'errors': 0}
+_read_counts_lock = threading.Lock()
+_mysql_retry_at = 0.0
+_mysql_last_error = None
+
+
+def _count_read(kind):
+    with _read_counts_lock:
+        _read_counts[kind] += 1
+
+
+def _route_to_mysql(name, query_shaped):
+    """Whether this list read should be served from the MySQL mirror."""
+    if READ_BACKEND == 'mysql' or (READ_BACKEND == 'auto' and query_shaped):
+        if time.monotonic() < _mysql_retry_at:
+            return False
+        if not mysql_mirror.is_fresh(name, MYSQL_READ_MAX_LAG):
+            _count_read('stale')
+            return False
+        return True
+    return False
+
+
+def _read_mysql(read):
+    """Runs a mirror read; returns None (so Firestore is used) if MySQL fails."""
+    global _mysql_retry_at, _mysql_last_error
+    try:
+        result = read()
+    except ValueError:
+        raise
+    except Exception as e:
+        print(f"Error reading from MySQL, falling back to Firestore: {e}")
+        _mysql_retry_at = time.monotonic() + MYSQL_READ_RETRY_AFTER
+        _mysql_last_error = str(e)
+        _count_read('errors')
+        return None
+    _count_read('mysql')
+    return result
+
+
+def read_routing_status():
+    """The routing mode and how many reads each backend has served."""
+    with _read_counts_lock:
+        counts = dict(_read_counts)
+    return {
+        'backend': READ_BACKEND,
+        'max_lag_seconds': MYSQL_READ_MAX_LAG,
+        'mysql_available': time.monotonic() >= _mysql_retry_at,
+        'mysql_last_error': _mysql_last_error,
+        'mirror_fresh': {name: mysql_mirror.is_fresh(name, MYSQL_READ_MAX_LAG) for name in COLLECTIONS},
+        'mirror_degraded': mysql_mirror.degraded(),
+        'reads': counts,
+    }
+
+
+# --- Document Cache ---
+# Read-through cache for the single-document getters (get_patient, get_bill, ...).
+# DOC_CACHE_SIZE bounds the number of entries and DOC_CACHE_TTL (seconds) how
+# long an entry may be served; DOC_CACHE_TTL=0 turns the cache off.
+document_cache = doc_cache.DocumentCache(
+    max_entries=int(os.environ.get('DOC_CACHE_SIZE', 2048)),
+    ttl=float(os.environ.get('DOC_CACHE_TTL', 30))
+)
+
+
+def cache_stats():
+    """Returns hit/miss/eviction counters of the document cache."""
+    return document_cache.stats()
+
+
+# --- Shared Read Helpers ---
+def _doc_to_dict(doc):
+    """Converts a document snapshot into a plain dict carrying its ID."""
+    data = doc.to_dict()
+    data['id'] = doc.id
+    return data
+
+
+def _parse_fields(fields):
+    """Validates a field projection; 'id' is implied and always returned."""
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    fields = [field.strip() for field in fields if field.strip() and field.strip() != 'id']
+    for field in fields:
+        if not field.replace('_', '').isalnum():
+            raise ValueError(f"Invalid field name: {field}")
+    return fields
+
+
+def _project(doc, fields):
+    """Applies a field projection to a document that was read in full."""
+    if fields is None:
+        return doc
+    projected = {field: doc[field] for field in fields if field in doc}
+    projected['id'] = doc['id']
+    return projected
+
+
+def _parse_filters(filters):
+    """Validates (field, operator, value) filters."""
+    filters = list(filters or ())
+    for field, op, _ in filters:
+        if op not in pagination.FILTER_OPERATORS:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        if not field.replace('_', '').isalnum():
+            raise ValueError(f"Invalid field name: {field}")
+    return filters
+
+
+def _build_query(name, order_by, cursor, fields=None, filters=()):
+    """
+    Builds the query for a (possibly paged, possibly projected, possibly
+    filtered) listing of a collection. Returns (query, order) where order is
+    the parsed (field, descending) pair.
+    """
+    order = pagination.parse_order_by(name, order_by, filters)
+    after = pagination.decode_cursor(cursor, order)
+    query = get_collection(name)
+    for field, op, value in filters:
+        query = query.where(filter=firestore.FieldFilter(field, op, value))
+    if fields is not None:
+        query = query.select(fields)
+    if order_by is None and after is None and order == ('id', False):
+        return query, order
+
+    # Order by (field, document ID) so every position in the listing is unique.
+    field, descending = order
+    direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+    if field != 'id':
+        query = query.order_by(field, direction=direction)
+    query = query.order_by(firestore.FieldPath.document_id(), direction=direction)
+    if after is not None:
+        value, doc_id = after
+        position = {firestore.FieldPath.document_id(): doc_id}
+        if field != 'id':
+            position[field] = value
+        query = query.start_after(position)
+    return query, order
+
+
+def _list_mysql(name, limit, order_by, cursor, filters, from_mysql):
+    """
+    A listing served by the MySQL mirror, or None to read it from Firestore.
+    A cursor stays on the backend that issued it (see
+    pagination.cursor_source): one from MySQL is resumed there even if reads
+    would otherwise go to Firestore, and one from Firestore never is.
+    """
+    if not from_mysql:
+        if cursor or not _route_to_mysql(name, bool(limit or order_by or filters)):
+            return None
+        return _read_mysql(lambda: mysql_service.list_documents_mysql(name, limit, order_by, cursor, filters))
+    page = None
+    if name not in mysql_mirror.degraded():
+        page = _read_mysql(lambda: mysql_service.list_documents_mysql(name, limit, order_by, cursor, filters))
+    if page is None:
+        raise ValueError("This cursor can't be resumed right now; start again from the first page.")
+    return page
+
+
+def list_documents(name, limit=None, order_by=None, cursor=None, fields=None, filters=()):
+    """
+    Fetches the documents of a collection, optionally one page at a time,
+    restricted to `fields` and matching `filters` ((field, operator, value)
+    triples). Returns a pagination.Page whose next_cursor is None on the last
+    page.
+    """
+    limit = pagination.parse_limit(limit)
+    fields = _parse_fields(fields)
+    filters = _parse_filters(filters)
+    from_mysql = pagination.cursor_source(cursor) == 'mysql'
+    source = None if from_mysql else _replica_for(name)
+    if source is not None:
+        order = pagination.parse_order_by(name, order_by, filters)
+        page = source.list(limit, order, pagination.decode_cursor(cursor, order), filters)
+        _count_read('replica')
+    else:
+        page = _list_mysql(name, limit, order_by, cursor, filters, from_mysql)
+    if page is not None:
+        if fields is not None:
+            page[:] = [_project(doc, fields) for doc in page]
+        return page
+
+    _count_read('firestore')
+    query, order = _build_query(name, order_by, cursor, fields, filters)
+    if limit is None:
+        return pagination.Page(_doc_to_dict(doc) for doc in query.stream())
+
+    # Fetch one extra document to learn whether another page follows.
+    docs = [_doc_to_dict(doc) for doc in query.limit(limit + 1).stream()]
+    return pagination.make_page(docs, limit, order)
+
+
+def iter_documents(name, limit=None, order_by=None, cursor=None, filters=()):
+    """
+    Like list_documents, but returns a generator that yields documents as they
+    arrive from the Firestore stream instead of collecting them into a list.
+    Arguments are validated before the first document is read.
+    """
+    limit = pagination.parse_limit(limit)
+    filters = _parse_filters(filters)
+    from_mysql = pagination.cursor_source(cursor) == 'mysql'
+    source = None if from_mysql else _replica_for(name)
+    if source is not None:
+        order = pagination.parse_order_by(name, order_by, filters)
+        _count_read('replica')
+        return iter(source.list(limit, order, pagination.decode_cursor(cursor, order), filters))
+    page = _list_mysql(name, limit, order_by, cursor, filters, from_mysql)
+    if page is not None:
+        return iter(page)
+
+    _count_read('firestore')
+    query, _ = _build_query(name, order_by, cursor, filters=filters)
+    if limit is not None:
+        query = query.limit(limit)
+    return (_doc_to_dict(doc) for doc in query.stream())
+
+
+def count_documents(name, filters=()):
+    """
+    Counts the documents of a collection that match `filters`: from the
+    replica, as a COUNT(*) on the mirror when reads are routed there, or
+    else as a Firestore count() aggregation.
+    """
+    if name not in COLLECTIONS:
+        raise ValueError(f"Unknown collection: {name}")
+    filters = _parse_filters(filters)
+    source = _replica_for(name)
+    if source is not None:
+        _count_read('replica')
+        return source.count(filters)
+    if _route_to_mysql(name, True):
+        count = _read_mysql(lambda: mysql_service.count_rows_mysql(name, filters))
+        if count is not None:
+            return count
+    _count_read('firestore')
+    query = get_collection(name)
+    for field, op, value in filters:
+        query = query.where(filter=firestore.FieldFilter(field, op, value))
+    count, _ = _aggregate(query)
+    return count
+
+
+def get_documents(name, ids):
+    """
+    Fetches several documents by ID at once: from the replica, else from the
+    document cache and then, for the rest, one IN query on the MySQL mirror
+    (when reads are routed there) or one Firestore get_all. Returns
+    {id: document}; IDs that don't exist are left out.
+    """
+    ids = [doc_id for doc_id in dict.fromkeys(ids) if isinstance(doc_id, str) and doc_id]
+    found = {}
+    source = _replica_for(name)
+    if source is not None:
+        _count_read('replica')
+        for doc_id in ids:
+            doc = source.get(doc_id)
+            if doc is not None:
+                found[doc_id] = doc
+        return found
+
+    missing = []
+    for doc_id in ids:
+        doc = document_cache.get((name, doc_id))
+        if doc is not None:
+            found[doc_id] = doc
+        else:
+            missing.append(doc_id)
+    if missing and _route_to_mysql(name, True):
+        rows = _read_mysql(lambda: mysql_service.get_rows_mysql(name, missing))
+        if rows is not None:
+            found.update(rows)
+            return found
+    if missing:
+        _count_read('firestore')
+        collection = get_collection(name)
+        for doc in get_db().get_all([collection.document(doc_id) for doc_id in missing]):
+            if doc.exists:
+                found[doc.id] = _doc_to_dict(doc)
+    return found
+
+
+# Reference fields ?expand= can resolve, the collection each points to, and
+# the fields of the referenced document that are embedded.
+EXPANDABLE = {
+    'appointments': {'patient': 'patients', 'doctor': 'doctors'},
+    'billing': {'patient': 'patients'}
+}
+EXPANDED_FIELDS = {
+    'patients': ('name', 'contact', 'gender', 'dob'),
+    'doctors': ('name', 'specialty', 'fee')
+}
+
+
+def parse_expand(name, expand):
+    """Validates an expand spec such as 'patient,doctor' for a collection."""
+    if not expand:
+        return []
+    fields = [field.strip() for field in expand.split(',') if field.strip()]
+    for field in fields:
+        if field not in EXPANDABLE.get(name, {}):
+            raise ValueError(f"Cannot expand '{field}' on {name}.")
+    return list(dict.fromkeys(fields))
+
+
+def expand_references(name, docs, fields):
+    """
+    Embeds the documents that `fields` of `docs` refer to as `<field>_details`
+    (None if the reference is dangling). Each referenced collection is read
+    once, with the distinct IDs of the whole page, and the collections are
+    read in parallel.
+    """
+    lookups = {}
+    for field in fields:
+        target = EXPANDABLE[name][field]
+        ids = [doc.get(field) for doc in docs]
+        lookups[field] = _read_pool.submit(get_documents, target, ids)
+    for field, lookup in lookups.items():
+        found = lookup.result()
+        target_fields = list(EXPANDED_FIELDS[EXPANDABLE[name][field]])
+        for doc in docs:
+            referenced = found.get(doc.get(field))
+            doc[f'{field}_details'] = _project(referenced, target_fields) if referenced is not None else None
+    return docs
+
+
+def _fetch_document(name, doc_id, not_found_message):
+    """Reads a single document by its ID from Firestore."""
+    doc = get_collection(name).document(doc_id).get()
+    if doc.exists:
+        return _doc_to_dict(doc)
+    else:
+        raise Exception(not_found_message)
+
+
+# Reads whole collections side by side for fetch_collections.
+_read_pool = ThreadPoolExecutor(max_workers=len(COLLECTIONS), thread_name_prefix='collection-read')
+
+
+def fetch_collections(names=COLLECTIONS, fields=None):
+    """
+    Reads several collections in parallel, so the total time is roughly that
+    of the slowest one. `fields` optionally maps a collection name to the
+    fields to return for it; other collections are returned whole.
+    """
+    fields = fields or {}
+    for name in list(names) + list(fields):
+        if name not in COLLECTIONS:
+            raise ValueError(f"Unknown collection: {name}")
+    futures = {name: _read_pool.submit(list_documents, name, fields=fields.get(name)) for name in names}
+    return {name: future.result() for name, future in futures.items()}
+
+
+# Leading characters that split a collection into ID ranges for parallel
+# scans; Firestore's auto IDs are made of exactly these.
+ID_RANGE_BOUNDS = sorted(string.digits + string.ascii_letters)
+
+
+def id_ranges():
+    """(start, end) ID ranges that together cover every ID; None is an open end."""
+    bounds = [None] + ID_RANGE_BOUNDS + [None]
+    return list(zip(bounds, bounds[1:]))
+
+
+def iter_id_range(name, start=None, end=None, after=None, limit=None):
+    """
+    Streams, straight from Firestore and in ID order, the documents whose IDs
+    are in [start, end) (None leaves a side open), beginning after the ID
+    `after` and stopping after `limit` documents.
+    """
+    collection = get_collection(name)
+    document_id = firestore.FieldPath.document_id()
+    query = collection.order_by(document_id)
+    if start is not None:
+        query = query.where(filter=firestore.FieldFilter(document_id, '>=', collection.document(start)))
+    if end is not None:
+        query = query.where(filter=firestore.FieldFilter(document_id, '<', collection.document(end)))
+    if after is not None:
+        query = query.start_after({document_id: after})
+    if limit is not None:
+        query = query.limit(limit)
+    return (_doc_to_dict(doc) for doc in query.stream())
+
+
+def _get_document(name, doc_id, not_found_message):
+    """Fetches a single document by its ID, from the replica or through the document cache."""
+    source = _replica_for(name)
+    if source is not None:
+        doc = source.get(doc_id)
+        if doc is not None:
+            return doc
+    return document_cache.get_or_load(
+        (name, doc_id), lambda: _fetch_document(name, doc_id, not_found_message))
+
+
+# --- Write Notifications ---
+def _notify_write(name, doc_id, data):
+    """
+    Called after every successful Firestore write with the document's new
+    contents, or None once it has been deleted, so that in-process state
+    derived from the collections stays current.
+    """
+    bump_version(name)
+    if _replica_started:
+        replicas[name].apply_local_write(doc_id, data)
+    if data is None:
+        document_cache.invalidate((name, doc_id))
+        search_index.index.remove_document(name, doc_id)
+    else:
+        # Every write path sends the complete document, so it can be cached as is.
+        document_cache.put((name, doc_id), dict(data, id=doc_id))
+        search_index.index.index_document(name, doc_id, data)
+    dashboard.aggregates.apply(name, doc_id, data)
+    availability.index.apply(name, doc_id, data)
+
+
+def _mirror(op, *args):
+    """
+    Mirrors a write to MySQL by calling mysql_service.<op>(*args), either right
+    away or, in write-behind mode, by handing it to the background mirror.
+    """
+    if mysql_mirror.enabled():
+        mysql_mirror.submit(op, *args)
+    else:
+        mysql_mirror.apply_now(op, *args)
+
+
+# --- Search ---
+_search_build_lock = threading.Lock()
+
+
+def build_search_index():
+    """Loads every collection into the in-process search index (once)."""
+    with _search_build_lock:
+        if not search_index.index.ready:
+            search_index.index.build(iter_documents)
+
+
+def search(name, query, limit=None, offset=0):
+    """
+    Ranked search over one collection, served from the in-process index.
+    Returns a (documents, total matches) pair.
+    """
+    if name not in search_index.SEARCH_FIELDS:
+        raise ValueError(f"Unknown search type: {name}")
+    limit = pagination.parse_limit(limit) or 20
+    try:
+        offset = int(offset or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid offset: {offset}")
+    if offset < 0:
+        raise ValueError("offset must not be negative.")
+    if not search_index.index.ready:
+        build_search_index()
+    return search_index.index.search(name, query, limit, offset)
+
+
+# --- Dashboard ---
+# The dashboard is served from counters kept current by _notify_write and, in
+# replica mode, by the listeners, which report other processes' writes too.
+# Without replica mode they only see this process's writes, so the dashboard
+# is only served when SINGLE_PROCESS=1 says there are no others (see
+# DASHBOARD_ENABLED). Every DASHBOARD_RECONCILE_INTERVAL seconds (0 disables
+# it) they are checked against Firestore aggregation queries, which catches
+# anything the listeners missed, and rebuilt if anything differs.
+DASHBOARD_ENABLED = REPLICA_ENABLED or SINGLE_PROCESS
+DASHBOARD_RECONCILE_INTERVAL = float(os.environ.get('DASHBOARD_RECONCILE_INTERVAL', 600))
+# Comparisons per reconciliation, for when writes keep racing with them.
+DASHBOARD_RECONCILE_ATTEMPTS = 4
+_dashboard_build_lock = threading.Lock()
+_dashboard_status = {'reconciled_at': None, 'last_mismatch': None, 'last_error': None}
+
+
+def build_dashboard(force=False):
+    """Loads every collection into the dashboard aggregates (once, unless forced)."""
+    with _dashboard_build_lock:
+        if force or not dashboard.aggregates.ready:
+            dashboard.aggregates.build(iter_documents)
+
+
+def get_dashboard(date=None):
+    """Returns the dashboard figures, with the appointments of `date` (default: today)."""
+    if date is None:
+        date = dt.date.today().isoformat()
+    else:
+        try:
+            date = dt.date.fromisoformat(date).isoformat()
+        except ValueError:
+            raise ValueError(f"Invalid date: {date}")
+    if not dashboard.aggregates.ready:
+        build_dashboard()
+    summary = dashboard.aggregates.summary(date)
+    summary['reconciled_at'] = _dashboard_status['reconciled_at']
+    return summary
+
+
+def _aggregate(query, sum_field=None):
+    """Runs a server-side count() (and sum() of `sum_field`) over a query."""
+    aggregation = query.count(alias='count')
+    if sum_field:
+        aggregation = aggregation.sum(sum_field, alias='sum')
+    values = {result.alias: result.value for result in aggregation.get()[0]}
+    return values['count'], values.get('sum') or 0
+
+
+def _dashboard_drift():
+    """
+    Compares the aggregates with Firestore count()/sum() queries once.
+    Returns the figures that differed, and whether a write went through
+    this process meanwhile (which makes the comparison meaningless).
+    """
+    versions = {name: collection_version(name) for name in COLLECTIONS}
+    expected = dashboard.aggregates.snapshot()
+    actual = {'totals': {}}
+    for name in dashboard.COUNTED_COLLECTIONS:
+        actual['totals'][name], _ = _aggregate(get_collection(name))
+    billing = get_collection('billing')
+    actual['pending_bills'], _ = _aggregate(billing.where(filter=firestore.FieldFilter('status', '==', 'Pending')))
+    actual['paid_bills'], revenue = _aggregate(
+        billing.where(filter=firestore.FieldFilter('status', '==', 'Paid')), 'total')
+    actual['revenue'] = round(revenue, 2)
+    actual['low_stock'], _ = _aggregate(get_collection('inventory').where(
+        filter=firestore.FieldFilter('quantity', '<=', dashboard.LOW_STOCK_THRESHOLD)))
+    moved = any(collection_version(name) != version for name, version in versions.items())
+
+    mismatches = {}
+    for key, value in actual.items():
+        if key == 'totals':
+            for name, count in value.items():
+                if expected['totals'][name] != count:
+                    mismatches[f'totals.{name}'] = {'expected': expected['totals'][name], 'actual': count}
+        elif (abs(expected[key] - value) > 0.005 if key == 'revenue' else expected[key] != value):
+            mismatches[key] = {'expected': expected[key], 'actual': value}
+    return mismatches, moved
+
+
+def reconcile_dashboard():
+    """
+    Compares the aggregates with Firestore count()/sum() queries and rebuilds
+    them if they have drifted. Returns the figures that differed.
+
+    Does nothing until the aggregates have been built. A comparison that
+    writes raced with is retried rather than trusted, and drift has to show
+    up in two comparisons in a row, so a write that Firestore has committed
+    but this process hasn't applied yet doesn't trigger a rebuild.
+    """
+    if not dashboard.aggregates.ready:
+        return {}
+    get_db()
+    confirmed = None
+    for attempt in range(DASHBOARD_RECONCILE_ATTEMPTS):
+        if attempt:
+            time.sleep(1)
+        mismatches, moved = _dashboard_drift()
+        if moved:
+            confirmed = None
+            continue
+        if not mismatches or confirmed is not None:
+            break
+        confirmed = mismatches
+    else:
+        print("Dashboard kept changing while being reconciled; checking again next time.")
+        return {}
+    if mismatches:
+        print(f"Dashboard aggregates drifted, rebuilding: {mismatches}")
+        _dashboard_status['last_mismatch'] = mismatches
+        build_dashboard(force=True)
+        # Drift means writes this process didn't see, so cached responses are stale too.
+        for name in COLLECTIONS:
+            bump_version(name)
+    _dashboard_status['reconciled_at'] = dt.datetime.now().isoformat(timespec='seconds')
+    return mismatches
+
+
+def run_dashboard_reconciler():
+    """Reconciles the dashboard forever, every DASHBOARD_RECONCILE_INTERVAL seconds."""
+    if not DASHBOARD_ENABLED or DASHBOARD_RECONCILE_INTERVAL <= 0:
+        return
+    while True:
+        time.sleep(DASHBOARD_RECONCILE_INTERVAL)
+        try:
+            reconcile_dashboard()
+            _dashboard_status['last_error'] = None
+        except Exception as e:
+            _dashboard_status['last_error'] = str(e)
+            print(f"Error reconciling dashboard: {e}")
+
+
+# --- Availability ---
+# The availability index and its booking locks are per process. With
+# SINGLE_PROCESS=1 they see every booking, so a check under the doctor's lock
+# is enough. Otherwise each booking is checked and written in one Firestore
+# transaction that reads the doctor's appointments around its time (served by
+# the (doctor, datetime) index) and the doctor's schedule, and a day's
+# availability is read from Firestore unless replica mode feeds the index the
+# other processes' bookings.
+_availability_build_lock = threading.Lock()
+
+
+def build_availability():
+    """Loads doctors and appointments into the availability index (once)."""
+    with _availability_build_lock:
+        if not availability.index.ready:
+            availability.index.build(iter_documents)
+
+
+def get_availability(did, date):
+    """A doctor's working hours, booked appointments and free time on `date` ('YYYY-MM-DD')."""
+    try:
+        date = dt.date.fromisoformat(date) if date else dt.date.today()
+    except ValueError:
+        raise ValueError(f"Invalid date: {date}")
+    doctor = get_doctor(did)
+    if SINGLE_PROCESS or _replica_for('appointments') is not None:
+        if not availability.index.ready:
+            build_availability()
+        return availability.index.day(did, date)
+    day_index = availability.AvailabilityIndex()
+    day_index.apply('doctors', did, doctor)
+    for appt in iter_documents('appointments', filters=appointment_filters(date, date + dt.timedelta(days=1), did)):
+        day_index.apply('appointments', appt['id'], appt)
+    return day_index.day(did, date)
+
+
+def _check_availability(doctor_id, datetime, aid=None):
+    """Raises availability.AppointmentConflict if the doctor can't see anyone at `datetime`."""
+    if not doctor_id or not datetime:
+        return
+    if not availability.index.ready:
+        build_availability()
+    availability.index.check(doctor_id, datetime, exclude_id=aid)
+
+
+def _check_availability_in(transaction, doctor_id, datetime, exclude_ids=()):
+    """
+    Like _check_availability, but reads the doctor's schedule and the
+    appointments that could overlap `datetime` from Firestore in `transaction`,
+    so the check holds until the transaction commits. `exclude_ids` are
+    appointments the transaction itself rewrites.
+    """
+    if not doctor_id or not datetime:
+        return
+    start = timestamps.parse_datetime(datetime)
+    duration = availability.index.duration
+    doctor = get_collection('doctors').document(doctor_id).get(transaction=transaction)
+    hours = availability.parse_schedule(doctor.to_dict().get('schedule')) if doctor.exists else None
+    query = get_collection('appointments')
+    for field, op, value in appointment_filters(start - duration + dt.timedelta(seconds=1), start + duration,
+                                                doctor_id):
+        query = query.where(filter=firestore.FieldFilter(field, op, value))
+    overlapping = [_doc_to_dict(snapshot) for snapshot in query.stream(transaction=transaction)
+                   if snapshot.id not in exclude_ids]
+    availability.check_booking(start, duration, overlapping, hours)
+
+
+@firestore.transactional
+def _book_appointment_transaction(transaction, doc_ref, data, create):
+    """Checks a booking against Firestore and writes it, in one transaction."""
+    _check_availability_in(transaction, data['doctor'], data['datetime'], {doc_ref.id})
+    if create:
+        transaction.set(doc_ref, data)
+    else:
+        transaction.update(doc_ref, data)
+
+
+def _book_appointment(doc_ref, data, create):
+    """Writes an appointment (set if `create`, else update) once the doctor is known to be free."""
+    if not SINGLE_PROCESS:
+        _book_appointment_transaction(get_db().transaction(), doc_ref, data, create)
+        _notify_write('appointments', doc_ref.id, data)
+        return
+    # Check and write under the doctor's lock so two bookings can't both pass the check
+    with availability.index.booking_lock(data['doctor']):
+        _check_availability(data['doctor'], data['datetime'], doc_ref.id)
+        if create:
+            doc_ref.set(data)
+        else:
+            doc_ref.update(data)
+        _notify_write('appointments', doc_ref.id, data)
 
 
 # --- Patients ---
-def get_patients():
-    """Fetches all patient documents."""
-    patients_ref = get_collection('patients')
-    docs = patients_ref.stream()
-    patients = []
-    for doc in docs:
-        patient = doc.to_dict()
-        patient['id'] = doc.id
-        patients.append(patient)
-    return patients
+def get_patients(limit=None, order_by=None, cursor=None):
+    """Fetches patient documents, optionally one page at a time."""
+    return list_documents('patients', limit, order_by, cursor)
 
 
 def add_patient(name, contact, history, dob, gender):
     """Adds a new patient."""
     patients_ref = get_collection('patients')
     doc_ref = patients_ref.document()
-    doc_ref.set({
+    data = {
         'name': name,
         'contact': contact,
         'history': history,
         'dob': dob,
         'gender': gender
-    })
+    }
+    doc_ref.set(data)
     pid = doc_ref.id
-    mysql_service.add_patient_mysql(pid, name, contact, history, dob, gender)
+    _notify_write('patients', pid, data)
+    _mirror('add_patient_mysql', pid, name, contact, history, dob, gender)
     return pid
 
 
 def update_patient(pid, name, contact, history, dob, gender):
     """Updates an existing patient."""
     patients_ref = get_collection('patients')
-    patients_ref.document(pid).update({
+    data = {
         'name': name,
         'contact': contact,
         'history': history,
         'dob': dob,
         'gender': gender
-    })
-    mysql_service.update_patient_mysql(pid, name, contact, history, dob, gender)
+    }
+    patients_ref.document(pid).update(data)
+    _notify_write('patients', pid, data)
+    _mirror('update_patient_mysql', pid, name, contact, history, dob, gender)
 
 
 def delete_patient(pid):
     patients_ref = get_collection('patients')
     patients_ref.document(pid).delete()
-    mysql_service.delete_patient_mysql(pid)
+    _notify_write('patients', pid, None)
+    _mirror('delete_patient_mysql', pid)
 
 
 def get_patient(pid):
     """Fetches a single patient by their ID."""
-    doc_ref = get_collection('patients').document(pid)
-    doc = doc_ref.get()
-    if doc.exists:
-        patient = doc.to_dict()
-        patient['id'] = doc.id
-        return patient
-    else:
-        raise Exception("Patient not found")
+    return _get_document('patients', pid, "Patient not found")
 
 
 # --- Doctors ---
-def get_doctors():
-    """Fetches all doctor documents."""
-    doctors_ref = get_collection('doctors')
-    docs = doctors_ref.stream()
-    doctors = []
-    for doc in docs:
-        doctor = doc.to_dict()
-        doctor['id'] = doc.id
-        doctors.append(doctor)
-    return doctors
+def get_doctors(limit=None, order_by=None, cursor=None):
+    """Fetches doctor documents, optionally one page at a time."""
+    return list_documents('doctors', limit, order_by, cursor)
 
 
 def add_doctor(name, specialty, schedule, fee):
     """Adds a new doctor."""
     doctors_ref = get_collection('doctors')
     doc_ref = doctors_ref.document()
-    doc_ref.set({
+    data = {
         'name': name,
         'specialty': specialty,
         'schedule': schedule,
         'fee': fee
-    })
+    }
+    doc_ref.set(data)
     did = doc_ref.id
-    mysql_service.add_doctor_mysql(did, name, specialty, schedule, fee)
+    _notify_write('doctors', did, data)
+    _mirror('add_doctor_mysql', did, name, specialty, schedule, fee)
     return did
 
 
 def update_doctor(did, name, specialty, schedule, fee):
     """Updates an existing doctor."""
     doctors_ref = get_collection('doctors')
-    doctors_ref.document(did).update({
+    data = {
         'name': name,
         'specialty': specialty,
         'schedule': schedule,
         'fee': fee
-    })
-    mysql_service.update_doctor_mysql(did, name, specialty, schedule, fee)
+    }
+    doctors_ref.document(did).update(data)
+    _notify_write('doctors', did, data)
+    _mirror('update_doctor_mysql', did, name, specialty, schedule, fee)
 
 
 def delete_doctor(did):
     doctors_ref = get_collection('doctors')
     doctors_ref.document(did).delete()
-    mysql_service.delete_doctor_mysql(did)
+    _notify_write('doctors', did, None)
+    _mirror('delete_doctor_mysql', did)
 
 
 def get_doctor(did):
     """Fetches a single doctor by their ID."""
-    doc_ref = get_collection('doctors').document(did)
-    doc = doc_ref.get()
-    if doc.exists:
-        doctor = doc.to_dict()
-        doctor['id'] = doc.id
-        return doctor
-    else:
-        raise Exception("Doctor not found")
+    return _get_document('doctors', did, "Doctor not found")
 
 
 # --- Appointments ---
-def get_appointments():
-    """Fetches all appointment documents."""
-    appts_ref = get_collection('appointments')
-    docs = appts_ref.stream()
-    appointments = []
-    for doc in docs:
-        appt = doc.to_dict()
-        appt['id'] = doc.id
-        appointments.append(appt)
-    return appointments
+def appointment_filters(start=None, end=None, doctor=None, patient=None):
+    """
+    Builds the filters for an appointment range query: times in [start, end),
+    optionally for one doctor and/or patient. Served by the (doctor, datetime)
+    and (patient, datetime) composite indexes.
+    """
+    filters = []
+    if doctor:
+        filters.append(('doctor', '==', doctor))
+    if patient:
+        filters.append(('patient', '==', patient))
+    if start:
+        filters.append(('datetime', '>=', timestamps.normalize_datetime(start)))
+    if end:
+        filters.append(('datetime', '<', timestamps.normalize_datetime(end)))
+    return filters
+
+
+def get_appointments(limit=None, order_by=None, cursor=None, filters=()):
+    """Fetches appointment documents, optionally one page at a time and filtered (see appointment_filters)."""
+    return list_documents('appointments', limit, order_by, cursor, filters=filters)
 
 
 def add_appointment(patient_id, doctor_id, datetime):
     """Adds a new appointment."""
+    datetime = timestamps.normalize_datetime(datetime)
     appts_ref = get_collection('appointments')
     doc_ref = appts_ref.document()
-    doc_ref.set({
+    data = {
         'patient': patient_id,  # Storing the ID
         'doctor': doctor_id,  # Storing the ID
         'datetime': datetime
-    })
+    }
+    _book_appointment(doc_ref, data, create=True)
     aid = doc_ref.id
-    mysql_service.add_appointment_mysql(aid, patient_id, doctor_id, datetime)
+    _mirror('add_appointment_mysql', aid, patient_id, doctor_id, datetime)
     return aid
 
 
 def update_appointment(aid, patient_id, doctor_id, datetime):
     """Updates an existing appointment."""
+    datetime = timestamps.normalize_datetime(datetime)
     appts_ref = get_collection('appointments')
-    appts_ref.document(aid).update({
+    data = {
         'patient': patient_id,
         'doctor': doctor_id,
         'datetime': datetime
-    })
-    mysql_service.update_appointment_mysql(aid, patient_id, doctor_id, datetime)
+    }
+    _book_appointment(appts_ref.document(aid), data, create=False)
+    _mirror('update_appointment_mysql', aid, patient_id, doctor_id, datetime)
 
 
 def delete_appointment(aid):
     appts_ref = get_collection('appointments')
     appts_ref.document(aid).delete()
-    mysql_service.delete_appointment_mysql(aid)
+    _notify_write('appointments', aid, None)
+    _mirror('delete_appointment_mysql', aid)
 
 
 def get_appointment(aid):
     """Fetches a single appointment by its ID."""
-    doc_ref = get_collection('appointments').document(aid)
-    doc = doc_ref.get()
-    if doc.exists:
-        appt = doc.to_dict()
-        appt['id'] = doc.id
-        return appt
-    else:
-        raise Exception("Appointment not found")
+    return _get_document('appointments', aid, "Appointment not found")
 
 
 # --- Billing ---
-def get_billing():
-    """Fetches all bill documents."""
-    billing_ref = get_collection('billing')
-    docs = billing_ref.stream()
-    bills = []
-    for doc in docs:
-        bill = doc.to_dict()
-        bill['id'] = doc.id
-        bills.append(bill)
-    return bills
+def get_billing(limit=None, order_by=None, cursor=None):
+    """Fetches bill documents, optionally one page at a time."""
+    return list_documents('billing', limit, order_by, cursor)
 
 
 def add_bill(patient_id, items, total, status):
     """Adds a new bill."""
     billing_ref = get_collection('billing')
     doc_ref = billing_ref.document()
-    doc_ref.set({
+    data = {
         'patient': patient_id,  # Storing the ID
         'items': items,
         'total': total,
         'status': status
-    })
+    }
+    doc_ref.set(data)
     bid = doc_ref.id
-    mysql_service.add_bill_mysql(bid, patient_id, items, total, status)
+    _notify_write('billing', bid, data)
+    _mirror('add_bill_mysql', bid, patient_id, items, total, status)
     return bid
 
 
 def update_bill(bid, patient_id, items, total, status):
     """Updates an existing bill."""
     billing_ref = get_collection('billing')
-    billing_ref.document(bid).update({
+    data = {
         'patient': patient_id,
         'items': items,
         'total': total,
         'status': status
-    })
-    mysql_service.update_bill_mysql(bid, patient_id, items, total, status)
+    }
+    billing_ref.document(bid).update(data)
+    _notify_write('billing', bid, data)
+    _mirror('update_bill_mysql', bid, patient_id, items, total, status)
 
 
 def delete_bill(bid):
     billing_ref = get_collection('billing')
     billing_ref.document(bid).delete()
-    mysql_service.delete_bill_mysql(bid)
+    _notify_write('billing', bid, None)
+    _mirror('delete_bill_mysql', bid)
 
 
 def get_bill(bid):
     """Fetches a single bill by its ID."""
-    doc_ref = get_collection('billing').document(bid)
-    doc = doc_ref.get()
-    if doc.exists:
-        bill = doc.to_dict()
-        bill['id'] = doc.id
-        return bill
-    else:
-        raise Exception("Bill not found")
+    return _get_document('billing', bid, "Bill not found")
 
 
 # --- Inventory ---
-def get_inventory():
-    """Fetches all inventory documents."""
-    inventory_ref = get_collection('inventory')
-    docs = inventory_ref.stream()
-    items = []
-    for doc in docs:
-        item = doc.to_dict()
-        item['id'] = doc.id
-        items.append(item)
-    return items
+def get_inventory(limit=None, order_by=None, cursor=None):
+    """Fetches inventory documents, optionally one page at a time."""
+    return list_documents('inventory', limit, order_by, cursor)
 
 
 def add_inventory(item, quantity, supplier, price):
     """Adds a new inventory item."""
     inventory_ref = get_collection('inventory')
     doc_ref = inventory_ref.document()
-    doc_ref.set({
+    data = {
         'item': item,
         'quantity': quantity,
         'supplier': supplier,
         'price': price
-    })
+    }
+    doc_ref.set(data)
     iid = doc_ref.id
-    mysql_service.add_inventory_mysql(iid, item, quantity, supplier, price)
+    _notify_write('inventory', iid, data)
+    _mirror('add_inventory_mysql', iid, item, quantity, supplier, price)
     return iid
 
 
 def update_inventory(iid, item, quantity, supplier, price):
     """Updates an existing inventory item."""
     inventory_ref = get_collection('inventory')
-    inventory_ref.document(iid).update({
+    data = {
         'item': item,
         'quantity': quantity,
         'supplier': supplier,
         'price': price
-    })
-    mysql_service.update_inventory_mysql(iid, item, quantity, supplier, price)
+    }
+    inventory_ref.document(iid).update(data)
+    _notify_write('inventory', iid, data)
+    _mirror('update_inventory_mysql', iid, item, quantity, supplier, price)
 
 
 def delete_inventory(iid):
     inventory_ref = get_collection('inventory')
     inventory_ref.document(iid).delete()
-    mysql_service.delete_inventory_mysql(iid)
+    _notify_write('inventory', iid, None)
+    _mirror('delete_inventory_mysql', iid)
 
 
 def get_inventory_item(iid):
     """Fetches a single inventory item by its ID."""
-    doc_ref = get_collection('inventory').document(iid)
-    doc = doc_ref.get()
-    if doc.exists:
-        item = doc.to_dict()
-        item['id'] = doc.id
-        return item
-    else:
-        raise Exception("Inventory item not found")
+    return _get_document('inventory', iid, "Inventory item not found")
+
+
+# --- Patient Timeline ---
+def get_patient_timeline(pid):
+    """
+    Everything about one patient in one call: the patient, their appointments
+    (newest first) with the doctor of each embedded as `doctor_details` (see
+    expand_references), and their bills. Reads use `patient == pid` filters
+    and one batched doctor lookup, so the cost follows the patient's own records.
+    """
+    patient_filter = [('patient', '==', pid)]
+    patient = _read_pool.submit(get_patient, pid)
+    appointments = _read_pool.submit(list_documents, 'appointments', order_by='-datetime', filters=patient_filter)
+    bills = _read_pool.submit(list_documents, 'billing', filters=patient_filter)
+    patient, appointments, bills = patient.result(), list(appointments.result()), list(bills.result())
+
+    expand_references('appointments', appointments, ['doctor'])
+
+    totals = {}
+    for bill in bills:
+        total = bill.get('total')
+        if isinstance(total, (int, float)):
+            totals[bill.get('status')] = totals.get(bill.get('status'), 0) + total
+    return {
+        'patient': patient,
+        'appointments': appointments,
+        'bills': bills,
+        'summary': {
+            'appointments': len(appointments),
+            'bills': len(bills),
+            'paid': totals.get('Paid', 0),
+            'outstanding': totals.get('Pending', 0)
+        }
+    }
+
+
+# --- Bulk Writes ---
+# Firestore accepts at most 500 writes per batch commit.
+BATCH_LIMIT = 500
+
+
+def _check_bookings(writes, held):
+    """
+    Checks each create and update of bulk_write `writes` against the bookings
+    before it in the same request and, with SINGLE_PROCESS, against the
+    availability index, under the booking locks of every doctor they book
+    (taken in ID order, so concurrent requests can't deadlock, and held on
+    the ExitStack `held`). Otherwise each batch is checked against Firestore
+    as it is committed (see _commit_bookings). Conflicts become failed
+    results; returns the writes that are left.
+    """
+    if SINGLE_PROCESS:
+        doctors = {data['doctor'] for _, kind, _, data in writes
+                   if kind != 'delete' and isinstance(data['doctor'], str)}
+        for doctor_id in sorted(doctors):
+            held.enter_context(availability.index.booking_lock(doctor_id))
+    booked = {}
+    left = []
+    for write in writes:
+        result, kind, ref, data = write
+        if kind != 'delete':
+            aid = ref.id if kind == 'update' else None
+            try:
+                if SINGLE_PROCESS:
+                    _check_availability(data['doctor'], data['datetime'], aid)
+                if isinstance(data['doctor'], str) and data['datetime']:
+                    start = timestamps.parse_datetime(data['datetime'])
+                    for other_id, other_start in booked.get(data['doctor'], []):
+                        if other_id != ref.id and abs(start - other_start) < availability.index.duration:
+                            raise availability.AppointmentConflict(
+                                "The doctor already has an appointment at this time in this request.")
+                    booked.setdefault(data['doctor'], []).append((ref.id, start))
+            except availability.AppointmentConflict as e:
+                result.update(success=False, error=str(e))
+                continue
+        left.append(write)
+    return left
+
+
+def _stage_writes(batch, chunk):
+    """Adds bulk_write's `chunk` of writes to a batch or transaction."""
+    for result, kind, ref, data in chunk:
+        if kind == 'create':
+            batch.set(ref, data)
+        elif kind == 'update':
+            batch.update(ref, data)
+        else:
+            batch.delete(ref)
+
+
+@firestore.transactional
+def _commit_bookings(transaction, chunk):
+    """
+    Checks the bookings of bulk_write's `chunk` against Firestore and commits
+    the ones that are free in one transaction (see _check_availability_in).
+    Returns the committed writes and the (result, error) of the others.
+    """
+    rewritten = {ref.id for _, kind, ref, _ in chunk if kind != 'create'}
+    left = []
+    conflicts = []
+    for write in chunk:
+        result, kind, ref, data = write
+        if kind != 'delete':
+            try:
+                _check_availability_in(transaction, data['doctor'], data['datetime'], rewritten)
+            except availability.AppointmentConflict as e:
+                conflicts.append((result, str(e)))
+                continue
+        left.append(write)
+    _stage_writes(transaction, left)
+    return left, conflicts
+
+
+def bulk_write(name, creates=(), updates=(), deletes=()):
+    """
+    Creates, updates and deletes many documents of one collection. Writes are
+    committed as Firestore batches of at most BATCH_LIMIT operations, and each
+    committed batch is mirrored to MySQL with one executemany. Creates and
+    updates take the same fields as add_*/update_*; updates and deletes need an
+    `id`. Returns one result per item, in order: creates, updates, deletes.
+    The targets of each batch's updates and deletes are read first (one
+    get_all), so a missing document fails only its own item. Appointment
+    bookings are checked like add_appointment's (see the Availability
+    section), and a conflict fails only its own item.
+    """
+    if name not in COLLECTIONS:
+        raise ValueError(f"Unknown collection: {name}")
+    db = get_db()
+    fields = DOCUMENT_FIELDS[name]
+    collection = get_collection(name)
+
+    results = []
+    writes = []
+    for kind, items in (('create', creates), ('update', updates), ('delete', deletes)):
+        for index, item in enumerate(items):
+            result = {'op': kind, 'index': index}
+            results.append(result)
+            doc_id = item.get('id') if isinstance(item, dict) else item
+            if kind != 'delete' and not isinstance(item, dict):
+                result.update(success=False, error="Item must be an object.")
+            elif kind != 'create' and not isinstance(doc_id, str):
+                result.update(success=False, error="Item has no id.")
+            else:
+                ref = collection.document() if kind == 'create' else collection.document(doc_id)
+                data = {field: item.get(field) for field in fields} if kind != 'delete' else None
+                if data is not None and name == 'appointments':
+                    try:
+                        data['datetime'] = timestamps.normalize_datetime(data['datetime'])
+                    except ValueError as e:
+                        result.update(success=False, error=str(e))
+                        continue
+                writes.append((result, kind, ref, data))
+
+    with contextlib.ExitStack() as held:
+        if name == 'appointments':
+            writes = _check_bookings(writes, held)
+        for start in range(0, len(writes), BATCH_LIMIT):
+            chunk = writes[start:start + BATCH_LIMIT]
+            targets = [ref for _, kind, ref, _ in chunk if kind != 'create']
+            if targets:
+                try:
+                    existing = {snapshot.id for snapshot in db.get_all(targets) if snapshot.exists}
+                except Exception as e:
+                    print(f"Error reading {name} batch targets: {e}")
+                    for result, _, _, _ in chunk:
+                        result.update(success=False, error=str(e))
+                    continue
+                for result, kind, ref, _ in chunk:
+                    if kind != 'create' and ref.id not in existing:
+                        result.update(success=False, error="Document not found.")
+                chunk = [write for write in chunk if write[1] == 'create' or write[2].id in existing]
+                if not chunk:
+                    continue
+            try:
+                if name == 'appointments' and not SINGLE_PROCESS:
+                    chunk, conflicts = _commit_bookings(db.transaction(), chunk)
+                    for result, error in conflicts:
+                        result.update(success=False, error=error)
+                else:
+                    batch = db.batch()
+                    _stage_writes(batch, chunk)
+                    batch.commit()
+            except Exception as e:
+                print(f"Error committing {name} batch: {e}")
+                for result, _, _, _ in chunk:
+                    result.update(success=False, error=str(e))
+                continue
+
+            rows = []
+            deleted = []
+            for result, kind, ref, data in chunk:
+                result.update(success=True, id=ref.id)
+                _notify_write(name, ref.id, data)
+                if kind == 'delete':
+                    deleted.append(ref.id)
+                else:
+                    rows.append([ref.id] + [data[field] for field in fields])
+            try:
+                if rows:
+                    _mirror('upsert_rows_mysql', name, rows)
+                if deleted:
+                    _mirror('delete_rows_mysql', name, deleted)
+            except Exception as e:
+                # Firestore has the writes; only the mirror is behind.
+                print(f"Error mirroring {name} batch: {e}")
+                for result, _, _, _ in chunk:
+                    result['mirror_error'] = str(e)
+    return results
+
+
+# --- Migrations ---
+def migrate_appointment_datetimes(dry_run=False):
+    """
+    Rewrites appointment times stored in any other format into the canonical
+    form of timestamps.normalize_datetime, in batches of BATCH_LIMIT, so range
+    queries see every appointment. Values that can't be parsed are left as
+    they are and reported. The rewritten rows are mirrored to MySQL as well.
+    """
+    db = get_db()
+    collection = get_collection('appointments')
+    fields = DOCUMENT_FIELDS['appointments']
+    report = {'scanned': 0, 'updated': 0, 'invalid': []}
+
+    def commit(pending):
+        batch = db.batch()
+        for doc_id, data in pending:
+            batch.update(collection.document(doc_id), {'datetime': data['datetime']})
+        batch.commit()
+        for doc_id, data in pending:
+            _notify_write('appointments', doc_id, data)
+        _mirror('upsert_rows_mysql', 'appointments', [[doc_id] + [data.get(field) for field in fields]
+                                                      for doc_id, data in pending])
+
+    pending = []
+    for doc in collection.stream():
+        report['scanned'] += 1
+        data = doc.to_dict()
+        try:
+            normalized = timestamps.normalize_datetime(data.get('datetime'))
+        except ValueError:
+            report['invalid'].append({'id': doc.id, 'datetime': data.get('datetime')})
+            continue
+        if normalized == data.get('datetime'):
+            continue
+        report['updated'] += 1
+        data['datetime'] = normalized
+        if not dry_run:
+            pending.append((doc.id, data))
+            if len(pending) == BATCH_LIMIT:
+                commit(pending)
+                pending = []
+    if pending:
+        commit(pending)
+    return report
 
 
 # --- Transactional Logic ---
 
+def _stock_quantities(items):
+    """
+    Sums the requested quantity per inventory ID over a bill's stock items
+    (everything but consultations), so an item listed twice is read and
+    decremented once. Also returns a display name per ID for error messages.
+    """
+    quantities = {}
+    names = {}
+    for item in items:
+        # We only care about items that are *not* consultations
+        if item.get('isConsultation', False) == False:
+            item_id = item.get('id')
+            if not item_id:
+                raise Exception(f"Bill contains an item with no ID: {item.get('name')}")
+            quantities[item_id] = quantities.get(item_id, 0) + item.get('quantity', 0)
+            names.setdefault(item_id, item.get('name'))
+    return quantities, names
+
+
 @firestore.transactional
 def process_payment_transaction(transaction, bid):
     """
     Handles the payment in a transaction:
-    1. Reads all required docs (bill, inventory items).
+    1. Reads the bill, then all of its inventory items in one get_all.
     2. Checks stock.
     3. Writes all updates (bill status, inventory quantities).
+    Returns the paid bill and the updated inventory documents by ID.
     """
     billing_ref = get_collection('billing')
     inventory_ref = get_collection('inventory')
@@ -366,38 +1471,26 @@ def process_payment_transaction(transaction, bid):
     if bill_data.get('status') == 'Paid':
         raise Exception("This bill has already been paid.")
 
-    items_to_update = bill_data.get('items', [])
-    inventory_snapshots = {}
-
-    # Get all inventory items that are part of this bill
-    for item in items_to_update:
-        # We only care about items that are *not* consultations
-        if item.get('isConsultation', False) == False:
-            item_id = item.get('id')
-            if not item_id:
-                raise Exception(f"Bill contains an item with no ID: {item.get('name')}")
-
-            item_doc_ref = inventory_ref.document(item_id)
-            item_snapshot = item_doc_ref.get(transaction=transaction)
-
-            if not item_snapshot.exists:
-                raise Exception(f"Inventory item not found: {item.get('name')}")
+    quantities, names = _stock_quantities(bill_data.get('items', []))
 
-            inventory_snapshots[item_id] = item_snapshot
+    # Get all inventory items that are part of this bill in one round trip
+    inventory = {}
+    if quantities:
+        item_refs = [inventory_ref.document(item_id) for item_id in quantities]
+        for item_snapshot in transaction.get_all(item_refs):
+            if item_snapshot.exists:
+                inventory[item_snapshot.id] = item_snapshot.to_dict()
 
     # --- 2. VALIDATION/CALCULATION PHASE (No DB calls) ---
 
-    for item in items_to_update:
-        if item.get('isConsultation', False) == False:
-            item_id = item.get('id')
-            item_snapshot = inventory_snapshots[item_id]
-
-            current_quantity = item_snapshot.to_dict().get('quantity', 0)
-            requested_quantity = item.get('quantity', 0)
+    for item_id, requested_quantity in quantities.items():
+        if item_id not in inventory:
+            raise Exception(f"Inventory item not found: {names[item_id]}")
 
-            if current_quantity < requested_quantity:
-                raise Exception(
-                    f"Not enough stock for item: {item.get('name')}. Requested: {requested_quantity}, Available: {current_quantity}")
+        current_quantity = inventory[item_id].get('quantity', 0)
+        if current_quantity < requested_quantity:
+            raise Exception(
+                f"Not enough stock for item: {names[item_id]}. Requested: {requested_quantity}, Available: {current_quantity}")
 
     # --- 3. WRITE PHASE ---
 
@@ -405,30 +1498,35 @@ def process_payment_transaction(transaction, bid):
     transaction.update(bill_doc_ref, {
         'status': 'Paid'
     })
+    bill_data['status'] = 'Paid'
 
     # Update all inventory items
-    for item in items_to_update:
-        if item.get('isConsultation', False) == False:
-            item_id = item.get('id')
-            item_snapshot = inventory_snapshots[item_id]
-            item_doc_ref = inventory_ref.document(item_id)  # Get ref again for writing
-
-            current_quantity = item_snapshot.to_dict().get('quantity', 0)
-            requested_quantity = item.get('quantity', 0)
-            new_quantity = current_quantity - requested_quantity
+    for item_id, requested_quantity in quantities.items():
+        new_quantity = inventory[item_id].get('quantity', 0) - requested_quantity
+        transaction.update(inventory_ref.document(item_id), {
+            'quantity': new_quantity
+        })
+        inventory[item_id]['quantity'] = new_quantity
 
-            transaction.update(item_doc_ref, {
-                'quantity': new_quantity
-            })
+    return bill_data, inventory
 
 
 def process_payment(bid):
     """
-    Public-facing function to run the payment transaction.
+    Public-facing function to run the payment transaction. Returns what it
+    changed: the paid bill and the list of updated inventory items.
     """
-    if db is None:
-        raise ConnectionError("Firestore is not initialized.")
-
-    transaction = db.transaction()
-    process_payment_transaction(transaction, bid)
-
+    transaction = get_db().transaction()
+    bill_data, inventory = process_payment_transaction(transaction, bid)
+    _notify_write('billing', bid, bill_data)
+    for item_id, item_data in inventory.items():
+        _notify_write('inventory', item_id, item_data)
+    # The quantities the transaction committed, not the deductions, so a
+    # replayed mirror operation can't take the items out of stock twice.
+    stock = {item_id: item_data.get('quantity') for item_id, item_data in inventory.items()}
+    try:
+        _mirror('apply_payment_mysql', bid, stock)
+    except Exception as e:
+        # Firestore has the payment; only the mirror is behind.
+        print(f"Error mirroring payment of bill {bid}: {e}")
+    return dict(bill_data, id=bid), [dict(item_data, id=item_id) for item_id, item_data in inventory.items()]
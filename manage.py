@@ -0,0 +1,194 @@
+"""
+Maintenance commands for the Medical Management System.
+
+    python manage.py init
+    python manage.py migrate-appointments [--dry-run] [--skip-firestore] [--skip-mysql]
+    python manage.py check-consistency [--collections NAME ...] [--prefix-length N] [--workers N]
+                                       [--report FILE] [--plan FILE] [--repair]
+    python manage.py export COLLECTION [--format csv|ndjson|parquet] [--compression none|gzip|zstd]
+                                       [--source auto|mysql|firestore] [--output FILE]
+    python manage.py backfill-mysql [--collections NAME ...] [--workers N] [--page-size N]
+                                    [--checkpoint FILE] [--restart] [--verify]
+    python manage.py profile-token [--ttl SECONDS]
+"""
+import argparse
+import json
+import sys
+import time
+
+import backfill
+import consistency
+import export
+import firebase_service
+import mysql_mirror
+import mysql_service
+import profiling
+
+
+def _print_report(title, report):
+    print(f"{title}:")
+    print(json.dumps(report, indent=2, default=str))
+
+
+def init(args):
+    """
+    Initializes both backends, creates the MySQL schema and records its
+    fingerprint, so app processes can start with MYSQL_SCHEMA_CHECK=auto or skip.
+    Exits with 1 unless both answer.
+    """
+    mysql_service.ensure_schema(force=True)
+    health = {'firestore': firebase_service.health(probe=True), 'mysql': mysql_service.health(probe=True)}
+    _print_report('Health', health)
+    return 0 if all(status['ready'] for status in health.values()) else 1
+
+
+def migrate_appointments(args):
+    """Normalizes appointment times in Firestore and converts the MySQL column to DATETIME."""
+    if not args.skip_mysql:
+        _print_report('MySQL appointments.datetime', mysql_service.migrate_appointments_mysql(args.dry_run))
+    if not args.skip_firestore:
+        _print_report('Firestore appointments', firebase_service.migrate_appointment_datetimes(args.dry_run))
+    return 0
+
+
+def _consistency_summary(report):
+    """The consistency report with ID lists replaced by their lengths."""
+    summary = {
+        name: {key: len(value) if isinstance(value, list) else value for key, value in result.items()}
+        for name, result in report['collections'].items()
+    }
+    return dict(report, collections=summary)
+
+
+def check_consistency(args):
+    """Compares the MySQL mirror with Firestore; exits with 1 if they differ."""
+    if not mysql_mirror.flush(timeout=60):
+        print("MySQL mirror writes are still queued; their rows will show up as differences.")
+    report = consistency.check_consistency(
+        args.collections or firebase_service.COLLECTIONS, args.prefix_length, args.workers,
+        plan=bool(args.plan or args.repair))
+    plan = report.pop('repair_plan', None)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    _print_report('Consistency', _consistency_summary(report))
+    if args.plan:
+        with open(args.plan, 'w') as f:
+            json.dump(plan, f, indent=2, default=str)
+    if args.repair and plan:
+        _print_report('Repaired', consistency.apply_repair(plan))
+    return 0 if report['consistent'] else 1
+
+
+def export_collection(args):
+    """Streams a collection to a file ('-' for standard output)."""
+    chunks = export.export(args.collection, args.format, args.compression, args.source)
+    output = args.output or export.export_info(args.collection, args.format, args.compression)[0]
+    started = time.monotonic()
+    written = 0
+    f = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    try:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+    finally:
+        if f is not sys.stdout.buffer:
+            f.close()
+    elapsed = time.monotonic() - started
+    # Progress goes to stderr so it doesn't end up in an export written to stdout.
+    print(f"Wrote {written} bytes to {output} in {elapsed:.1f}s "
+          f"({written / max(elapsed, 1e-9) / 1e6:.1f} MB/s).", file=sys.stderr)
+    return 0
+
+
+def backfill_mysql(args):
+    """Copies Firestore into the MySQL mirror; run it again to resume after an interruption."""
+    def progress(report):
+        print(f"{report['total_rows']} rows in {report['elapsed_seconds']}s ({report['rows_per_second']} rows/s)")
+
+    report = backfill.backfill(
+        args.collections or firebase_service.COLLECTIONS, args.workers, args.checkpoint, args.page_size,
+        restart=args.restart, on_progress=progress)
+    _print_report('Backfill', report)
+    if report['errors']:
+        print(f"Some ranges failed; run the command again to resume from {args.checkpoint}.")
+        return 1
+    if args.verify:
+        report = consistency.check_consistency(
+            args.collections or firebase_service.COLLECTIONS, workers=args.workers, plan=True)
+        plan = report.pop('repair_plan')
+        _print_report('Consistency', _consistency_summary(report))
+        if plan:
+            _print_report('Repaired', consistency.apply_repair(plan))
+    return 0
+
+
+def profile_token(args):
+    """Prints an X-Profile header value that has the app profile a request (see profiling.py)."""
+    try:
+        token = profiling.make_token(args.ttl)
+    except ValueError as e:
+        print(e)
+        return 2
+    print(f"{profiling.PROFILE_HEADER}: {token}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('init', help='create the MySQL schema and check both backends')
+    command.set_defaults(handler=init)
+
+    command = commands.add_parser('migrate-appointments', help='store appointment times as real timestamps')
+    command.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    command.add_argument('--skip-firestore', action='store_true')
+    command.add_argument('--skip-mysql', action='store_true')
+    command.set_defaults(handler=migrate_appointments)
+
+    command = commands.add_parser('check-consistency', help='find rows where MySQL and Firestore differ')
+    command.add_argument('--collections', nargs='+', choices=firebase_service.COLLECTIONS)
+    command.add_argument('--prefix-length', type=int, default=consistency.DEFAULT_PREFIX_LENGTH,
+                         help='ID characters per chunk; longer means smaller chunks')
+    command.add_argument('--workers', type=int, default=consistency.DEFAULT_WORKERS)
+    command.add_argument('--report', help='write the full report (every differing ID) to this file')
+    command.add_argument('--plan', help='write the repair plan to this file')
+    command.add_argument('--repair', action='store_true', help='apply the repair plan to MySQL')
+    command.set_defaults(handler=check_consistency)
+
+    command = commands.add_parser('export', help='stream a collection to a CSV, NDJSON or Parquet file')
+    command.add_argument('collection', choices=firebase_service.COLLECTIONS)
+    command.add_argument('--format', choices=export.FORMATS, default='csv')
+    command.add_argument('--compression', choices=export.COMPRESSIONS, default='none')
+    command.add_argument('--source', choices=export.SOURCES, default='auto')
+    command.add_argument('--output', help="file to write (default: <collection>.<format>[.gz|.zst]; '-' for stdout)")
+    command.set_defaults(handler=export_collection)
+
+    command = commands.add_parser('backfill-mysql', help='copy every Firestore document into the MySQL mirror')
+    command.add_argument('--collections', nargs='+', choices=firebase_service.COLLECTIONS)
+    command.add_argument('--workers', type=int, default=backfill.DEFAULT_WORKERS)
+    command.add_argument('--page-size', type=int, default=backfill.BACKFILL_PAGE_SIZE,
+                         help='documents per Firestore query and per executemany')
+    command.add_argument('--checkpoint', default=backfill.DEFAULT_CHECKPOINT, help='progress file used to resume')
+    command.add_argument('--restart', action='store_true', help='ignore the checkpoint and copy everything again')
+    command.add_argument('--verify', action='store_true',
+                         help='afterwards, check the mirror against Firestore and repair what differs')
+    command.set_defaults(handler=backfill_mysql)
+
+    command = commands.add_parser('profile-token', help='sign an X-Profile header for on-demand request profiling')
+    command.add_argument('--ttl', type=int, default=3600, help='seconds the token stays valid')
+    command.set_defaults(handler=profile_token)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.handler(args)
+    finally:
+        # Write-behind mode: wait for the mirror writes this command made.
+        if not mysql_mirror.flush(timeout=60):
+            print("MySQL mirror writes are still queued; they stay in the spool and are applied by the app's "
+                  "mirror worker or the next command.")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
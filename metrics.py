@@ -0,0 +1,295 @@
+"""
+Latency histograms and counters for the web routes and the firebase_service /
+mysql_service calls, rendered in the Prometheus text format, plus a log of
+slow operations.
+
+instrument(module, backend) wraps a module's public functions, so calls made
+through the module (including its calls to its own functions) are timed.
+Within a request, each backend's time is counted exclusively of the other's,
+so a route's time splits into Firestore, MySQL and everything else (handler
+code and JSON serialization); see http_request_backend_seconds.
+"""
+import datetime
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+# Routes and backend calls slower than this (seconds) go to the slow-operation
+# log; the most recent SLOW_LOG_SIZE entries are kept.
+SLOW_OPERATION_SECONDS = float(os.environ.get('SLOW_OPERATION_SECONDS', 1.0))
+SLOW_LOG_SIZE = int(os.environ.get('SLOW_LOG_SIZE', 200))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# name: (type, help, buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Time to handle a request, by route.', LATENCY_BUCKETS),
+    'http_request_backend_seconds': (
+        'histogram', 'Time a request spent in each backend; "other" is handler code and serialization.',
+        LATENCY_BUCKETS),
+    'http_request_size_bytes': ('histogram', 'Request body sizes, by route.', SIZE_BUCKETS),
+    'http_response_size_bytes': ('histogram', 'Response body sizes, by route (streamed responses excluded).',
+                                 SIZE_BUCKETS),
+    'backend_call_duration_seconds': ('histogram', 'Duration of firebase_service/mysql_service calls.',
+                                      LATENCY_BUCKETS),
+    'backend_call_documents': ('histogram', 'Documents or rows returned (or yielded) per call.', COUNT_BUCKETS),
+    'backend_call_errors_total': ('counter', 'Calls that raised, by exception type.', None),
+    'slow_operations_total': ('counter', f'Operations slower than {SLOW_OPERATION_SECONDS}s.', None),
+}
+
+# Functions that aren't worth a timer, or whose duration means nothing.
+_NOT_TIMED = {
+    'firebase_service': {'init', 'get_db', 'health', 'get_collection', 'bump_version', 'collection_version',
+                         'collection_etag', 'parse_expand', 'appointment_filters', 'id_ranges',
+                         'run_dashboard_reconciler'},
+    # row_to_document runs once per row.
+    'mysql_service': {'init', 'health', 'pool_stats', 'transaction', 'row_to_document'},
+}
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Thread-safe store of labelled histograms and counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self.slow_log = deque(maxlen=SLOW_LOG_SIZE)
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(METRICS[name][2])
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def slow(self, kind, name, seconds, **detail):
+        """Logs an operation that took longer than SLOW_OPERATION_SECONDS."""
+        entry = dict(at=datetime.datetime.now().isoformat(timespec='milliseconds'), kind=kind, name=name,
+                     seconds=round(seconds, 4), **detail)
+        print(f"Slow {kind} {name}: {seconds:.3f}s {detail or ''}")
+        self.inc('slow_operations_total', {'kind': kind})
+        with self._lock:
+            self.slow_log.append(entry)
+
+    def slow_operations(self):
+        with self._lock:
+            return list(self.slow_log)
+
+    def render(self):
+        """Everything recorded, in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+
+registry = Registry()
+
+
+# --- Per-request accounting ---
+# Each thread keeps a stack with the time spent in nested timed calls, so a
+# call's own (exclusive) time can be charged to its backend.
+_local = threading.local()
+
+
+def _enter():
+    frames = getattr(_local, 'frames', None)
+    if frames is None:
+        frames = _local.frames = []
+    frames.append(0.0)
+
+
+def _exit(backend, elapsed):
+    frames = _local.frames
+    children = frames.pop()
+    if frames:
+        frames[-1] += elapsed
+    backend_times = getattr(_local, 'backend_times', None)
+    if backend_times is not None:
+        backend_times[backend] = backend_times.get(backend, 0.0) + elapsed - children
+
+
+def start_request():
+    """Starts charging backend time on this thread to a new request."""
+    _local.backend_times = {}
+    _local.started = time.perf_counter()
+
+
+def finish_request(route, method, status, request_size=None, response_size=None):
+    """Records the request started on this thread by start_request()."""
+    started = getattr(_local, 'started', None)
+    backend_times = getattr(_local, 'backend_times', None) or {}
+    _local.started = _local.backend_times = None
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    labels = {'route': route, 'method': method}
+    registry.observe('http_request_duration_seconds', dict(labels, status=str(status)), elapsed)
+    split = dict(backend_times, other=max(elapsed - sum(backend_times.values()), 0.0))
+    for backend, seconds in split.items():
+        registry.observe('http_request_backend_seconds', dict(labels, backend=backend), seconds)
+    if request_size is not None:
+        registry.observe('http_request_size_bytes', labels, request_size)
+    if response_size is not None:
+        registry.observe('http_response_size_bytes', labels, response_size)
+    if elapsed >= SLOW_OPERATION_SECONDS:
+        registry.slow('route', f"{method} {route}", elapsed, status=status,
+                      backends={backend: round(seconds, 4) for backend, seconds in split.items()})
+
+
+# --- Backend calls ---
+def _document_count(result):
+    """How many documents or rows a call returned, when that can be told from the result."""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        if 'id' in result:
+            return 1
+        # {id: document} maps, as get_documents/get_rows_mysql return.
+        if result and all(isinstance(value, dict) for value in result.values()):
+            return len(result)
+        return None
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return None
+
+
+def _record_call(backend, name, elapsed, documents=None, error=None):
+    labels = {'backend': backend, 'operation': name}
+    registry.observe('backend_call_duration_seconds', labels, elapsed)
+    if documents is not None:
+        registry.observe('backend_call_documents', labels, documents)
+    if error is not None:
+        registry.inc('backend_call_errors_total', dict(labels, error=type(error).__name__))
+    if elapsed >= SLOW_OPERATION_SECONDS:
+        registry.slow(backend, name, elapsed, error=str(error) if error is not None else None)
+
+
+def _timed_items(backend, name, iterator, elapsed):
+    """
+    Passes on what a call returned as an iterator, timing only the work done
+    inside it (not the consumer's, between items); the call is recorded when
+    the iteration ends.
+    """
+    count = 0
+    error = None
+    try:
+        while True:
+            _enter()
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                step = time.perf_counter() - started
+                _exit(backend, step)
+                elapsed += step
+            count += 1
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+        _record_call(backend, name, elapsed, count, error)
+
+
+def _timed(backend, name, func):
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        _enter()
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            elapsed = time.perf_counter() - started
+            _exit(backend, elapsed)
+            _record_call(backend, name, elapsed, error=e)
+            raise
+        elapsed = time.perf_counter() - started
+        _exit(backend, elapsed)
+        # Generators (and functions returning one, like iter_documents) do their work as they are read.
+        if isinstance(result, Iterator):
+            return _timed_items(backend, name, result, elapsed)
+        _record_call(backend, name, elapsed, _document_count(result))
+        return result
+    return call
+
+
+def instrument(module, backend):
+    """Replaces the public functions defined in `module` with timed wrappers (once)."""
+    if not METRICS_ENABLED or getattr(module, '_metrics_backend', None):
+        return
+    skipped = _NOT_TIMED.get(module.__name__, set())
+    for name, value in list(vars(module).items()):
+        if name.startswith('_') or name in skipped or not inspect.isfunction(value):
+            continue
+        if value.__module__ != module.__name__:
+            continue
+        setattr(module, name, _timed(backend, name, value))
+    module._metrics_backend = backend
@@ -0,0 +1,679 @@
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+import mysql_service
+
+# 'sync' calls mysql_service inside the request, as before; 'write-behind'
+# queues mirror operations and applies them from a background worker.
+MIRROR_MODE = os.environ.get('MYSQL_MIRROR_MODE', 'sync')
+
+# Write-behind settings. Every operation is appended to the spool file before
+# it is queued, so nothing is lost if the queue is full or the process exits;
+# the checkpoint file records the last sequence number applied to MySQL.
+# Each process spools to its own file, spool_path.<pid>, which it keeps locked
+# while it runs; spools left by processes that have exited are applied by
+# whichever process's worker finds them first (see WriteBehindMirror.adopt).
+MIRROR_CONFIG = {
+    'spool_path': os.environ.get(
+        'MYSQL_SPOOL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mysql_mirror.spool')),
+    'fsync': os.environ.get('MYSQL_SPOOL_FSYNC', '').lower() in ('1', 'true', 'yes'),
+    'queue_size': int(os.environ.get('MYSQL_MIRROR_QUEUE_SIZE', 10000)),
+    'batch_size': int(os.environ.get('MYSQL_MIRROR_BATCH_SIZE', 500)),
+    'flush_interval': float(os.environ.get('MYSQL_MIRROR_FLUSH_INTERVAL', 0.05)),
+    'max_backoff': float(os.environ.get('MYSQL_MIRROR_MAX_BACKOFF', 30))
+}
+
+# Mirror operations that can be merged: within a batch only the last one per
+# (table, id) matters, and all of them become one executemany per table.
+# Their arguments are the row in mysql_service.TABLE_COLUMNS order.
+COALESCIBLE = {}
+for _table, _singular in [('patients', 'patient'), ('doctors', 'doctor'), ('appointments', 'appointment'),
+                          ('billing', 'bill'), ('inventory', 'inventory')]:
+    COALESCIBLE[f'add_{_singular}_mysql'] = (_table, 'upsert')
+    COALESCIBLE[f'update_{_singular}_mysql'] = (_table, 'upsert')
+    COALESCIBLE[f'delete_{_singular}_mysql'] = (_table, 'delete')
+
+# How often (seconds) a worker looks for spools of exited processes.
+ADOPT_INTERVAL = 60
+
+_ALL_TABLES = ('patients', 'doctors', 'appointments', 'billing', 'inventory')
+
+
+def _tables_of(op, args):
+    """The tables a mirror operation writes to, so reads know what to wait for."""
+    if op in COALESCIBLE:
+        return (COALESCIBLE[op][0],)
+    if op in ('upsert_rows_mysql', 'delete_rows_mysql') and args:
+        return (args[0],)
+    if op == 'apply_payment_mysql':
+        return ('billing', 'inventory')
+    return _ALL_TABLES
+
+
+# MySQL errors that say nothing about the data: lock wait timeout, deadlock.
+_TRANSIENT_ERRNOS = {1205, 1213}
+
+
+def enabled():
+    return MIRROR_MODE == 'write-behind'
+
+
+def _lock_file(path, wait=True):
+    """
+    Opens `path` and takes an exclusive lock on it, which the OS drops if the
+    process dies. Returns the open file (close it to unlock), or None if
+    `wait` is false and another process holds the lock.
+    """
+    while True:
+        f = open(path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if wait else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            if wait:
+                raise
+            return None
+        try:
+            # The holder we waited for may have deleted the file; lock the one at `path` now.
+            if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+@contextmanager
+def _locked(path):
+    f = _lock_file(path)
+    try:
+        yield
+    finally:
+        f.close()
+
+
+def _is_permanent(error):
+    """
+    Whether a mirror operation failed because of its data (a value the column
+    rejects, a broken constraint, a bad argument), so retrying it would fail
+    the same way. Connection, pool and lock errors are worth retrying.
+    """
+    if isinstance(error, ValueError):
+        return True
+    errors = mysql.connector.errors
+    return (isinstance(error, errors.DatabaseError) and not isinstance(error, errors.OperationalError)
+            and getattr(error, 'errno', None) not in _TRANSIENT_ERRNOS)
+
+
+# --- Degraded tables ---
+# A table is degraded once a mirror write to it has failed for good: in sync
+# mode any failure, in write-behind mode a dead-lettered operation. Its reads
+# go to Firestore until a consistency check finds it consistent (or repairs
+# it) or a backfill copies it again. The marks live in a file next to the
+# spool, so manage.py, which runs as its own process, can clear them.
+DEGRADED_PATH = MIRROR_CONFIG['spool_path'] + '.degraded'
+_degraded = {}
+_degraded_mtime = None
+_degraded_lock = threading.Lock()
+
+
+def _load_degraded():
+    """The marks, re-read only when the file has changed. Call with _degraded_lock held."""
+    global _degraded, _degraded_mtime
+    try:
+        mtime = os.stat(DEGRADED_PATH).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime != _degraded_mtime:
+        try:
+            with open(DEGRADED_PATH, encoding='utf-8') as f:
+                _degraded = json.load(f)
+        except FileNotFoundError:
+            _degraded = {}
+        except ValueError:
+            # Caught mid-write by another process; use what we had.
+            return _degraded
+        _degraded_mtime = mtime
+    return _degraded
+
+
+def _save_degraded(marks):
+    global _degraded, _degraded_mtime
+    tmp_path = DEGRADED_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(marks, f)
+    os.replace(tmp_path, DEGRADED_PATH)
+    _degraded = marks
+    _degraded_mtime = os.stat(DEGRADED_PATH).st_mtime_ns
+
+
+def mark_degraded(tables, reason):
+    """Marks `tables` as no longer matching Firestore, so reads stop using them."""
+    now = time.time()
+    with _degraded_lock, _locked(DEGRADED_PATH + '.lock'):
+        marks = dict(_load_degraded())
+        new = [table for table in tables if table not in marks]
+        for table in tables:
+            # `last` is what clear_degraded() compares with, so a later failure isn't cleared by an earlier check.
+            marks[table] = {'since': marks.get(table, {}).get('since', now), 'last': now, 'reason': str(reason)}
+        try:
+            _save_degraded(marks)
+        except OSError as e:
+            print(f"Error saving degraded MySQL tables: {e}")
+            _degraded.update(marks)
+    if new:
+        print(f"MySQL mirror of {', '.join(new)} is degraded; reading it from Firestore until it is checked: {reason}")
+
+
+def clear_degraded(tables, before):
+    """
+    Clears the marks of `tables` whose last failure happened before `before`
+    (a time.time() from when the check or backfill started). Returns the
+    tables cleared.
+    """
+    with _degraded_lock, _locked(DEGRADED_PATH + '.lock'):
+        marks = dict(_load_degraded())
+        cleared = [table for table in tables if table in marks and marks[table]['last'] < before]
+        if cleared:
+            for table in cleared:
+                del marks[table]
+            _save_degraded(marks)
+    return cleared
+
+
+def degraded():
+    """{table: {'since', 'last', 'reason'}} for the degraded tables."""
+    with _degraded_lock:
+        return dict(_load_degraded())
+
+
+def apply_now(op, *args):
+    """Runs a mirror operation right away (sync mode), marking its tables degraded if it fails."""
+    try:
+        getattr(mysql_service, op)(*args)
+    except Exception as e:
+        mark_degraded(_tables_of(op, args), f"{op}: {e}")
+        raise
+
+
+class WriteBehindMirror:
+    """
+    Applies mirror operations to MySQL off the request path.
+
+    submit() assigns each operation a sequence number, appends it to the spool
+    and queues it. The worker applies operations strictly in sequence order,
+    in batches: coalescible ones are merged per (table, id) and written with
+    one executemany per table inside a single transaction; anything else runs
+    on its own, in order. Operations missing from the queue (because it was
+    full, or the process restarted) are read back from the spool. An
+    operation MySQL rejects for its data is moved to the dead-letter file
+    (for merged rows, just the rejected row); any other failure is retried
+    with exponential backoff from the first uncommitted operation.
+    """
+
+    def __init__(self, spool_path, dead_letter_path=None, base_path=None, fsync=False, queue_size=10000,
+                 batch_size=500, flush_interval=0.05, max_backoff=30.0, owner_lock=None):
+        """
+        `base_path`, if given, is the path the process spools are named after;
+        the worker then adopts the spools of exited processes. `owner_lock` is
+        the already locked spool lock file, for adopt().
+        """
+        self.spool_path = spool_path
+        self.checkpoint_path = spool_path + '.ckpt'
+        self.lock_path = spool_path + '.lock'
+        self.dead_letter_path = dead_letter_path or spool_path + '.dead'
+        self.base_path = base_path
+        # Held for as long as this object owns the spool.
+        self._owner_lock = owner_lock or _lock_file(self.lock_path)
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pending = {}
+        self._timestamps = {}
+        # Last sequence number written to each table, for is_fresh().
+        self._table_seqs = {}
+        self.applied_seq = self._read_checkpoint()
+        self._next_seq = max(self.applied_seq, self._scan_spool()) + 1
+        self._spool = open(self.spool_path, 'a', encoding='utf-8')
+        self._dirty = self._next_seq > 1
+        self.submitted = 0
+        self.applied = 0
+        self.batches = 0
+        self.failures = 0
+        self.dead_letters = 0
+        self.overflows = 0
+        self.adopted = 0
+        self.backoff = 0.0
+        self.last_error = None
+        self._adopt_at = 0.0
+
+    # --- Spool and checkpoint ---
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_checkpoint(self, seq):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(seq))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _iter_spool(self):
+        try:
+            with open(self.spool_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-append.
+                        continue
+        except FileNotFoundError:
+            return
+
+    def _scan_spool(self):
+        """Returns the last spooled sequence number, noting which tables the entries touch."""
+        last = 0
+        for entry in self._iter_spool():
+            last = max(last, entry['seq'])
+            for table in _tables_of(entry['op'], entry['args']):
+                self._table_seqs[table] = max(self._table_seqs.get(table, 0), entry['seq'])
+        return last
+
+    def _read_from_spool(self, seqs):
+        found = {}
+        for entry in self._iter_spool():
+            if entry['seq'] in seqs:
+                found[entry['seq']] = entry
+                if len(found) == len(seqs):
+                    break
+        return found
+
+    def _compact(self):
+        """Truncates the spool once everything in it has been applied."""
+        with self._lock:
+            if self._dirty and self.applied_seq == self._next_seq - 1 and self._queue.empty():
+                self._spool.close()
+                self._spool = open(self.spool_path, 'w', encoding='utf-8')
+                self._dirty = False
+
+    # --- Spools of exited processes ---
+    @classmethod
+    def adopt(cls, spool_path, **config):
+        """
+        Takes over the spool of a process that has exited. Returns None if
+        its owner is still running (or another process got to it first).
+        """
+        lock = _lock_file(spool_path + '.lock', wait=False)
+        if lock is None:
+            return None
+        if not os.path.exists(spool_path):
+            # Adopted and removed already; don't recreate it.
+            lock.close()
+            return None
+        return cls(spool_path, owner_lock=lock, **config)
+
+    def drain(self):
+        """Applies everything left in the spool, on the calling thread."""
+        for entry in self._iter_spool():
+            if entry['seq'] > self.applied_seq:
+                self._pending[entry['seq']] = entry
+                self._timestamps[entry['seq']] = entry['ts']
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._apply(batch)
+
+    def close(self, remove=False):
+        """Releases the spool; with `remove`, deletes it and its checkpoint first."""
+        self._spool.close()
+        if remove:
+            for path in (self.spool_path, self.checkpoint_path, self.lock_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self._owner_lock.close()
+
+    def _adopt_orphans(self):
+        """Applies, then deletes, the spools of processes that exited with operations unapplied."""
+        # The bare base path is the single spool all processes shared before.
+        for path in [self.base_path] + sorted(glob.glob(glob.escape(self.base_path) + '.*')):
+            if path != self.base_path and not path[len(self.base_path) + 1:].isdigit() or path == self.spool_path:
+                continue
+            if not os.path.exists(path):
+                continue
+            orphan = WriteBehindMirror.adopt(path, dead_letter_path=self.dead_letter_path,
+                                             batch_size=self.batch_size)
+            if orphan is None:
+                continue
+            try:
+                orphan.drain()
+            except Exception as e:
+                print(f"Error applying the MySQL mirror spool {path} of an exited process (will retry): {e}")
+                orphan.close()
+                continue
+            print(f"Applied {orphan.applied} MySQL mirror operations left in {path}.")
+            self.adopted += orphan.applied
+            orphan.close(remove=True)
+
+    # --- Producer side ---
+    def submit(self, op, args):
+        """Records a mirror operation; returns once it is durably spooled."""
+        entry = {'seq': 0, 'op': op, 'args': list(args), 'ts': time.time()}
+        with self._lock:
+            entry['seq'] = self._next_seq
+            self._next_seq += 1
+            self.submitted += 1
+            self._spool.write(json.dumps(entry, default=str) + '\n')
+            self._spool.flush()
+            self._dirty = True
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            self._timestamps[entry['seq']] = entry['ts']
+            for table in _tables_of(op, args):
+                self._table_seqs[table] = entry['seq']
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                # Still safe: the worker reads it back from the spool.
+                self.overflows += 1
+        self.start()
+
+    # --- Worker side ---
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name='mysql-write-behind', daemon=True)
+                    self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def flush(self, timeout=None):
+        """Blocks until everything submitted so far has been applied (or timeout)."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        target = self._next_seq - 1
+        while self.applied_seq < target:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.flush_interval)
+        return True
+
+    def _drain_queue(self, wait):
+        try:
+            entry = self._queue.get(timeout=wait)
+            self._pending[entry['seq']] = entry
+        except queue.Empty:
+            return
+        while len(self._pending) < self.batch_size * 2:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._pending[entry['seq']] = entry
+
+    def _next_batch(self):
+        """Collects the next in-order run of operations after applied_seq."""
+        last = min(self._next_seq - 1, self.applied_seq + self.batch_size)
+        wanted = range(self.applied_seq + 1, last + 1)
+        missing = {seq for seq in wanted if seq not in self._pending}
+        if missing:
+            found = self._read_from_spool(missing)
+            with self._lock:
+                for seq, entry in found.items():
+                    self._timestamps.setdefault(seq, entry['ts'])
+            self._pending.update(found)
+        batch = []
+        for seq in wanted:
+            entry = self._pending.get(seq)
+            if entry is None:
+                # Not readable yet (e.g. still being written); stop short of it.
+                break
+            batch.append(entry)
+        return batch
+
+    def _advance(self, entries):
+        """Records `entries` (the start of what is left of a batch) as applied."""
+        if not entries:
+            return
+        last_seq = entries[-1]['seq']
+        with self._lock:
+            self.applied_seq = last_seq
+            for entry in entries:
+                self._pending.pop(entry['seq'], None)
+                self._timestamps.pop(entry['seq'], None)
+        self._write_checkpoint(last_seq)
+        self.applied += len(entries)
+
+    def _apply(self, batch):
+        """
+        Applies a batch as a series of commits: each run of merged row writes,
+        then each other operation on its own. The checkpoint advances after
+        every commit, so a retry resumes after the last one instead of
+        repeating operations (like payments) that are already in MySQL.
+        """
+        upserts = {}
+        deletes = {}
+        merged = []
+        # The entry each merged row came from, to dead-letter if the row is rejected.
+        sources = {}
+
+        def flush_merged():
+            if upserts or deletes:
+                try:
+                    with mysql_service.transaction() as conn:
+                        for table, rows in upserts.items():
+                            mysql_service.upsert_rows_mysql(table, list(rows.values()), conn)
+                        for table, ids in deletes.items():
+                            mysql_service.delete_rows_mysql(table, list(ids), conn)
+                except Exception as e:
+                    if not _is_permanent(e):
+                        raise
+                    # One bad row fails the whole executemany; find it.
+                    self._apply_singly(upserts, deletes, sources)
+                upserts.clear()
+                deletes.clear()
+                sources.clear()
+            self._advance(merged)
+            merged.clear()
+
+        for entry in batch:
+            op, args = entry['op'], entry['args']
+            merged.append(entry)
+            if op in COALESCIBLE:
+                table, kind = COALESCIBLE[op]
+                doc_id = args[0]
+                sources[(table, doc_id)] = entry
+                if kind == 'upsert':
+                    deletes.get(table, set()).discard(doc_id)
+                    upserts.setdefault(table, {})[doc_id] = tuple(args)
+                else:
+                    upserts.get(table, {}).pop(doc_id, None)
+                    deletes.setdefault(table, set()).add(doc_id)
+            else:
+                # Order matters relative to row writes, so flush what we have first.
+                merged.pop()
+                flush_merged()
+                try:
+                    if not op.endswith('_mysql') or not hasattr(mysql_service, op):
+                        raise ValueError(f"Unknown mirror operation: {op}")
+                    getattr(mysql_service, op)(*args)
+                except Exception as e:
+                    if not _is_permanent(e):
+                        raise
+                    # The data itself is at fault; retrying cannot help.
+                    self._dead_letter(entry, e)
+                self._advance([entry])
+        flush_merged()
+
+    def _apply_singly(self, upserts, deletes, sources):
+        """Applies merged rows one at a time, dead-lettering the ones MySQL rejects."""
+        writes = [('upsert_rows_mysql', table, row, doc_id)
+                  for table, rows in upserts.items() for doc_id, row in rows.items()]
+        writes += [('delete_rows_mysql', table, doc_id, doc_id) for table, ids in deletes.items() for doc_id in ids]
+        for op, table, row, doc_id in writes:
+            try:
+                getattr(mysql_service, op)(table, [row])
+            except Exception as e:
+                if not _is_permanent(e):
+                    raise
+                self._dead_letter(sources[(table, doc_id)], e)
+
+    def _dead_letter(self, entry, error):
+        print(f"Skipping MySQL mirror operation {entry['seq']} ({entry['op']}): {error}")
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(entry, error=str(error)), default=str) + '\n')
+        self.dead_letters += 1
+        mark_degraded(_tables_of(entry['op'], entry['args']), f"{entry['op']}: {error}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.base_path is not None and time.monotonic() >= self._adopt_at:
+                self._adopt_at = time.monotonic() + ADOPT_INTERVAL
+                self._adopt_orphans()
+            # Only linger for more operations to merge when there is no backlog.
+            backlog = self.applied_seq < self._next_seq - 1
+            self._drain_queue(0 if backlog else self.flush_interval)
+            batch = self._next_batch()
+            if not batch:
+                if not self._pending and self.applied_seq == self._next_seq - 1:
+                    self._compact()
+                continue
+            try:
+                self._apply(batch)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                self.backoff = min(self.max_backoff, self.backoff * 2 if self.backoff else 0.5)
+                print(f"Error applying MySQL mirror batch (retrying in {self.backoff:.1f}s): {e}")
+                self._stop.wait(self.backoff)
+                continue
+            self.backoff = 0.0
+            self.batches += 1
+
+    def is_fresh(self, table, max_lag=0.0):
+        """
+        Whether MySQL already has every write submitted so far to `table`, or
+        the oldest write still pending is at most `max_lag` seconds old.
+        """
+        with self._lock:
+            if self.applied_seq >= self._table_seqs.get(table, 0):
+                return True
+            oldest = self._timestamps.get(self.applied_seq + 1)
+            return oldest is not None and time.time() - oldest <= max_lag
+
+    def stats(self):
+        with self._lock:
+            depth = self._next_seq - 1 - self.applied_seq
+            oldest = self._timestamps.get(self.applied_seq + 1)
+            return {
+                'mode': MIRROR_MODE,
+                'depth': depth,
+                'queued': self._queue.qsize(),
+                'lag_seconds': time.time() - oldest if depth and oldest else 0.0,
+                'applied_seq': self.applied_seq,
+                'applied': self.applied,
+                'batches': self.batches,
+                'failures': self.failures,
+                'dead_letters': self.dead_letters,
+                'overflows': self.overflows,
+                'adopted': self.adopted,
+                'spool_path': self.spool_path,
+                'backoff_seconds': self.backoff,
+                'last_error': self.last_error,
+                'worker_alive': self._thread is not None and self._thread.is_alive()
+            }
+
+
+_mirror = None
+_mirror_pid = None
+_mirror_lock = threading.Lock()
+
+
+def get_mirror():
+    """Returns this process's write-behind mirror, creating it on first use (and again after a fork)."""
+    global _mirror, _mirror_pid
+    if _mirror is None or _mirror_pid != os.getpid():
+        with _mirror_lock:
+            if _mirror is None or _mirror_pid != os.getpid():
+                if _mirror is not None:
+                    # Inherited from the parent through fork; the parent still owns that spool.
+                    _mirror.close()
+                config = dict(MIRROR_CONFIG)
+                base_path = config.pop('spool_path')
+                _mirror = WriteBehindMirror(f'{base_path}.{os.getpid()}', dead_letter_path=base_path + '.dead',
+                                            base_path=base_path, **config)
+                _mirror_pid = os.getpid()
+    return _mirror
+
+
+def submit(op, *args):
+    get_mirror().submit(op, args)
+
+
+def flush(timeout=None):
+    """
+    Waits (up to `timeout` seconds) until the operations this process
+    submitted have been applied; returns whether they were. Returns at once
+    if it submitted none.
+    """
+    if not enabled() or _mirror is None or _mirror_pid != os.getpid() or not _mirror.submitted:
+        return True
+    _mirror.start()
+    return _mirror.flush(timeout)
+
+
+def resume():
+    """Starts the worker so operations left in the spool by a previous run are applied."""
+    if enabled():
+        get_mirror().start()
+
+
+def is_fresh(table, max_lag=0.0):
+    """
+    Whether reads of `table` can be served from MySQL: it isn't degraded and,
+    in write-behind mode, the mirror has caught up (see
+    WriteBehindMirror.is_fresh). In sync mode MySQL is written inside the
+    request, so a table that isn't degraded is current.
+    """
+    if table in degraded():
+        return False
+    if not enabled():
+        return True
+    return get_mirror().is_fresh(table, max_lag)
+
+
+def stats():
+    if not enabled():
+        return {'mode': MIRROR_MODE}
+    return get_mirror().stats()
@@ -1,6 +1,16 @@
 import mysql.connector
 from mysql.connector import Error
+import datetime
+import hashlib
 import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from decimal import Decimal
+import pagination
+import timestamps
 
 # MySQL connection details
 DB_CONFIG = {
@@ -11,8 +21,208 @@ DB_CONFIG = {
     'database': 'medai'
 }
 
-# Global connection
-conn = None
+# Connection pool settings. `size` caps open connections, `timeout` is how
+# long a checkout may wait for one (seconds), connections older than `recycle`
+# seconds are replaced, and idle ones are pinged after `ping_interval` seconds.
+POOL_CONFIG = {
+    'size': int(os.environ.get('MYSQL_POOL_SIZE', 8)),
+    'timeout': float(os.environ.get('MYSQL_POOL_TIMEOUT', 5)),
+    'recycle': float(os.environ.get('MYSQL_POOL_RECYCLE', 1800)),
+    'ping_interval': float(os.environ.get('MYSQL_POOL_PING_INTERVAL', 30))
+}
+
+# Global connection pool
+pool = None
+
+# Column order of every mirror table. The *_mysql functions take their
+# arguments in this same order.
+TABLE_COLUMNS = {
+    'patients': ('id', 'name', 'contact', 'history', 'dob', 'gender'),
+    'doctors': ('id', 'name', 'specialty', 'schedule', 'fee'),
+    'appointments': ('id', 'patient', 'doctor', 'datetime'),
+    'billing': ('id', 'patient', 'items', 'total', 'status'),
+    'inventory': ('id', 'item', 'quantity', 'supplier', 'price'),
+}
+
+# Columns stored as JSON text in MySQL.
+JSON_COLUMNS = {'billing': ('items',)}
+
+# Secondary indexes backing the keyset queries in get_page_mysql. InnoDB
+# appends the primary key to each of them, so they also serve (column, id).
+TABLE_INDEXES = {
+    'patients': {'idx_patients_name': 'name', 'idx_patients_dob': 'dob'},
+    'doctors': {'idx_doctors_name': 'name', 'idx_doctors_specialty': 'specialty', 'idx_doctors_fee': 'fee'},
+    'appointments': {'idx_appointments_patient': 'patient', 'idx_appointments_doctor': 'doctor',
+                     'idx_appointments_datetime': 'datetime',
+                     # Range queries for one doctor's or one patient's calendar.
+                     'idx_appointments_doctor_datetime': 'doctor, datetime',
+                     'idx_appointments_patient_datetime': 'patient, datetime'},
+    'billing': {'idx_billing_patient': 'patient', 'idx_billing_status': 'status', 'idx_billing_total': 'total'},
+    'inventory': {'idx_inventory_item': 'item', 'idx_inventory_supplier': 'supplier',
+                  'idx_inventory_quantity': 'quantity', 'idx_inventory_price': 'price'},
+}
+
+class _PooledConnection:
+    """A connection plus the bookkeeping the pool needs to recycle it."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """
+    Thread-safe MySQL connection pool. Connections are opened on demand up to
+    `size`; a checkout waits up to `timeout` seconds for one to come back.
+    Idle connections are pinged before reuse and replaced when broken or
+    older than `recycle` seconds, so a dropped server connection heals itself.
+    """
+
+    def __init__(self, config, size=8, timeout=5.0, recycle=1800.0, ping_interval=30.0):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._open = 0
+        self._in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.recycled = 0
+        self.broken = 0
+        self.peak_in_use = 0
+
+    def _connect(self):
+        return _PooledConnection(mysql.connector.connect(**self.config))
+
+    def _close(self, entry):
+        try:
+            entry.conn.close()
+        except Error:
+            pass
+
+    def _checkout_ready(self, entry):
+        """Returns a usable connection for an idle entry, replacing it if needed."""
+        now = time.monotonic()
+        if now - entry.created_at > self.recycle:
+            self._close(entry)
+            with self._cond:
+                self.recycled += 1
+            return self._connect()
+        if now - entry.last_used > self.ping_interval:
+            try:
+                entry.conn.ping(reconnect=False)
+            except Error:
+                self._close(entry)
+                with self._cond:
+                    self.broken += 1
+                return self._connect()
+        return entry
+
+    def acquire(self):
+        """Checks out a connection, waiting at most `timeout` seconds."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    # LIFO: reuse the most recently returned (warmest) connection.
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    entry = None
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise ConnectionError(f"Timed out after {self.timeout}s waiting for a MySQL connection.")
+                waited = True
+                self._cond.wait(remaining)
+            wait = time.monotonic() - started
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self._in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self._in_use)
+
+        try:
+            return self._connect() if entry is None else self._checkout_ready(entry)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, entry, discard=False):
+        """Returns a connection; any transaction left open is rolled back."""
+        if not discard:
+            try:
+                if entry.conn.in_transaction:
+                    entry.conn.rollback()
+            except Error:
+                discard = True
+        if discard:
+            self._close(entry)
+        else:
+            entry.last_used = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """`with pool.connection() as conn:` checks a connection out and back in."""
+        entry = self.acquire()
+        discard = False
+        try:
+            yield entry.conn
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            # The connection itself is suspect; don't hand it to anyone else.
+            discard = True
+            raise
+        finally:
+            self.release(entry, discard)
+
+    def close(self):
+        """Closes idle connections; checked-out ones close when returned."""
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.pop())
+                self._open -= 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'utilization': self._in_use / self.size if self.size else 0.0,
+                'peak_in_use': self.peak_in_use,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'avg_wait_seconds': self.total_wait / self.checkouts if self.checkouts else 0.0,
+                'max_wait_seconds': self.max_wait,
+                'recycled': self.recycled,
+                'broken': self.broken
+            }
+
 
 def create_database_if_not_exists():
     """Create the 'medai' database if it doesn't exist."""
@@ -31,11 +241,8 @@ def create_database_if_not_exists():
     except Error as e:
         print(f"Error creating database: {e}")
 
-def create_tables():
+def create_tables(conn):
     """Create necessary tables if they don't exist."""
-    global conn
-    if conn is None:
-        return
     cursor = conn.cursor()
 
     # Patients table
@@ -67,7 +274,7 @@ def create_tables():
             id VARCHAR(255) PRIMARY KEY,
             patient VARCHAR(255),
             doctor VARCHAR(255),
-            datetime VARCHAR(255)
+            datetime DATETIME NULL
         )
     """)
 
@@ -95,36 +302,420 @@ def create_tables():
 
     conn.commit()
     cursor.close()
+    create_indexes(conn)
+
+def create_indexes(conn):
+    """Create the secondary indexes in TABLE_INDEXES that don't exist yet."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT TABLE_NAME, INDEX_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = %s",
+        (DB_CONFIG['database'],)
+    )
+    existing = {(table, index) for table, index in cursor.fetchall()}
+    for table, indexes in TABLE_INDEXES.items():
+        for index_name, columns in indexes.items():
+            if (table, index_name) not in existing:
+                cursor.execute(f"CREATE INDEX {index_name} ON {table} ({columns})")
+    conn.commit()
+    cursor.close()
 
-def init_mysql():
-    """Initialize MySQL connection and create database/tables."""
-    global conn
+# --- Initialization ---
+# Nothing connects at import. init() creates the pool, which connects on
+# demand, and makes sure the schema exists on first use. MYSQL_SCHEMA_CHECK
+# decides how:
+#   'auto' (default)  one query compares the fingerprint the last check recorded
+#                     with SCHEMA_FINGERPRINT; the DDL only runs if they differ
+#   'always'          runs create_database_if_not_exists/create_tables every time
+#   'skip'            assumes the schema is in place (see `manage.py init`)
+# A failed check is retried on use after MYSQL_SCHEMA_RETRY_AFTER seconds.
+MYSQL_SCHEMA_CHECK = os.environ.get('MYSQL_SCHEMA_CHECK', 'auto').lower()
+MYSQL_SCHEMA_RETRY_AFTER = float(os.environ.get('MYSQL_SCHEMA_RETRY_AFTER', 30))
+# Bump SCHEMA_REVISION when create_tables changes in a way the column and
+# index definitions above don't show.
+SCHEMA_REVISION = 1
+SCHEMA_FINGERPRINT = hashlib.sha256(
+    repr((SCHEMA_REVISION, TABLE_COLUMNS, JSON_COLUMNS, TABLE_INDEXES)).encode()).hexdigest()[:16]
+_init_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_schema_verified = False
+_schema_error = None
+_schema_retry_at = 0.0
+
+
+def _create_pool():
+    """Creates the connection pool (once); doesn't connect."""
+    global pool
+    if pool is None:
+        with _init_lock:
+            if pool is None:
+                # The pool exists even if MySQL is down right now; it connects on demand,
+                # so the mirror recovers once the server is back.
+                pool = ConnectionPool(DB_CONFIG, **POOL_CONFIG)
+    return pool
+
+def _schema_recorded():
+    """Whether the last schema check recorded SCHEMA_FINGERPRINT; False when that can't be read."""
     try:
-        create_database_if_not_exists()
-        conn = mysql.connector.connect(**DB_CONFIG)
-        create_tables()
-        print("MySQL initialized successfully.")
-    except Error as e:
-        print(f"Error initializing MySQL: {e}")
-        conn = None
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT fingerprint FROM schema_meta WHERE id = 1")
+                row = cursor.fetchone()
+            finally:
+                cursor.close()
+    except Error:
+        # No database or no schema_meta table yet.
+        return False
+    return row is not None and row[0] == SCHEMA_FINGERPRINT
+
+def _record_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_meta (
+            id TINYINT PRIMARY KEY,
+            fingerprint VARCHAR(64),
+            checked_at DATETIME
+        )
+    """)
+    cursor.execute(
+        "INSERT INTO schema_meta (id, fingerprint, checked_at) VALUES (1, %s, NOW()) "
+        "ON DUPLICATE KEY UPDATE fingerprint=VALUES(fingerprint), checked_at=VALUES(checked_at)",
+        (SCHEMA_FINGERPRINT,)
+    )
+    conn.commit()
+    cursor.close()
+
+def ensure_schema(force=False):
+    """
+    Makes sure the database, tables and indexes exist, as MYSQL_SCHEMA_CHECK
+    says; `force` runs the DDL regardless (and doesn't wait out a retry).
+    Returns whether the schema is known to be in place.
+    """
+    global _schema_verified, _schema_error, _schema_retry_at
+    if _schema_verified and not force:
+        return True
+    _create_pool()
+    with _schema_lock:
+        if not force:
+            if _schema_verified:
+                return True
+            if MYSQL_SCHEMA_CHECK == 'skip':
+                _schema_verified = True
+                return True
+            if time.monotonic() < _schema_retry_at:
+                return False
+        try:
+            if force or MYSQL_SCHEMA_CHECK == 'always' or not _schema_recorded():
+                create_database_if_not_exists()
+                with pool.connection() as conn:
+                    create_tables(conn)
+                    _record_schema(conn)
+                print("MySQL initialized successfully.")
+            _schema_verified = True
+            _schema_error = None
+        except (Error, ConnectionError) as e:
+            print(f"Error initializing MySQL: {e}")
+            _schema_error = str(e)
+            _schema_retry_at = time.monotonic() + MYSQL_SCHEMA_RETRY_AFTER
+        return _schema_verified
+
+def init():
+    """Creates the connection pool (once) and checks the schema on first use. Returns the pool."""
+    _create_pool()
+    if not _schema_verified:
+        ensure_schema()
+    return pool
+
+def health(probe=False):
+    """
+    Whether the mirror is usable: the schema has been checked and, with
+    `probe`, a SELECT 1 round trip succeeds (timed).
+    """
+    status = {'ready': ensure_schema(), 'schema_check': MYSQL_SCHEMA_CHECK, 'error': _schema_error}
+    if status['ready'] and probe:
+        started = time.monotonic()
+        try:
+            execute_query("SELECT 1", fetch=True)
+        except (Error, ConnectionError) as e:
+            status.update(ready=False, error=str(e))
+        status['probe_seconds'] = round(time.monotonic() - started, 4)
+    return status
 
-# Initialize on import
-init_mysql()
+def pool_stats():
+    """Utilization and wait-time counters of the connection pool."""
+    return _create_pool().stats()
 
 # --- Helper functions ---
 def execute_query(query, params=None, fetch=False):
-    """Execute a query and optionally fetch results."""
+    """Execute a query on a pooled connection and optionally fetch results."""
+    with init().connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(query, params or ())
+            if fetch:
+                result = cursor.fetchall()
+            else:
+                conn.commit()
+                result = None
+        finally:
+            cursor.close()
+    return result
+
+@contextmanager
+def transaction():
+    """`with transaction() as conn:` runs statements in one transaction on a pooled connection."""
+    with init().connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def _row_params(table, row):
+    """Prepares a row (a tuple in TABLE_COLUMNS order) for use as query parameters."""
+    json_columns = JSON_COLUMNS.get(table, ())
+    if not json_columns:
+        return tuple(row)
+    return tuple(
+        json.dumps(value) if column in json_columns else value
+        for column, value in zip(TABLE_COLUMNS[table], row)
+    )
+
+def upsert_rows_mysql(table, rows, conn=None):
+    """Insert-or-update many rows (tuples in TABLE_COLUMNS order) with one executemany."""
+    if not rows:
+        return
+    columns = TABLE_COLUMNS[table]
+    query = (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON DUPLICATE KEY UPDATE {', '.join(f'{column}=VALUES({column})' for column in columns[1:])}"
+    )
+    params = [_row_params(table, row) for row in rows]
     if conn is None:
-        raise ConnectionError("MySQL is not initialized.")
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute(query, params or ())
-    if fetch:
-        result = cursor.fetchall()
+        with transaction() as conn:
+            _executemany(conn, query, params)
     else:
-        conn.commit()
-        result = None
-    cursor.close()
-    return result
+        _executemany(conn, query, params)
+
+def delete_rows_mysql(table, ids, conn=None):
+    """Delete many rows by ID, a bounded number of IDs per statement."""
+    ids = list(ids)
+    if not ids:
+        return
+    if conn is None:
+        with transaction() as conn:
+            _delete_rows(conn, table, ids)
+    else:
+        _delete_rows(conn, table, ids)
+
+# IDs per ... WHERE id IN (...) statement.
+IN_CHUNK_SIZE = 1000
+
+def _delete_rows(conn, table, ids):
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(ids), IN_CHUNK_SIZE):
+            chunk = ids[start:start + IN_CHUNK_SIZE]
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+    finally:
+        cursor.close()
+
+def _executemany(conn, query, params):
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(query, params)
+    finally:
+        cursor.close()
+
+def row_to_document(table, row):
+    """Convert a mirror row into the same shape firebase_service returns."""
+    doc = {}
+    for column, value in row.items():
+        if isinstance(value, Decimal):
+            value = float(value)
+        elif isinstance(value, datetime.datetime):
+            value = value.strftime(timestamps.DATETIME_FORMAT)
+        elif column == 'items' and isinstance(value, (str, bytes)):
+            value = json.loads(value)
+        doc[column] = value
+    return doc
+
+def _filter_conditions(table, filters):
+    """Turns (column, operator, value) filters into SQL conditions and parameters."""
+    conditions = []
+    params = []
+    for field, op, value in filters:
+        if field not in TABLE_COLUMNS[table] or op not in pagination.FILTER_OPERATORS:
+            raise ValueError(f"Cannot filter {table} on '{field} {op}'.")
+        conditions.append(f"{field} {'=' if op == '==' else op} %s")
+        params.append(value)
+    return conditions, params
+
+def get_page_mysql(table, limit=None, order_by=('id', False), after=None, filters=()):
+    """
+    Keyset-paginated read of a mirror table. `order_by` is a (column, descending)
+    pair and `after` the (value, id) position decoded from a cursor; only rows
+    strictly after that position are returned, so deep pages cost no more than
+    the first one. NULLs sort first, as MySQL orders them, and a cursor may sit
+    on a NULL. `filters` are (column, operator, value) triples.
+    """
+    column, descending = order_by
+    if column not in TABLE_COLUMNS[table]:
+        raise ValueError(f"Cannot order {table} by '{column}'.")
+    comparison = '<' if descending else '>'
+    direction = 'DESC' if descending else 'ASC'
+
+    query = f"SELECT {', '.join(TABLE_COLUMNS[table])} FROM {table}"
+    conditions, params = _filter_conditions(table, filters)
+    if after is not None:
+        value, doc_id = after
+        if column == 'id':
+            conditions.append(f"id {comparison} %s")
+            params.append(doc_id)
+        elif value is None:
+            # MySQL sorts NULLs first, so after a NULL come the rest of the
+            # NULLs and (ascending) every non-NULL value.
+            if descending:
+                conditions.append(f"({column} IS NULL AND id < %s)")
+            else:
+                conditions.append(f"({column} IS NULL AND id > %s OR {column} IS NOT NULL)")
+            params.append(doc_id)
+        else:
+            # A row comparison would be NULL for NULL values, so spell it out.
+            nulls_after = f" OR {column} IS NULL" if descending else ""
+            conditions.append(f"({column} {comparison} %s OR {column} = %s AND id {comparison} %s{nulls_after})")
+            params.extend([value, value, doc_id])
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if column == 'id':
+        query += f" ORDER BY id {direction}"
+    else:
+        query += f" ORDER BY {column} {direction}, id {direction}"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    rows = execute_query(query, tuple(params), fetch=True)
+    return [row_to_document(table, row) for row in rows]
+
+def list_documents_mysql(table, limit=None, order_by=None, cursor=None, filters=()):
+    """
+    Mirror counterpart of firebase_service.list_documents; takes the same
+    filters. Its cursors are marked as MySQL's, since they only resume
+    correctly in MySQL's own ordering.
+    """
+    limit = pagination.parse_limit(limit)
+    order = pagination.parse_order_by(table, order_by, filters)
+    after = pagination.decode_cursor(cursor, order)
+    docs = get_page_mysql(table, limit + 1 if limit else None, order, after, filters)
+    return pagination.make_page(docs, limit, order, source='mysql')
+
+def get_rows_mysql(table, ids):
+    """Fetches rows by ID with one IN query per IN_CHUNK_SIZE IDs; returns {id: document}."""
+    ids = list(ids)
+    found = {}
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        chunk = ids[start:start + IN_CHUNK_SIZE]
+        query = f"SELECT {', '.join(TABLE_COLUMNS[table])} FROM {table} WHERE id IN ({', '.join(['%s'] * len(chunk))})"
+        for row in execute_query(query, tuple(chunk), fetch=True):
+            found[row['id']] = row_to_document(table, row)
+    return found
+
+def iter_rows_mysql(table, id_prefix=None, batch_size=1000, filters=()):
+    """
+    Streams the rows of a mirror table as documents through an unbuffered
+    cursor, `batch_size` rows per fetch, so memory stays flat however large
+    the table is. `id_prefix` keeps only IDs starting with it (compared
+    case-sensitively, like Firestore does) and `filters` are (column,
+    operator, value) triples. Holds one pooled connection until the generator
+    is exhausted or closed.
+    """
+    conn_pool = init()
+    query = f"SELECT {', '.join(TABLE_COLUMNS[table])} FROM {table}"
+    conditions, params = _filter_conditions(table, filters)
+    if id_prefix:
+        # LIKE follows the column's case-insensitive collation but can use the
+        # primary key; the exact prefix is checked below.
+        escaped = id_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append("id LIKE %s")
+        params.append(escaped + '%')
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    with conn_pool.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(query, tuple(params))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    if not id_prefix or row['id'].startswith(id_prefix):
+                        yield row_to_document(table, row)
+        finally:
+            try:
+                # Drain what wasn't read so the connection can be reused.
+                conn.consume_results()
+            finally:
+                cursor.close()
+
+def count_rows_mysql(table, filters=()):
+    """Counts the rows of a mirror table that match `filters`."""
+    conditions, params = _filter_conditions(table, filters)
+    query = f"SELECT COUNT(*) AS count FROM {table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return execute_query(query, tuple(params), fetch=True)[0]['count']
+
+# --- Migrations ---
+def migrate_appointments_mysql(dry_run=False):
+    """
+    Converts appointments.datetime from the original VARCHAR column to DATETIME.
+    Every value is first rewritten in a form MySQL converts reliably (NULL if it
+    can't be parsed, which is reported), then the column type is changed.
+    Does nothing if the column is already DATETIME, so it is safe to re-run.
+    """
+    conn_pool = init()
+    report = {'column_type': None, 'scanned': 0, 'updated': 0, 'invalid': []}
+    with conn_pool.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                "SELECT DATA_TYPE FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'appointments' AND COLUMN_NAME = 'datetime'",
+                (DB_CONFIG['database'],)
+            )
+            row = cursor.fetchone()
+            report['column_type'] = row['DATA_TYPE'].lower() if row else None
+            if report['column_type'] in (None, 'datetime'):
+                return report
+
+            cursor.execute("SELECT id, datetime FROM appointments")
+            updates = []
+            for row in cursor.fetchall():
+                report['scanned'] += 1
+                try:
+                    parsed = timestamps.parse_datetime(row['datetime']) if row['datetime'] else None
+                except ValueError:
+                    report['invalid'].append({'id': row['id'], 'datetime': row['datetime']})
+                    parsed = None
+                value = parsed.strftime('%Y-%m-%d %H:%M:%S') if parsed else None
+                if value != row['datetime']:
+                    updates.append((value, row['id']))
+            report['updated'] = len(updates)
+            if dry_run:
+                return report
+
+            if updates:
+                cursor.executemany("UPDATE appointments SET datetime=%s WHERE id=%s", updates)
+                conn.commit()
+            cursor.execute("ALTER TABLE appointments MODIFY datetime DATETIME NULL")
+            conn.commit()
+            report['column_type'] = 'datetime'
+        finally:
+            cursor.close()
+    return report
 
 # --- Patients ---
 def add_patient_mysql(pid, name, contact, history, dob, gender):
@@ -208,10 +799,51 @@ def delete_bill_mysql(bid):
     query = "DELETE FROM billing WHERE id=%s"
     execute_query(query, (bid,))
 
-def process_payment_mysql(bid):
-    # For simplicity, just update status to 'Paid' (inventory update would require more complex logic)
-    query = "UPDATE billing SET status='Paid' WHERE id=%s"
-    execute_query(query, (bid,))
+def apply_payment_mysql(bid, stock=None):
+    """
+    Mirrors a payment Firestore has committed: marks the bill paid and sets
+    its inventory items to `stock`, which maps inventory IDs to their
+    quantity after the payment, as the Firestore transaction computed it.
+    The bill row and then the inventory rows are locked, and all rows are
+    set by a single UPDATE ... JOIN, so the statement count does not grow
+    with the bill. The quantities are absolute, so replaying the operation
+    leaves MySQL the same. Missing rows raise ValueError and roll everything
+    back.
+    """
+    stock = {item_id: quantity for item_id, quantity in (stock or {}).items()}
+    with transaction() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT status FROM billing WHERE id=%s FOR UPDATE", (bid,))
+            if cursor.fetchone() is None:
+                raise ValueError(f"Bill not found in MySQL: {bid}")
+
+            if stock:
+                ids = sorted(stock)
+                placeholders = ', '.join(['%s'] * len(ids))
+                # Locked in ID order so concurrent payments can't deadlock.
+                cursor.execute(
+                    f"SELECT id FROM inventory WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE",
+                    tuple(ids)
+                )
+                found = {row['id'] for row in cursor.fetchall()}
+                missing = [item_id for item_id in ids if item_id not in found]
+                if missing:
+                    raise ValueError(f"Inventory items not found in MySQL: {', '.join(missing)}")
+
+                values = ' UNION ALL '.join(['SELECT %s AS id, %s AS quantity'] * len(ids))
+                params = []
+                for item_id in ids:
+                    params.extend((item_id, stock[item_id]))
+                cursor.execute(
+                    f"UPDATE inventory JOIN ({values}) AS stock ON inventory.id = stock.id "
+                    f"SET inventory.quantity = stock.quantity",
+                    tuple(params)
+                )
+
+            cursor.execute("UPDATE billing SET status='Paid' WHERE id=%s", (bid,))
+        finally:
+            cursor.close()
 
 # --- Inventory ---
 def add_inventory_mysql(iid, item, quantity, supplier, price):
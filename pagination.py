@@ -0,0 +1,123 @@
+import base64
+import json
+
+# Largest page a client may ask for in one request.
+MAX_PAGE_SIZE = 1000
+
+# Fields each collection can be ordered by. Every one of them is backed by an
+# index on the MySQL mirror, so keyset queries never fall back to a filesort.
+SORTABLE_FIELDS = {
+    'patients': ('id', 'name', 'dob'),
+    'doctors': ('id', 'name', 'specialty', 'fee'),
+    'appointments': ('id', 'patient', 'doctor', 'datetime'),
+    'billing': ('id', 'patient', 'status', 'total'),
+    'inventory': ('id', 'item', 'supplier', 'quantity', 'price'),
+}
+
+
+# Filters are (field, operator, value) triples with Firestore's operators.
+FILTER_OPERATORS = ('==', '>', '>=', '<', '<=')
+RANGE_OPERATORS = ('>', '>=', '<', '<=')
+
+
+class Page(list):
+    """A list of documents plus the cursor of the page that follows it."""
+
+    def __init__(self, items=(), next_cursor=None):
+        super().__init__(items)
+        self.next_cursor = next_cursor
+
+
+def parse_limit(limit):
+    """Validates a page size, returning None for 'no limit'."""
+    if limit is None or limit == '':
+        return None
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid limit: {limit}")
+    if limit < 1:
+        raise ValueError("limit must be a positive integer.")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_order_by(collection, order_by, filters=()):
+    """
+    Splits an order_by spec such as 'name' or '-fee' into (field, descending).
+    Defaults to ordering by document ID, or by the field of a range filter:
+    like Firestore, a listing filtered on a range must be ordered by that field.
+    """
+    range_fields = {field for field, op, _ in filters if op in RANGE_OPERATORS}
+    if len(range_fields) > 1:
+        raise ValueError("Range filters are only supported on one field.")
+    if not order_by:
+        return (range_fields.pop(), False) if range_fields else ('id', False)
+    descending = order_by.startswith('-')
+    field = order_by.lstrip('-')
+    if field not in SORTABLE_FIELDS[collection]:
+        raise ValueError(f"Cannot order {collection} by '{field}'.")
+    if range_fields and field not in range_fields:
+        raise ValueError(f"A range filter on '{range_fields.pop()}' requires ordering by it.")
+    return field, descending
+
+
+def encode_cursor(order_by, doc, source=None):
+    """
+    Builds the opaque cursor that resumes a listing right after `doc`.
+    `source` names the backend the listing came from, if it isn't Firestore
+    (see cursor_source).
+    """
+    field, descending = order_by
+    payload = [field, descending, doc.get(field) if field != 'id' else None, doc['id']]
+    if source is not None:
+        payload.append(source)
+    raw = json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def make_page(docs, limit, order_by, source=None):
+    """
+    Turns the result of a `limit + 1` query into a Page. The extra document only
+    tells us that another page follows; it is dropped from the result.
+    """
+    if limit is None or len(docs) <= limit:
+        return Page(docs)
+    docs = docs[:limit]
+    return Page(docs, encode_cursor(order_by, docs[-1], source))
+
+
+def _load_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(payload, list) or len(payload) not in (4, 5):
+        raise ValueError("Invalid cursor.")
+    return payload
+
+
+def cursor_source(cursor):
+    """
+    The backend that issued a cursor: 'mysql', or None for Firestore and the
+    replica, which order documents the same way. MySQL compares strings by
+    its collation rather than Firestore's byte order, so a listing has to be
+    resumed on the backend it started on.
+    """
+    if not cursor:
+        return None
+    payload = _load_cursor(cursor)
+    return payload[4] if len(payload) == 5 else None
+
+
+def decode_cursor(cursor, order_by):
+    """
+    Decodes a cursor into (value, doc_id). The cursor must have been issued for
+    the same ordering, otherwise resuming from it would skip or repeat documents.
+    """
+    if not cursor:
+        return None
+    field, descending, value, doc_id = _load_cursor(cursor)[:4]
+    if (field, descending) != tuple(order_by):
+        raise ValueError("Cursor does not match the requested order_by.")
+    return value, doc_id
@@ -0,0 +1,133 @@
+"""
+Opt-in cProfile profiling of individual web requests.
+
+A request is profiled when
+  - PROFILE_REQUESTS is on and it falls in the PROFILE_SAMPLE_RATE sample, or
+  - it carries an X-Profile header holding a token signed with PROFILE_SECRET
+    (see make_token and `manage.py profile-token`), which works even while
+    PROFILE_REQUESTS is off.
+
+Each profile is written to PROFILE_DIR as a pstats file named after the time,
+method, route and duration, and a line describing it is appended to
+PROFILE_DIR/index.ndjson. Read one with
+`python -m pstats profiles/<file>.prof` (then e.g. `sort cumtime`, `stats 30`).
+
+Only the handler is profiled: a streamed response's body is produced after
+the profile has been written. One request is profiled at a time; others that would have been are counted
+as skipped. Since Python 3.12 cProfile sees every thread, so a profile can
+include work other requests did meanwhile.
+"""
+import cProfile
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01))
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+PROFILE_HEADER = 'X-Profile'
+
+_lock = threading.Lock()
+_stats = {'profiled': 0, 'skipped': 0, 'rejected_tokens': 0, 'errors': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _signature(expires):
+    return hmac.new(PROFILE_SECRET.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+
+
+def make_token(ttl=3600):
+    """An X-Profile header value that is valid for `ttl` seconds."""
+    if not PROFILE_SECRET:
+        raise ValueError("PROFILE_SECRET is not set.")
+    expires = int(time.time() + ttl)
+    return f"{expires}.{_signature(expires)}"
+
+
+def _valid_token(token):
+    if not PROFILE_SECRET:
+        return False
+    expires, _, signature = token.partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(expires))
+
+
+def should_profile(token=None):
+    """Whether to profile a request carrying `token` (the X-Profile header, if any)."""
+    if token:
+        if _valid_token(token):
+            return True
+        _count('rejected_tokens')
+    return PROFILE_REQUESTS and random.random() < PROFILE_SAMPLE_RATE
+
+
+class RequestProfile:
+    """cProfile running around one request; start() returns None if another profile is running."""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.started = None
+
+    @classmethod
+    def start(cls):
+        if not _lock.acquire(blocking=False):
+            _count('skipped')
+            return None
+        profile = cls()
+        try:
+            profile.started = time.perf_counter()
+            profile.profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger's) is active.
+            _lock.release()
+            _count('skipped')
+            return None
+        return profile
+
+    def stop(self):
+        """Stops profiling; returns the seconds it ran."""
+        try:
+            self.profiler.disable()
+        finally:
+            _lock.release()
+        return time.perf_counter() - self.started
+
+    def save(self, elapsed, route, method, path, status):
+        """Writes the profile and its index entry; returns the file's name, or None if that failed."""
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S')
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        name = f"{stamp}-{method}-{slug}-{elapsed * 1000:.0f}ms-{uuid.uuid4().hex[:6]}.prof"
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            self.profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+            entry = {'file': name, 'at': stamp, 'method': method, 'route': route, 'path': path,
+                     'status': status, 'seconds': round(elapsed, 4)}
+            with open(os.path.join(PROFILE_DIR, 'index.ndjson'), 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            print(f"Error writing profile {name}: {e}")
+            _count('errors')
+            return None
+        _count('profiled')
+        return name
+
+
+def stats():
+    with _stats_lock:
+        counts = dict(_stats)
+    return dict(counts, enabled=PROFILE_REQUESTS, sample_rate=PROFILE_SAMPLE_RATE,
+                signed_requests=bool(PROFILE_SECRET), directory=PROFILE_DIR)
@@ -0,0 +1,185 @@
+import bisect
+import threading
+import time
+
+import pagination
+
+
+def sort_key(value):
+    """Orders mixed values the way Firestore does: null < bool < number < string."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, str(value))
+
+
+_COMPARISONS = {
+    '==': lambda a, b: a == b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+
+
+def matches(doc, filters):
+    """Applies (field, operator, value) filters the way a Firestore query would."""
+    for field, op, value in filters:
+        actual = doc.get(field)
+        # Firestore only compares values of the same type; others never match.
+        if actual is None or sort_key(actual)[0] != sort_key(value)[0]:
+            return False
+        if not _COMPARISONS[op](sort_key(actual), sort_key(value)):
+            return False
+    return True
+
+
+class CollectionReplica:
+    """
+    In-memory copy of one Firestore collection, kept current by an on_snapshot
+    listener. Local writes are applied immediately (read-your-writes) and are
+    tracked until the listener echoes them back, which is how staleness is
+    measured: a replica that has caught up with every write we made is fresh.
+    """
+
+    def __init__(self, name, on_change=None, on_document=None):
+        self.name = name
+        # Called with the collection name whenever the listener reports changes.
+        self._on_change = on_change
+        # Called with (name, doc_id, data) for every document the listener
+        # reports, data being None once it has been removed.
+        self._on_document = on_document
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._sorted_ids = None
+        self._ready = threading.Event()
+        self._watch = None
+        self._pending_writes = {}
+        self.last_event_at = None
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.events = 0
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def start(self, collection_ref):
+        """Attaches the snapshot listener; the first snapshot marks the replica ready."""
+        with self._lock:
+            if self._watch is None:
+                self._watch = collection_ref.on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        with self._lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+                self._watch = None
+            self._ready.clear()
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        now = time.monotonic()
+        changed = []
+        with self._lock:
+            for change in changes:
+                doc_id = change.document.id
+                if change.type.name == 'REMOVED':
+                    self._docs.pop(doc_id, None)
+                    changed.append((doc_id, None))
+                else:
+                    data = change.document.to_dict()
+                    data['id'] = doc_id
+                    self._docs[doc_id] = data
+                    changed.append((doc_id, dict(data)))
+                written_at = self._pending_writes.pop(doc_id, None)
+                if written_at is not None:
+                    self.last_lag = now - written_at
+                    self.max_lag = max(self.max_lag, self.last_lag)
+            if changes:
+                self._sorted_ids = None
+            self.last_event_at = now
+            self.events += 1
+        if self._on_document is not None:
+            for doc_id, data in changed:
+                self._on_document(self.name, doc_id, data)
+        if changes and self._on_change is not None:
+            self._on_change(self.name)
+        self._ready.set()
+
+    def apply_local_write(self, doc_id, data):
+        """Applies a write this process just committed, ahead of the listener."""
+        with self._lock:
+            if data is None:
+                self._docs.pop(doc_id, None)
+            else:
+                self._docs[doc_id] = dict(data, id=doc_id)
+            self._sorted_ids = None
+            self._pending_writes.setdefault(doc_id, time.monotonic())
+
+    def get(self, doc_id):
+        """Returns a copy of one document, or None if the replica doesn't have it."""
+        with self._lock:
+            doc = self._docs.get(doc_id)
+            return dict(doc) if doc is not None else None
+
+    def list(self, limit=None, order=('id', False), after=None, filters=()):
+        """Pages through the replica with the same (order, cursor, filter) semantics as Firestore."""
+        field, descending = order
+        take = limit + 1 if limit is not None else None
+        with self._lock:
+            if field == 'id' and not filters:
+                # The sorted ID list is cached between writes, so paging by ID
+                # is a bisect plus a slice.
+                if self._sorted_ids is None:
+                    self._sorted_ids = sorted(self._docs)
+                ids = self._sorted_ids
+                if descending:
+                    end = bisect.bisect_left(ids, after[1]) if after is not None else len(ids)
+                    begin = max(0, end - take) if take is not None else 0
+                    selected = ids[begin:end][::-1]
+                else:
+                    begin = bisect.bisect_right(ids, after[1]) if after is not None else 0
+                    selected = ids[begin:begin + take] if take is not None else ids[begin:]
+                docs = [dict(self._docs[doc_id]) for doc_id in selected]
+            else:
+                def key(doc):
+                    return sort_key(doc.get(field)), doc['id']
+
+                docs = [doc for doc in self._docs.values() if matches(doc, filters)]
+                docs.sort(key=key, reverse=descending)
+                if after is not None:
+                    position = (sort_key(after[0]), after[1])
+                    docs = [doc for doc in docs if (key(doc) < position if descending else key(doc) > position)]
+                docs = [dict(doc) for doc in docs[:take]]
+        return pagination.make_page(docs, limit, order)
+
+    def count(self, filters=()):
+        """Counts the documents matching `filters`."""
+        with self._lock:
+            if not filters:
+                return len(self._docs)
+            return sum(1 for doc in self._docs.values() if matches(doc, filters))
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            oldest_pending = min(self._pending_writes.values(), default=None)
+            return {
+                'ready': self.ready,
+                'documents': len(self._docs),
+                'events': self.events,
+                'seconds_since_last_event': now - self.last_event_at if self.last_event_at else None,
+                # How long the oldest local write has been waiting for the listener.
+                'staleness_seconds': now - oldest_pending if oldest_pending is not None else 0.0,
+                'pending_writes': len(self._pending_writes),
+                'last_lag_seconds': self.last_lag,
+                'max_lag_seconds': self.max_lag,
+            }
@@ -0,0 +1,250 @@
+import re
+import threading
+
+# Fields searched per collection. Appointments and bills only store patient and
+# doctor IDs, so they are indexed under the names those IDs resolve to.
+SEARCH_FIELDS = {
+    'patients': ('name', 'contact', 'gender'),
+    'doctors': ('name', 'specialty'),
+    'appointments': ('patient_name', 'doctor_name'),
+    'billing': ('patient_name', 'status'),
+    'inventory': ('item', 'supplier'),
+}
+
+# Which collections reference which, and through which field.
+REFERENCES = {
+    'appointments': {'patient': 'patients', 'doctor': 'doctors'},
+    'billing': {'patient': 'patients'},
+}
+
+# Field used to break ties between equally ranked results.
+SORT_FIELDS = {
+    'patients': 'name',
+    'doctors': 'name',
+    'appointments': 'datetime',
+    'billing': 'status',
+    'inventory': 'item',
+}
+
+# Points a document earns for each query term, depending on how the term
+# matched one of its tokens.
+EXACT_SCORE = 3
+PREFIX_SCORE = 2
+SUBSTRING_SCORE = 1
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Lower-cases text and splits it into word tokens."""
+    if text is None:
+        return []
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+def trigrams(token):
+    """Returns the set of 3-character substrings of a token."""
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class _CollectionIndex:
+    """Postings for one collection: token -> doc IDs and trigram -> tokens."""
+
+    def __init__(self):
+        self.docs = {}
+        self.doc_tokens = {}
+        self.postings = {}
+        self.grams = {}
+
+    def add(self, doc_id, doc, tokens):
+        self.remove(doc_id)
+        self.docs[doc_id] = doc
+        self.doc_tokens[doc_id] = tokens
+        for token in tokens:
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = set()
+                for gram in trigrams(token):
+                    self.grams.setdefault(gram, set()).add(token)
+            ids.add(doc_id)
+
+    def remove(self, doc_id):
+        self.docs.pop(doc_id, None)
+        for token in self.doc_tokens.pop(doc_id, ()):
+            ids = self.postings[token]
+            ids.discard(doc_id)
+            if not ids:
+                del self.postings[token]
+                for gram in trigrams(token):
+                    tokens = self.grams[gram]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self.grams[gram]
+
+    def matching_tokens(self, term):
+        """Yields the indexed tokens containing `term`, with the score they earn."""
+        if len(term) >= 3:
+            candidates = None
+            for gram in trigrams(term):
+                tokens = self.grams.get(gram)
+                if not tokens:
+                    return
+                candidates = set(tokens) if candidates is None else candidates & tokens
+        else:
+            # Too short for trigrams; the vocabulary is far smaller than the
+            # documents, so scanning it is still cheap.
+            candidates = self.postings.keys()
+        for token in candidates:
+            if token == term:
+                yield token, EXACT_SCORE
+            elif token.startswith(term):
+                yield token, PREFIX_SCORE
+            elif term in token:
+                yield token, SUBSTRING_SCORE
+
+
+class SearchIndex:
+    """
+    In-process inverted index over all five collections. It is filled once by
+    build() and then kept current by index_document()/remove_document(), which
+    firebase_service calls from its write paths.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections = {name: _CollectionIndex() for name in SEARCH_FIELDS}
+        # (referenced collection, referenced ID) -> {(collection, doc ID)}
+        self._referrers = {}
+        self._ready = threading.Event()
+        self._building = False
+        self._touched = set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def _resolve(self, collection, doc):
+        """Adds the resolved names of referenced patients/doctors to a document."""
+        fields = dict(doc)
+        for field, target in REFERENCES.get(collection, {}).items():
+            referenced = self._collections[target].docs.get(doc.get(field))
+            fields[f'{field}_name'] = referenced.get('name') if referenced else None
+        return fields
+
+    def _tokens(self, collection, doc):
+        fields = self._resolve(collection, doc)
+        tokens = set()
+        for field in SEARCH_FIELDS[collection]:
+            tokens.update(tokenize(fields.get(field)))
+        return tokens
+
+    def _link(self, collection, doc_id, doc):
+        for field, target in REFERENCES.get(collection, {}).items():
+            if doc.get(field):
+                self._referrers.setdefault((target, doc.get(field)), set()).add((collection, doc_id))
+
+    def _unlink(self, collection, doc_id):
+        old = self._collections[collection].docs.get(doc_id)
+        if old is None:
+            return
+        for field, target in REFERENCES.get(collection, {}).items():
+            key = (target, old.get(field))
+            referrers = self._referrers.get(key)
+            if referrers is not None:
+                referrers.discard((collection, doc_id))
+                if not referrers:
+                    del self._referrers[key]
+
+    def _reindex_referrers(self, collection, doc_id):
+        """Re-tokenizes appointments/bills after a patient or doctor changed name."""
+        for ref_collection, ref_id in list(self._referrers.get((collection, doc_id), ())):
+            index = self._collections[ref_collection]
+            doc = index.docs.get(ref_id)
+            if doc is not None:
+                index.add(ref_id, doc, self._tokens(ref_collection, doc))
+
+    def _put(self, collection, doc_id, doc):
+        doc = dict(doc, id=doc_id)
+        self._unlink(collection, doc_id)
+        self._collections[collection].add(doc_id, doc, self._tokens(collection, doc))
+        self._link(collection, doc_id, doc)
+        self._reindex_referrers(collection, doc_id)
+
+    def index_document(self, collection, doc_id, doc):
+        """Adds or replaces a single document."""
+        if collection not in self._collections:
+            return
+        with self._lock:
+            if self._building:
+                self._touched.add((collection, doc_id))
+            self._put(collection, doc_id, doc)
+
+    def remove_document(self, collection, doc_id):
+        """Drops a single document from the index."""
+        if collection not in self._collections:
+            return
+        with self._lock:
+            if self._building:
+                self._touched.add((collection, doc_id))
+            self._unlink(collection, doc_id)
+            self._collections[collection].remove(doc_id)
+            self._reindex_referrers(collection, doc_id)
+
+    def build(self, load):
+        """
+        Fills the index from scratch. `load(collection)` must return an iterable
+        of documents. Documents written while the build is running are kept as
+        written rather than overwritten with the (older) streamed copy.
+        """
+        with self._lock:
+            self._building = True
+            self._touched = set()
+        try:
+            # Patients and doctors first, so references resolve on first pass.
+            for collection in SEARCH_FIELDS:
+                for doc in load(collection):
+                    with self._lock:
+                        if (collection, doc['id']) not in self._touched:
+                            self._put(collection, doc['id'], doc)
+            self._ready.set()
+        finally:
+            with self._lock:
+                self._building = False
+                self._touched = set()
+
+    def search(self, collection, query, limit=20, offset=0):
+        """
+        Ranks the documents of a collection against a query. Every query term
+        must match (exactly, as a prefix, or as a substring) a token of the
+        document. Returns (documents, total number of matches).
+        """
+        terms = tokenize(query)
+        with self._lock:
+            index = self._collections[collection]
+            scores = None
+            for term in terms:
+                best = {}
+                for token, score in index.matching_tokens(term):
+                    for doc_id in index.postings[token]:
+                        if best.get(doc_id, 0) < score:
+                            best[doc_id] = score
+                if scores is None:
+                    scores = best
+                else:
+                    scores = {doc_id: total + best[doc_id] for doc_id, total in scores.items() if doc_id in best}
+                if not scores:
+                    return [], 0
+
+            if scores is None:
+                return [], 0
+            sort_field = SORT_FIELDS[collection]
+            ranked = sorted(
+                scores,
+                key=lambda doc_id: (-scores[doc_id], str(index.docs[doc_id].get(sort_field) or '').lower(), doc_id)
+            )
+            page = [dict(index.docs[doc_id]) for doc_id in ranked[offset:offset + limit]]
+            return page, len(ranked)
+
+
+# The process-wide index used by firebase_service and web_app.
+index = SearchIndex()
@@ -0,0 +1,17 @@
+"""
+The tests run against the in-memory Firestore and MySQL of bench/, which
+have to be registered before firebase_service and mysql_service are imported.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Keep mirror state files (spool, degraded marks) out of the working tree.
+os.environ.setdefault('MYSQL_SPOOL_PATH', os.path.join(tempfile.mkdtemp(prefix='mirror-tests-'), 'mysql_mirror.spool'))
+
+from bench import fake_firestore, fake_mysql  # noqa: E402
+
+fake_firestore.install()
+fake_mysql.install()
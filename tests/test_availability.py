@@ -0,0 +1,120 @@
+"""Booking checks: schedules, overlaps, and the transactional check used when several processes book."""
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import availability
+import firebase_service
+import replica
+from bench import fake_firestore, fake_mysql
+
+
+@pytest.fixture
+def store(monkeypatch):
+    fake_firestore.store.clear()
+    fake_mysql.tables.clear()
+    firebase_service.document_cache.clear()
+    monkeypatch.setattr(availability, 'index', availability.AvailabilityIndex(appointment_minutes=30))
+    monkeypatch.setattr(firebase_service, 'SINGLE_PROCESS', False)
+    doctors = firebase_service.get_collection('doctors')
+    doctors.document('d1').set({'name': 'Dr. One', 'schedule': 'Mon-Fri 9AM-5PM'})
+    return fake_firestore.store
+
+
+def _book_elsewhere(doc_id, doctor, datetime):
+    """Writes an appointment straight to Firestore, the way another process would."""
+    firebase_service.get_collection('appointments').document(doc_id).set(
+        {'patient': 'p9', 'doctor': doctor, 'datetime': datetime})
+
+
+def test_parse_schedule():
+    assert availability.parse_schedule('Mon, Wed, Fri 9AM-5PM') == {0: [(540, 1020)], 2: [(540, 1020)],
+                                                                     4: [(540, 1020)]}
+    assert availability.parse_schedule('Sat 9-5') == {5: [(540, 1020)]}
+    assert availability.parse_schedule('Mon 09:00-12:00, 13:00-17:00') == {0: [(540, 720), (780, 1020)]}
+    assert availability.parse_schedule('On call') is None
+
+
+def test_check_booking():
+    start = datetime.datetime(2024, 5, 6, 9, 0)  # A Monday
+    duration = datetime.timedelta(minutes=30)
+    hours = availability.parse_schedule('Mon 9AM-5PM')
+    availability.check_booking(start, duration, [], hours)
+    availability.check_booking(start, duration, [], None)
+    with pytest.raises(availability.AppointmentConflict, match='already has'):
+        availability.check_booking(start, duration, [{'id': 'a1'}], hours)
+    with pytest.raises(availability.AppointmentConflict, match='schedule'):
+        availability.check_booking(start.replace(hour=16, minute=45), duration, [], hours)
+
+
+def test_index_overlap_is_one_duration():
+    index = availability.AvailabilityIndex(appointment_minutes=30)
+    index.apply('appointments', 'a1', {'doctor': 'd1', 'datetime': '2024-05-06T10:00:00'})
+    assert [doc['id'] for doc in index.conflicts('d1', '2024-05-06T10:29:00')] == ['a1']
+    assert index.conflicts('d1', '2024-05-06T10:30:00') == []
+    assert index.conflicts('d1', '2024-05-06T09:30:00') == []
+    assert index.conflicts('d1', '2024-05-06T10:00:00', exclude_id='a1') == []
+
+
+def test_booking_sees_other_processes_appointments(store):
+    _book_elsewhere('other', 'd1', '2024-05-06T10:00:00')
+    with pytest.raises(availability.AppointmentConflict) as raised:
+        firebase_service.add_appointment('p1', 'd1', '2024-05-06T10:15:00')
+    assert [doc['id'] for doc in raised.value.conflicts] == ['other']
+    with pytest.raises(availability.AppointmentConflict, match='schedule'):
+        firebase_service.add_appointment('p1', 'd1', '2024-05-06T18:00:00')
+    aid = firebase_service.add_appointment('p1', 'd1', '2024-05-06T10:30:00')
+    # Moving an appointment doesn't conflict with itself.
+    firebase_service.update_appointment(aid, 'p1', 'd1', '2024-05-06T10:45:00')
+    assert firebase_service.get_appointment(aid)['datetime'] == '2024-05-06T10:45:00'
+
+
+def test_single_process_checks_the_index(store, monkeypatch):
+    monkeypatch.setattr(firebase_service, 'SINGLE_PROCESS', True)
+    aid = firebase_service.add_appointment('p1', 'd1', '2024-05-06T10:00:00')
+    with pytest.raises(availability.AppointmentConflict) as raised:
+        firebase_service.add_appointment('p2', 'd1', '2024-05-06T10:10:00')
+    assert [doc['id'] for doc in raised.value.conflicts] == [aid]
+
+
+def test_bulk_bookings_are_checked_against_firestore(store):
+    _book_elsewhere('moved', 'd1', '2024-05-06T10:00:00')
+    _book_elsewhere('busy', 'd1', '2024-05-06T13:00:00')
+    results = firebase_service.bulk_write('appointments', creates=[
+        # Free once 'moved' has moved, which the same request does.
+        {'patient': 'p1', 'doctor': 'd1', 'datetime': '2024-05-06T10:10:00'},
+        {'patient': 'p2', 'doctor': 'd1', 'datetime': '2024-05-06T11:00:00'},
+        {'patient': 'p3', 'doctor': 'd1', 'datetime': '2024-05-06T11:15:00'},
+        {'patient': 'p4', 'doctor': 'd1', 'datetime': '2024-05-06T13:15:00'},
+    ], updates=[
+        {'id': 'moved', 'patient': 'p9', 'doctor': 'd1', 'datetime': '2024-05-06T15:00:00'},
+    ])
+    assert [result['success'] for result in results] == [True, True, False, False, True]
+    assert 'in this request' in results[2]['error']
+    assert 'already has' in results[3]['error']
+    stored = sorted(doc['datetime'] for doc in firebase_service.iter_documents('appointments'))
+    assert stored == ['2024-05-06T10:10:00', '2024-05-06T11:00:00', '2024-05-06T13:00:00', '2024-05-06T15:00:00']
+
+
+def test_availability_day_reads_other_processes_bookings(store):
+    _book_elsewhere('other', 'd1', '2024-05-06T10:00:00')
+    day = firebase_service.get_availability('d1', '2024-05-06')
+    assert [doc['id'] for doc in day['booked']] == ['other']
+    assert day['free'][0] == {'start': '2024-05-06T09:00:00', 'end': '2024-05-06T10:00:00'}
+
+
+def test_replica_changes_feed_the_index(monkeypatch):
+    index = availability.AvailabilityIndex(appointment_minutes=30)
+    monkeypatch.setattr(availability, 'index', index)
+    collection_replica = replica.CollectionReplica('appointments', on_document=firebase_service._replica_document)
+
+    def change(kind, doc_id, data=None):
+        document = SimpleNamespace(id=doc_id, to_dict=lambda: dict(data))
+        return SimpleNamespace(type=SimpleNamespace(name=kind), document=document)
+
+    collection_replica._on_snapshot(None, [change('ADDED', 'a1', {'doctor': 'd1', 'datetime': '2024-05-06T10:00:00'})],
+                                    None)
+    assert [doc['id'] for doc in index.conflicts('d1', '2024-05-06T10:00:00')] == ['a1']
+    collection_replica._on_snapshot(None, [change('REMOVED', 'a1')], None)
+    assert index.conflicts('d1', '2024-05-06T10:00:00') == []
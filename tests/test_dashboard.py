@@ -0,0 +1,51 @@
+"""Dashboard aggregates: local writes, replica change events and reconciliation."""
+from types import SimpleNamespace
+
+import pytest
+
+import dashboard
+import firebase_service
+import replica
+from bench import fake_firestore, fake_mysql
+
+
+@pytest.fixture
+def aggregates(monkeypatch):
+    fake_firestore.store.clear()
+    fake_mysql.tables.clear()
+    aggregates = dashboard.DashboardAggregates()
+    monkeypatch.setattr(dashboard, 'aggregates', aggregates)
+    firebase_service.build_dashboard()
+    return aggregates
+
+
+def _change(kind, doc_id, data=None):
+    document = SimpleNamespace(id=doc_id, to_dict=lambda: dict(data))
+    return SimpleNamespace(type=SimpleNamespace(name=kind), document=document)
+
+
+def test_local_writes_are_applied(aggregates):
+    firebase_service.add_patient('Ann', '555', '', '1990-01-01', 'F')
+    bill = {'patient': 'p1', 'items': [], 'total': 40, 'status': 'Paid'}
+    firebase_service.get_collection('billing').document('b1').set(bill)
+    firebase_service._notify_write('billing', 'b1', bill)
+    figures = aggregates.snapshot()
+    assert figures['totals']['patients'] == 1
+    assert figures['paid_bills'] == 1 and figures['revenue'] == 40
+    assert firebase_service.reconcile_dashboard() == {}
+
+
+def test_replica_changes_reach_the_aggregates(aggregates):
+    """Writes made by other processes arrive through the listeners."""
+    bills = replica.CollectionReplica('billing', on_document=firebase_service._replica_document)
+    bills._on_snapshot(None, [_change('ADDED', 'b1', {'total': 25, 'status': 'Pending'}),
+                              _change('ADDED', 'b2', {'total': 10, 'status': 'Paid'})], None)
+    assert aggregates.snapshot()['pending_bills'] == 1
+    assert aggregates.snapshot()['revenue'] == 10
+    # The echo of a write this process already applied changes nothing.
+    firebase_service._notify_write('billing', 'b1', {'total': 25, 'status': 'Paid'})
+    bills._on_snapshot(None, [_change('MODIFIED', 'b1', {'total': 25, 'status': 'Paid'})], None)
+    bills._on_snapshot(None, [_change('REMOVED', 'b2')], None)
+    figures = aggregates.snapshot()
+    assert figures['totals']['billing'] == 1
+    assert (figures['pending_bills'], figures['paid_bills'], figures['revenue']) == (0, 1, 25)
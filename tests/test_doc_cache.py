@@ -0,0 +1,63 @@
+"""DocumentCache read-through loads, invalidation and failed loads."""
+import pytest
+
+from doc_cache import DocumentCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_loads_once_and_returns_copies():
+    cache = DocumentCache(ttl=30)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return {'name': 'a'}
+
+    first = cache.get_or_load('p1', load)
+    first['name'] = 'changed'
+    assert cache.get_or_load('p1', load) == {'name': 'a'}
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_failed_load_leaves_nothing_pending():
+    cache = DocumentCache(ttl=30)
+
+    def load():
+        raise Exception("Patient not found")
+
+    for _ in range(3):
+        with pytest.raises(Exception, match="not found"):
+            cache.get_or_load('missing', load)
+    assert cache._pending == {}
+    assert cache.stats()['size'] == 0
+
+
+def test_invalidation_during_load_discards_the_loaded_value():
+    cache = DocumentCache(ttl=30)
+
+    def load():
+        cache.invalidate('p1')
+        return {'name': 'stale'}
+
+    assert cache.get_or_load('p1', load) == {'name': 'stale'}
+    assert cache.get('p1') is None
+    assert cache._pending == {}
+
+
+def test_entries_expire():
+    clock = Clock()
+    cache = DocumentCache(ttl=10, clock=clock)
+    cache.put('p1', {'name': 'a'})
+    clock.now = 9.9
+    assert cache.get('p1') == {'name': 'a'}
+    clock.now = 10
+    assert cache.get('p1') is None
+    assert cache.stats()['expirations'] == 1
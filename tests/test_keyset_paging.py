@@ -0,0 +1,64 @@
+"""Keyset paging of the MySQL mirror over nullable sort columns."""
+import sqlite3
+
+import pytest
+
+import mysql_service
+
+DOCTORS = [
+    ('d1', 'Dr A', 'Cardiology', None, 500),
+    ('d2', 'Dr B', None, None, 300),
+    ('d3', 'Dr C', 'Cardiology', None, 300),
+    ('d4', 'Dr D', None, None, None),
+    ('d5', 'Dr E', 'ENT', None, 750),
+    ('d6', 'Dr F', 'Dermatology', None, None),
+    ('d7', 'Dr G', None, None, 1000),
+]
+
+
+@pytest.fixture
+def doctors(monkeypatch):
+    # SQLite orders NULLs the way MySQL does (first ascending, last
+    # descending), so it can run the generated keyset queries.
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE doctors (id TEXT PRIMARY KEY, name TEXT, specialty TEXT, schedule TEXT, fee REAL)")
+    conn.executemany("INSERT INTO doctors VALUES (?, ?, ?, ?, ?)", DOCTORS)
+
+    def execute_query(query, params=None, fetch=False):
+        return [dict(row) for row in conn.execute(query.replace('%s', '?'), params or ()).fetchall()]
+
+    monkeypatch.setattr(mysql_service, 'execute_query', execute_query)
+    return conn
+
+
+def _page_through(order_by, limit):
+    ids = []
+    cursor = None
+    while True:
+        page = mysql_service.list_documents_mysql('doctors', limit, order_by, cursor)
+        ids.extend(doc['id'] for doc in page)
+        cursor = page.next_cursor
+        if cursor is None:
+            return ids
+
+
+def _expected(column, descending):
+    index = {'specialty': 2, 'fee': 4}[column]
+    nulls = sorted((row for row in DOCTORS if row[index] is None), key=lambda row: row[0], reverse=descending)
+    values = sorted((row for row in DOCTORS if row[index] is not None), key=lambda row: (row[index], row[0]),
+                    reverse=descending)
+    rows = values + nulls if descending else nulls + values
+    return [row[0] for row in rows]
+
+
+@pytest.mark.parametrize('order_by', ['specialty', '-specialty', 'fee', '-fee'])
+@pytest.mark.parametrize('limit', [1, 2, 3])
+def test_pages_cover_null_and_non_null_rows_once(doctors, order_by, limit):
+    column = order_by.lstrip('-')
+    assert _page_through(order_by, limit) == _expected(column, order_by.startswith('-'))
+
+
+def test_pages_by_id(doctors):
+    assert _page_through(None, 2) == sorted(row[0] for row in DOCTORS)
+    assert _page_through('-id', 3) == sorted((row[0] for row in DOCTORS), reverse=True)
@@ -0,0 +1,209 @@
+"""The write-behind mirror: coalescing, checkpoints, dead letters and retries."""
+import json
+import os
+import time
+
+import pytest
+
+import mysql_mirror
+import mysql_service
+from bench import fake_mysql
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    fake_mysql.tables.clear()
+    monkeypatch.setattr(mysql_mirror, 'DEGRADED_PATH', str(tmp_path / 'spool.degraded'))
+    monkeypatch.setattr(mysql_mirror, '_degraded', {})
+    monkeypatch.setattr(mysql_mirror, '_degraded_mtime', None)
+    mirror = mysql_mirror.WriteBehindMirror(str(tmp_path / 'spool'))
+    yield mirror
+    mirror.stop(timeout=5)
+
+
+def _batch(mirror, *ops):
+    """Spools `ops` ((op, args) pairs) without starting the worker; returns them as a batch."""
+    batch = []
+    for op, args in ops:
+        entry = {'seq': mirror._next_seq, 'op': op, 'args': list(args), 'ts': 0}
+        mirror._next_seq += 1
+        batch.append(entry)
+    return batch
+
+
+def _dead_letters(mirror):
+    try:
+        with open(mirror.dead_letter_path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+    except FileNotFoundError:
+        return []
+
+
+def _checkpoint(mirror):
+    with open(mirror.checkpoint_path, encoding='utf-8') as f:
+        return int(f.read())
+
+
+def _patient(doc_id, name):
+    return ('add_patient_mysql', (doc_id, name, '1', '', '', ''))
+
+
+def test_coalesces_rows_into_one_write_per_table(mirror, monkeypatch):
+    calls = []
+    upsert = mysql_service.upsert_rows_mysql
+    monkeypatch.setattr(mysql_service, 'upsert_rows_mysql',
+                        lambda table, rows, conn=None: calls.append((table, len(rows))) or upsert(table, rows, conn))
+    batch = _batch(mirror, _patient('p1', 'a'), _patient('p2', 'b'), _patient('p1', 'c'),
+                   ('delete_patient_mysql', ('p2',)))
+    mirror._apply(batch)
+    assert calls == [('patients', 1)]
+    assert {doc_id: row['name'] for doc_id, row in fake_mysql.tables['patients'].items()} == {'p1': 'c'}
+    assert mirror.applied_seq == _checkpoint(mirror) == batch[-1]['seq']
+
+
+def test_checkpoint_advances_per_committed_segment(mirror, monkeypatch):
+    payments = []
+    monkeypatch.setattr(mysql_service, 'apply_payment_mysql', lambda *args: payments.append(args))
+    batch = _batch(mirror, _patient('p1', 'a'), ('apply_payment_mysql', ('b1', {})), _patient('p2', 'b'))
+    upsert = mysql_service.upsert_rows_mysql
+
+    def fail_second(table, rows, conn=None):
+        if rows[0][0] == 'p2':
+            raise fake_mysql.OperationalError("Lost connection to MySQL server", errno=2013)
+        return upsert(table, rows, conn)
+
+    monkeypatch.setattr(mysql_service, 'upsert_rows_mysql', fail_second)
+    with pytest.raises(fake_mysql.OperationalError):
+        mirror._apply(batch)
+    # The payment committed, so a retry must start after it.
+    assert mirror.applied_seq == _checkpoint(mirror) == batch[1]['seq']
+
+    monkeypatch.setattr(mysql_service, 'upsert_rows_mysql', upsert)
+    mirror._apply(batch[2:])
+    assert payments == [('b1', {})]
+    assert mirror.applied_seq == batch[-1]['seq']
+    assert _dead_letters(mirror) == []
+
+
+def test_value_error_is_dead_lettered(mirror):
+    batch = _batch(mirror, ('apply_payment_mysql', ('missing-bill', {})), _patient('p1', 'a'))
+    mirror._apply(batch)
+    assert [entry['seq'] for entry in _dead_letters(mirror)] == [batch[0]['seq']]
+    assert 'p1' in fake_mysql.tables['patients']
+    assert not mysql_mirror.is_fresh('billing')
+
+
+def test_unknown_operation_is_dead_lettered(mirror):
+    batch = _batch(mirror, ('process_payment_mysql', ('b1', {'i1': 2})))
+    mirror._apply(batch)
+    assert len(_dead_letters(mirror)) == 1
+    assert mirror.applied_seq == batch[0]['seq']
+
+
+@pytest.mark.parametrize('error', [
+    fake_mysql.DataError("Data too long for column 'name'", errno=1406),
+    fake_mysql.IntegrityError("Column 'id' cannot be null", errno=1048),
+    fake_mysql.DatabaseError("Incorrect decimal value: 'abc' for column 'fee'", errno=1366),
+])
+def test_rejected_merged_row_is_the_only_one_dead_lettered(mirror, monkeypatch, error):
+    upsert = mysql_service.upsert_rows_mysql
+
+    def reject_bad_fee(table, rows, conn=None):
+        if any(row[4] == 'abc' for row in rows):
+            raise error
+        return upsert(table, rows, conn)
+
+    monkeypatch.setattr(mysql_service, 'upsert_rows_mysql', reject_bad_fee)
+    batch = _batch(mirror,
+                   ('add_doctor_mysql', ('d1', 'Dr A', 'ENT', '', 500)),
+                   ('add_doctor_mysql', ('d2', 'Dr B', 'ENT', '', 'abc')),
+                   ('add_doctor_mysql', ('d3', 'Dr C', 'ENT', '', 300)))
+    mirror._apply(batch)
+    assert [entry['args'][0] for entry in _dead_letters(mirror)] == ['d2']
+    assert sorted(fake_mysql.tables['doctors']) == ['d1', 'd3']
+    assert mirror.applied_seq == batch[-1]['seq']
+    assert 'doctors' in mysql_mirror.degraded()
+
+
+@pytest.mark.parametrize('error', [
+    fake_mysql.OperationalError("MySQL server has gone away", errno=2006),
+    fake_mysql.InterfaceError("Can't connect to MySQL server", errno=2003),
+    fake_mysql.InternalError("Deadlock found when trying to get lock", errno=1213),
+    fake_mysql.DatabaseError("Lock wait timeout exceeded", errno=1205),
+    ConnectionError("MySQL is not initialized."),
+])
+def test_transient_errors_are_retried_not_dead_lettered(mirror, monkeypatch, error):
+    def fail(table, rows, conn=None):
+        raise error
+
+    monkeypatch.setattr(mysql_service, 'upsert_rows_mysql', fail)
+    batch = _batch(mirror, _patient('p1', 'a'))
+    with pytest.raises(type(error)):
+        mirror._apply(batch)
+    assert mirror.applied_seq == 0
+    assert _dead_letters(mirror) == []
+
+
+def test_worker_applies_submitted_operations(mirror):
+    mirror.submit(*_patient('p1', 'a'))
+    mirror.submit(*_patient('p2', 'b'))
+    assert mirror.flush(timeout=5)
+    assert sorted(fake_mysql.tables['patients']) == ['p1', 'p2']
+
+
+def test_payment_replay_converges(mirror):
+    mysql_service.upsert_rows_mysql('billing', [('b1', 'p1', [], 10, 'Pending')])
+    mysql_service.upsert_rows_mysql('inventory', [('i1', 'Pills', 10, 'S', 1.0)])
+    for _ in range(2):
+        mysql_service.apply_payment_mysql('b1', {'i1': 7})
+    assert fake_mysql.tables['inventory']['i1']['quantity'] == 7
+    assert fake_mysql.tables['billing']['b1']['status'] == 'Paid'
+
+
+def test_each_process_mirror_locks_its_spool(tmp_path):
+    first = mysql_mirror.WriteBehindMirror(str(tmp_path / 'spool.100'))
+    try:
+        assert mysql_mirror.WriteBehindMirror.adopt(str(tmp_path / 'spool.100')) is None
+    finally:
+        first.close()
+
+
+def _leave_spool(path, dead_letter_path, *ops):
+    """Spools `ops` the way a process that then exited would have left them."""
+    exited = mysql_mirror.WriteBehindMirror(path, dead_letter_path=dead_letter_path)
+    for entry in _batch(exited, *ops):
+        exited._spool.write(json.dumps(entry) + '\n')
+    exited.close()
+
+
+def test_spools_of_exited_processes_are_adopted(tmp_path, mirror):
+    base = str(tmp_path / 'shared.spool')
+    _leave_spool(base + '.100', base + '.dead', _patient('p1', 'a'))
+    # The single shared spool of earlier versions.
+    _leave_spool(base, base + '.dead', _patient('p2', 'b'))
+
+    current = mysql_mirror.WriteBehindMirror(base + '.200', dead_letter_path=base + '.dead', base_path=base)
+    try:
+        current._adopt_orphans()
+        assert sorted(fake_mysql.tables['patients']) == ['p1', 'p2']
+        assert current.adopted == 2
+        assert sorted(path.name for path in tmp_path.iterdir() if path.name.startswith('shared')) == [
+            'shared.spool.200', 'shared.spool.200.lock']
+    finally:
+        current.close()
+
+
+def test_flush_waits_only_for_this_processes_operations(tmp_path, mirror, monkeypatch):
+    monkeypatch.setattr(mysql_mirror, 'MIRROR_MODE', 'write-behind')
+    monkeypatch.setattr(mysql_mirror, '_mirror', mirror)
+    monkeypatch.setattr(mysql_mirror, '_mirror_pid', os.getpid())
+    # Left in the spool by an earlier run, and not this process's to wait for.
+    for entry in _batch(mirror, _patient('p1', 'a')):
+        mirror._spool.write(json.dumps(entry) + '\n')
+    started = time.monotonic()
+    assert mysql_mirror.flush(timeout=5)
+    assert time.monotonic() - started < 1
+
+    mirror.submit(*_patient('p2', 'b'))
+    assert mysql_mirror.flush(timeout=5)
+    assert sorted(fake_mysql.tables['patients']) == ['p1', 'p2']
@@ -0,0 +1,37 @@
+import datetime
+
+# Appointment times are local wall-clock times without a timezone, stored as
+# zero-padded ISO-8601 strings. In this form string order is time order, so
+# Firestore range filters and composite indexes work on them directly, and
+# MySQL accepts them as DATETIME literals.
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def parse_datetime(value):
+    """
+    Parses an appointment time: an ISO-8601 string ('2024-05-01T09:30',
+    '2024-05-01 09:30:00', '2024-05-01'), a datetime or a date. Times with a
+    timezone are converted to this server's local time. Raises ValueError if
+    the value isn't a recognizable time.
+    """
+    if isinstance(value, datetime.datetime):
+        parsed = value
+    elif isinstance(value, datetime.date):
+        parsed = datetime.datetime(value.year, value.month, value.day)
+    elif isinstance(value, str) and value.strip():
+        try:
+            parsed = datetime.datetime.fromisoformat(value.strip())
+        except ValueError:
+            raise ValueError(f"Invalid date/time: {value}")
+    else:
+        raise ValueError(f"Invalid date/time: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.replace(microsecond=0)
+
+
+def normalize_datetime(value):
+    """Returns the canonical string form of an appointment time (None stays None)."""
+    if value is None or value == '':
+        return None
+    return parse_datetime(value).strftime(DATETIME_FORMAT)
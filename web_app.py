@@ -1,6 +1,17 @@
+import availability
+import dashboard
+import export
 import firebase_service
-from flask import Flask, render_template, request, jsonify, abort
+import metrics
+import mysql_mirror
+import mysql_service
+import profiling
+import search_index
+from flask import Flask, render_template, request, jsonify, abort, Response, stream_with_context, g
+import datetime
+import itertools
 import os
+import threading
 
 # Get the absolute path of the directory where this script (web_app.py) is
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -11,6 +22,86 @@ template_dir = os.path.join(basedir, 'templates')
 # Initialize Flask app, telling it the absolute path
 app = Flask(__name__, template_folder=template_dir)
 
+# --- Metrics ---
+# Every route and every firebase_service/mysql_service call is timed (see
+# metrics.py) and exposed at /metrics; METRICS_ENABLED=0 turns this off.
+metrics.instrument(firebase_service, 'firestore')
+metrics.instrument(mysql_service, 'mysql')
+
+
+def _route():
+    """The matched rule ('/api/patients/<string:pid>'), which unlike the path has few distinct values."""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def _start_request_metrics():
+    if metrics.METRICS_ENABLED:
+        metrics.start_request()
+
+
+@app.after_request
+def _finish_request_metrics(response):
+    if metrics.METRICS_ENABLED:
+        metrics.finish_request(_route(), request.method, response.status_code, request.content_length,
+                               None if response.is_streamed else response.content_length)
+    return response
+
+
+# --- Profiling ---
+# Sampled requests (PROFILE_REQUESTS) and requests with a signed X-Profile
+# header run under cProfile; see profiling.py.
+@app.before_request
+def _start_profile():
+    if profiling.should_profile(request.headers.get(profiling.PROFILE_HEADER)):
+        g.profile = profiling.RequestProfile.start()
+
+
+@app.after_request
+def _finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        elapsed = profile.stop()
+        name = profile.save(elapsed, _route(), request.method, request.path, response.status_code)
+        # Whoever asked for the profile is told where it went.
+        if name and profiling.PROFILE_HEADER in request.headers:
+            response.headers['X-Profile-File'] = name
+    return response
+
+
+@app.teardown_request
+def _discard_profile(error):
+    # Reached with the profile still running only if the request failed before after_request.
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.stop()
+
+
+def _warm_up():
+    """Builds in-process state (search index, replica, mirror) in the background at startup."""
+    try:
+        # Apply mirror operations that exited processes left in their spools
+        mysql_mirror.resume()
+        if firebase_service.REPLICA_ENABLED:
+            firebase_service.start_replica()
+        firebase_service.build_search_index()
+        if firebase_service.DASHBOARD_ENABLED:
+            firebase_service.build_dashboard()
+        if firebase_service.SINGLE_PROCESS or firebase_service.REPLICA_ENABLED:
+            # Otherwise bookings and availability are read from Firestore.
+            firebase_service.build_availability()
+    except Exception as e:
+        print(f"Error warming up: {e}")
+
+
+# Backends are initialized on first use, so importing this module doesn't
+# touch the network; WARM_UP_ON_START=0 also leaves the in-process indexes to
+# be built by the first request that needs them (e.g. in tests).
+if os.environ.get('WARM_UP_ON_START', '1').lower() in ('1', 'true', 'yes'):
+    threading.Thread(target=_warm_up, name='warm-up', daemon=True).start()
+    threading.Thread(target=firebase_service.run_dashboard_reconciler, name='dashboard-reconciler',
+                     daemon=True).start()
+
 # --- HTML Page ---
 @app.route('/')
 def index():
@@ -20,15 +111,355 @@ def index():
 # --- API Endpoints ---
 # These are what the HTML page will call to get/save data.
 
-# --- PATIENTS API ---
-@app.route('/api/patients', methods=['GET'])
-def get_patients():
+# Documents serialized per chunk written to a streamed response.
+STREAM_BATCH_SIZE = 100
+
+
+def _encode_stream(docs, fmt, label):
+    """
+    Serializes documents one at a time, grouping them into chunks of
+    STREAM_BATCH_SIZE so a large collection is not written byte by byte.
+    `fmt` is 'ndjson' (one document per line) or 'json' (a chunked array).
+    """
+    separator = '\n' if fmt == 'ndjson' else ','
+    chunk = []
+    count = 0
+    if fmt == 'json':
+        chunk.append('[')
+    try:
+        for doc in docs:
+            if fmt == 'json' and count:
+                chunk.append(separator)
+            chunk.append(app.json.dumps(doc))
+            if fmt == 'ndjson':
+                chunk.append(separator)
+            count += 1
+            if count % STREAM_BATCH_SIZE == 0:
+                yield ''.join(chunk)
+                chunk = []
+    except Exception as e:
+        # Headers are already sent, so the status can no longer change. NDJSON
+        # clients get a final error line; a JSON array is left unterminated.
+        print(f"Error streaming {label}: {e}")
+        if fmt == 'ndjson':
+            chunk.append(app.json.dumps({"error": str(e)}) + '\n')
+        yield ''.join(chunk)
+        return
+    if fmt == 'json':
+        chunk.append(']')
+    yield ''.join(chunk)
+
+
+def _tagged(response, etag):
+    """
+    Attaches a strong ETag and asks clients to revalidate before reusing it.
+    Without ETAGS_ENABLED the tag could miss other processes' writes, so the
+    response gets no validator at all.
+    """
+    if firebase_service.ETAGS_ENABLED:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _not_modified(etag):
+    """Returns a 304 response if the client's If-None-Match matches `etag`."""
+    if firebase_service.ETAGS_ENABLED and request.if_none_match.contains(etag):
+        return _tagged(Response(status=304), etag)
+    return None
+
+
+def _stream_response(collection, fmt, label, etag, filters=()):
+    """Streams a collection straight from Firestore without building a list."""
+    if fmt not in ('ndjson', 'json'):
+        return jsonify({"error": f"Unsupported stream format: {fmt}"}), 400
+    args = request.args
+    try:
+        docs = firebase_service.iter_documents(
+            collection, args.get('limit'), args.get('order_by'), args.get('cursor'), filters)
+        # Read the first document up front so connection errors still get a 500.
+        first = next(docs, None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error getting {label}: {e}")
+        return jsonify({"error": str(e)}), 500
+    if first is not None:
+        docs = itertools.chain([first], docs)
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return _tagged(Response(stream_with_context(_encode_stream(docs, fmt, label)), mimetype=mimetype), etag)
+
+
+def _list_response(collection, fetch, label, filters=()):
+    """
+    Shared body of the collection GET routes. Without paging parameters the
+    response is the plain JSON array the page has always used; with `limit`,
+    `order_by` or `cursor` it is an object carrying `items` and `next_cursor`.
+    `?stream=ndjson` or `?stream=json` streams the documents instead.
+    `filters` are passed on to `fetch` for collections that support them, and
+    `?expand=patient,doctor` embeds referenced documents (see expand_references).
+    Responses carry the collection's version as a strong ETag, and a matching
+    If-None-Match is answered with 304 without reading the collection.
+    """
+    args = request.args
+    try:
+        expand = firebase_service.parse_expand(collection, args.get('expand'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Expanded responses also change when a referenced collection does.
+    referenced = [firebase_service.EXPANDABLE[collection][field] for field in expand]
+    etag = firebase_service.collection_etag([collection] + referenced, request.query_string)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    if 'stream' in args:
+        if expand:
+            return jsonify({"error": "expand is not supported on streamed responses."}), 400
+        return _stream_response(collection, args.get('stream') or 'ndjson', label, etag, filters)
+    paged = any(key in args for key in ('limit', 'order_by', 'cursor'))
+    try:
+        if filters:
+            items = fetch(args.get('limit'), args.get('order_by'), args.get('cursor'), filters=filters)
+        else:
+            items = fetch(args.get('limit'), args.get('order_by'), args.get('cursor'))
+        if expand:
+            firebase_service.expand_references(collection, items, expand)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error getting {label}: {e}")
+        return jsonify({"error": str(e)}), 500
+    if not paged:
+        return _tagged(jsonify(items), etag)
+    return _tagged(jsonify({"items": items, "next_cursor": items.next_cursor}), etag)
+
+# --- BOOTSTRAP API ---
+def _parse_projection(spec):
+    """Parses 'patients:name,contact;doctors:name' into {collection: [fields]}."""
+    fields = {}
+    for part in (spec or '').split(';'):
+        if not part.strip():
+            continue
+        name, sep, field_list = part.partition(':')
+        if not sep:
+            raise ValueError(f"Invalid fields spec: {part}")
+        fields[name.strip()] = field_list
+    return fields
+
+@app.route('/api/bootstrap', methods=['GET'])
+def bootstrap():
+    """
+    Returns several collections in one response, read in parallel.
+    ?collections=patients,doctors picks them (default: all five) and
+    ?fields=patients:name,contact;doctors:name,fee projects them.
+    """
+    args = request.args
+    names = [name for name in args.get('collections', '').split(',') if name] or list(firebase_service.COLLECTIONS)
     try:
-        patients = firebase_service.get_patients()
-        return jsonify(patients)
+        fields = _parse_projection(args.get('fields'))
+        for name in names + list(fields):
+            if name not in firebase_service.COLLECTIONS:
+                raise ValueError(f"Unknown collection: {name}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    etag = firebase_service.collection_etag(names, request.query_string)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        data = firebase_service.fetch_collections(names, fields)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error getting patients: {e}")
+        print(f"Error bootstrapping: {e}")
         return jsonify({"error": str(e)}), 500
+    return _tagged(jsonify(data), etag)
+
+# --- SEARCH API ---
+@app.route('/api/search', methods=['GET'])
+def search():
+    args = request.args
+    try:
+        items, total = firebase_service.search(
+            args.get('type', ''), args.get('q', ''), args.get('limit'), args.get('offset'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error searching: {e}")
+        return jsonify({"error": str(e)}), 500
+    offset = int(args.get('offset') or 0)
+    next_offset = offset + len(items) if offset + len(items) < total else None
+    return jsonify({"items": items, "total": total, "next_offset": next_offset})
+
+# --- DASHBOARD API ---
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    """Dashboard figures from the maintained aggregates; ?date=YYYY-MM-DD picks the day."""
+    if not firebase_service.DASHBOARD_ENABLED:
+        # The aggregates would miss other processes' writes; the page falls
+        # back to computing the figures from its own lists.
+        return jsonify({"error": "The dashboard needs SINGLE_PROCESS=1 or FIRESTORE_REPLICA=1."}), 503
+    # Today's date is part of the tag, since "today" changes without any write.
+    variant = request.query_string + datetime.date.today().isoformat().encode()
+    etag = firebase_service.collection_etag(firebase_service.COLLECTIONS, variant)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        summary = firebase_service.get_dashboard(request.args.get('date'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error getting dashboard: {e}")
+        return jsonify({"error": str(e)}), 500
+    return _tagged(jsonify(summary), etag)
+
+# --- CACHE / POOL / REPLICA STATUS ---
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(firebase_service.cache_stats())
+
+@app.route('/api/mysql/pool/stats', methods=['GET'])
+def get_mysql_pool_stats():
+    try:
+        return jsonify(mysql_service.pool_stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/mysql/mirror/stats', methods=['GET'])
+def get_mysql_mirror_stats():
+    return jsonify(mysql_mirror.stats())
+
+@app.route('/api/replica/status', methods=['GET'])
+def get_replica_status():
+    return jsonify(firebase_service.replica_status())
+
+@app.route('/api/reads/status', methods=['GET'])
+def get_read_routing_status():
+    return jsonify(firebase_service.read_routing_status())
+
+# --- METRICS ---
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Latency histograms and counters in the Prometheus text format."""
+    return Response(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/metrics/slow', methods=['GET'])
+def get_slow_operations():
+    """The most recent routes and backend calls slower than SLOW_OPERATION_SECONDS."""
+    return jsonify(metrics.registry.slow_operations())
+
+@app.route('/api/profiling/status', methods=['GET'])
+def get_profiling_status():
+    return jsonify(profiling.stats())
+
+# --- READINESS ---
+@app.route('/api/ready', methods=['GET'])
+def get_readiness():
+    """
+    200 once Firestore is initialized, 503 until then. MySQL is only a mirror,
+    so its state is reported but not required. ?probe=1 also sends each
+    backend a query and times it.
+    """
+    probe = request.args.get('probe', '').lower() in ('1', 'true', 'yes')
+    firestore_health = firebase_service.health(probe)
+    status = {
+        'ready': firestore_health['ready'],
+        'firestore': firestore_health,
+        'mysql': mysql_service.health(probe),
+        'warm_up': {
+            'search_index': search_index.index.ready,
+            'dashboard': dashboard.aggregates.ready,
+            'availability': availability.index.ready,
+        },
+    }
+    return jsonify(status), 200 if status['ready'] else 503
+
+# --- COUNT API ---
+@app.route('/api/<any(patients, doctors, appointments, billing, inventory):collection>/count', methods=['GET'])
+def count_documents(collection):
+    """Number of documents; appointments take the same from/to/doctor/patient filters as the listing."""
+    args = request.args
+    etag = firebase_service.collection_etag(collection, request.query_string)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        filters = ()
+        if collection == 'appointments':
+            filters = firebase_service.appointment_filters(
+                args.get('from'), args.get('to'), args.get('doctor'), args.get('patient'))
+        count = firebase_service.count_documents(collection, filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error counting {collection}: {e}")
+        return jsonify({"error": str(e)}), 500
+    return _tagged(jsonify({"count": count}), etag)
+
+# --- EXPORT API ---
+@app.route('/api/<any(patients, doctors, appointments, billing, inventory):collection>/export', methods=['GET'])
+def export_collection(collection):
+    """
+    Downloads a whole collection as ?format=csv|ndjson|parquet, optionally
+    ?compression=gzip|zstd, read from ?source=auto|mysql|firestore. The file
+    is streamed as it is read. Appointments take the from/to/doctor/patient filters.
+    """
+    args = request.args
+    fmt = args.get('format', 'csv')
+    compression = args.get('compression', 'none')
+    try:
+        filters = ()
+        if collection == 'appointments':
+            filters = firebase_service.appointment_filters(
+                args.get('from'), args.get('to'), args.get('doctor'), args.get('patient'))
+        chunks = export.export(collection, fmt, compression, args.get('source', 'auto'), filters)
+        # Produce the first chunk up front so connection errors still get a 500.
+        first = next(chunks, b'')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error exporting {collection}: {e}")
+        return jsonify({"error": str(e)}), 500
+    filename, mimetype = export.export_info(collection, fmt, compression)
+    response = Response(stream_with_context(itertools.chain([first], chunks)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+# --- BULK API ---
+@app.route('/api/<any(patients, doctors, appointments, billing, inventory):collection>/bulk', methods=['POST'])
+def bulk_write(collection):
+    """
+    Accepts {"create": [...], "update": [...], "delete": [ids]} (or a bare
+    array of documents to create) and returns a result per item.
+    """
+    data = request.json
+    if isinstance(data, list):
+        data = {'create': data}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "error": "Expected a JSON object or array."}), 400
+    try:
+        results = firebase_service.bulk_write(
+            collection,
+            data.get('create') or [],
+            data.get('update') or [],
+            data.get('delete') or []
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in bulk write to {collection}: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+    errors = sum(1 for result in results if not result.get('success'))
+    # 207 Multi-Status when only some items went through
+    status = 200 if errors == 0 else 207
+    return jsonify({"success": errors == 0, "errors": errors, "results": results}), status
+
+# --- PATIENTS API ---
+@app.route('/api/patients', methods=['GET'])
+def get_patients():
+    return _list_response('patients', firebase_service.get_patients, 'patients')
 
 @app.route('/api/patients', methods=['POST'])
 def add_patient():
@@ -75,15 +506,19 @@ def delete_patient(pid):
         print(f"Error deleting patient: {e}")
         return jsonify({"success": False, "error": str(e)}), 400
 
+@app.route('/api/patients/<string:pid>/timeline', methods=['GET'])
+def get_patient_timeline(pid):
+    """The patient, their appointments (with doctor details) and their bills in one response."""
+    try:
+        return jsonify(firebase_service.get_patient_timeline(pid))
+    except Exception as e:
+        print(f"Error getting patient timeline: {e}")
+        return jsonify({"success": False, "error": str(e)}), 400
+
 # --- DOCTORS API ---
 @app.route('/api/doctors', methods=['GET'])
 def get_doctors():
-    try:
-        doctors = firebase_service.get_doctors()
-        return jsonify(doctors)
-    except Exception as e:
-        print(f"Error getting doctors: {e}")
-        return jsonify({"error": str(e)}), 500
+    return _list_response('doctors', firebase_service.get_doctors, 'doctors')
 
 @app.route('/api/doctors', methods=['POST'])
 def add_doctor():
@@ -127,15 +562,26 @@ def delete_doctor(did):
         print(f"Error deleting doctor: {e}")
         return jsonify({"success": False, "error": str(e)}), 400
 
+@app.route('/api/doctors/<string:did>/availability', methods=['GET'])
+def get_doctor_availability(did):
+    """Working hours, bookings and free intervals of a doctor on ?date=YYYY-MM-DD (default today)."""
+    try:
+        return jsonify(firebase_service.get_availability(did, request.args.get('date')))
+    except Exception as e:
+        print(f"Error getting availability: {e}")
+        return jsonify({"success": False, "error": str(e)}), 400
+
 # --- APPOINTMENTS API ---
 @app.route('/api/appointments', methods=['GET'])
 def get_appointments():
+    """?from=&to= (start inclusive, end exclusive) and ?doctor= / ?patient= narrow the listing."""
+    args = request.args
     try:
-        appointments = firebase_service.get_appointments()
-        return jsonify(appointments)
-    except Exception as e:
-        print(f"Error getting appointments: {e}")
-        return jsonify({"error": str(e)}), 500
+        filters = firebase_service.appointment_filters(
+            args.get('from'), args.get('to'), args.get('doctor'), args.get('patient'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return _list_response('appointments', firebase_service.get_appointments, 'appointments', filters)
 
 @app.route('/api/appointments', methods=['POST'])
 def add_appointment():
@@ -149,6 +595,8 @@ def add_appointment():
         )
         new_appointment = firebase_service.get_appointment(doc_id)
         return jsonify(new_appointment), 201
+    except availability.AppointmentConflict as e:
+        return jsonify({"success": False, "error": str(e), "conflicts": e.conflicts}), 409
     except Exception as e:
         print(f"Error adding appointment: {e}")
         return jsonify({"success": False, "error": str(e)}), 400
@@ -166,6 +614,8 @@ def update_appointment(aid):
         )
         updated_appointment = firebase_service.get_appointment(aid)
         return jsonify(updated_appointment)
+    except availability.AppointmentConflict as e:
+        return jsonify({"success": False, "error": str(e), "conflicts": e.conflicts}), 409
     except Exception as e:
         print(f"Error updating appointment: {e}")
         return jsonify({"success": False, "error": str(e)}), 400
@@ -182,12 +632,7 @@ def delete_appointment(aid):
 # --- BILLING API ---
 @app.route('/api/billing', methods=['GET'])
 def get_billing():
-    try:
-        bills = firebase_service.get_billing()
-        return jsonify(bills)
-    except Exception as e:
-        print(f"Error getting bills: {e}")
-        return jsonify({"error": str(e)}), 500
+    return _list_response('billing', firebase_service.get_billing, 'bills')
 
 @app.route('/api/billing', methods=['POST'])
 def add_bill():
@@ -236,10 +681,8 @@ def delete_bill(bid):
 @app.route('/api/billing/pay/<string:bid>', methods=['POST'])
 def pay_bill(bid):
     try:
-        firebase_service.process_payment(bid)
-        # Fetch the updated bill and all inventory items to send back
-        updated_bill = firebase_service.get_bill(bid)
-        updated_inventory = firebase_service.get_inventory()
+        # Only the bill and the inventory items it changed are sent back
+        updated_bill, updated_inventory = firebase_service.process_payment(bid)
         return jsonify({
             "success": True,
             "updated_bill": updated_bill,
@@ -253,12 +696,7 @@ def pay_bill(bid):
 # --- INVENTORY API ---
 @app.route('/api/inventory', methods=['GET'])
 def get_inventory():
-    try:
-        items = firebase_service.get_inventory()
-        return jsonify(items)
-    except Exception as e:
-        print(f"Error getting inventory: {e}")
-        return jsonify({"error": str(e)}), 500
+    return _list_response('inventory', firebase_service.get_inventory, 'inventory')
 
 @app.route('/api/inventory', methods=['POST'])
 def add_inventory_item():